@@ -12,6 +12,7 @@ from telegram import Bot, ReplyKeyboardRemove
 
 import db_connection
 import responses
+from broadcast import broadcast
 from config import ADMIN_NAME, ADMIN_PW, BOT_TOKEN
 from LogHandler import LogHandler
 
@@ -20,6 +21,9 @@ if "logged_in" not in st.session_state:
 if "delay" not in st.session_state:
     st.session_state["delay"] = 15
 
+# Seconds the bot gets to send its offline announcement and exit after being terminated, before it is killed
+BOT_EXIT_TIMEOUT = 900
+
 
 logging.basicConfig(
     level=logging.INFO,
@@ -43,18 +47,31 @@ async def set_online():
 async def set_offline():
     with st.spinner("Setting bot offline, please wait..."):
         pid = db_connection.get_bot_pid()
-        process = psutil.Process(pid)
-        process.terminate()
+        try:
+            process = psutil.Process(pid)
+            process.terminate()
+
+            # The bot sends the offline announcement itself while stopping, wait until it is done
+            # so that a single process owns the broadcast
+            try:
+                process.wait(BOT_EXIT_TIMEOUT)
+            except psutil.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+        except psutil.NoSuchProcess:
+            logging.warning(f"Bot process {pid} was not running.")
+
         logging.info("Bot turned offline.")
-        time.sleep(st.session_state["delay"])
 
         db_connection.set_bot_status(False, 0)
-        user_ids = db_connection.get_all_user_ids()
-        bot = Bot(token=BOT_TOKEN)
-        for user_id in user_ids:
-            await bot.send_message(
+        async with Bot(token=BOT_TOKEN) as bot:
+            # Resumes the bot's own offline announcement if it was interrupted, or sends it if the bot never did
+            await broadcast(
+                bot,
+                "offline",
+                once=True,
                 reply_markup=ReplyKeyboardRemove(),
-                chat_id=user_id,
                 text=responses.turn_offline,
             )
 
@@ -66,8 +83,7 @@ def reset_database():
         if db_connection.is_online():
             asyncio.run(set_offline())
         else:
-            if os.path.exists("users_database.db"):
-                os.remove("users_database.db")
+            if db_connection.remove_db():
                 logging.info("Database reset.")
             else:
                 logging.warning("Database file not found.")
@@ -148,6 +164,27 @@ def dashboard():
     st.text_area("Current Day Log Output", log_content, height=300)
 
 
+def sticker_sets():
+    st.header("Sticker Sets")
+
+    # Stickers of allowlisted sets skip moderation entirely
+    set_name = st.text_input("Sticker set name")
+    col1, col2 = st.columns(2)
+
+    with col1:
+        if st.button("Allow") and set_name:
+            db_connection.set_sticker_set_allowed(set_name, True)
+            logging.info(f"Sticker set {set_name} allowlisted.")
+
+    with col2:
+        if st.button("Remove") and set_name:
+            db_connection.set_sticker_set_allowed(set_name, False)
+            logging.info(f"Sticker set {set_name} removed from the allowlist.")
+
+    st.subheader("Allowlisted Sets")
+    st.write(db_connection.get_allowed_sticker_sets())
+
+
 def logs():
     st.header("Logs")
 
@@ -175,11 +212,13 @@ def main():
     if st.session_state["logged_in"]:
         sidebar_status()
         st.sidebar.title("Navigation")
-        selection = st.sidebar.radio("Go to", ["Dashboard", "Logs"])
+        selection = st.sidebar.radio("Go to", ["Dashboard", "Sticker Sets", "Logs"])
         logout()
         refresh()
         if selection == "Dashboard":
             dashboard()
+        elif selection == "Sticker Sets":
+            sticker_sets()
         elif selection == "Logs":
             logs()
     else:
@@ -0,0 +1,70 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import db_connection
+from matchmaking import matchmaker
+
+# Every query runs on this single dedicated thread, so the event loop never waits on SQLite.
+# The thread owns one pooled connection and its work queue serializes the writes in submission order.
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+
+
+async def run(func, *args, **kwargs):
+    # Run a blocking database call on the DB thread and await its result
+    loop = asyncio.get_running_loop()
+
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+def to_async(func):
+    # Wrap a blocking db_connection function into a coroutine function running on the DB thread
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run(func, *args, **kwargs)
+
+    return wrapper
+
+
+def shutdown() -> None:
+    # Let queued writes finish, then close the DB thread's connection
+    _executor.submit(db_connection.close_db).result()
+    _executor.shutdown(wait=True)
+
+
+# Async facade of db_connection
+create_db = to_async(db_connection.create_db)
+check_user = to_async(db_connection.check_user)
+insert_user = to_async(db_connection.insert_user)
+set_bot_status = to_async(db_connection.set_bot_status)
+get_bot_pid = to_async(db_connection.get_bot_pid)
+is_online = to_async(db_connection.is_online)
+get_all_user_ids = to_async(db_connection.get_all_user_ids)
+get_user_status = to_async(db_connection.get_user_status)
+set_user_status = to_async(db_connection.set_user_status)
+set_user_start_bot_time = to_async(db_connection.set_user_start_bot_time)
+set_credit = to_async(db_connection.set_credit)
+get_user_credit = to_async(db_connection.get_user_credit)
+is_eligible_to_chat = to_async(db_connection.is_eligible_to_chat)
+get_partner_id = to_async(db_connection.get_partner_id)
+check_user_duration = to_async(db_connection.check_user_duration)
+check_chat_duration = to_async(db_connection.check_chat_duration)
+get_expired_user_ids = to_async(db_connection.get_expired_user_ids)
+uncouple = to_async(db_connection.uncouple)
+end_session = to_async(db_connection.end_session)
+set_user_blocked = to_async(db_connection.set_user_blocked)
+start_broadcast = to_async(db_connection.start_broadcast)
+get_broadcast_recipients = to_async(db_connection.get_broadcast_recipients)
+record_broadcast_deliveries = to_async(db_connection.record_broadcast_deliveries)
+finish_broadcast = to_async(db_connection.finish_broadcast)
+get_media_score = to_async(db_connection.get_media_score)
+set_media_score = to_async(db_connection.set_media_score)
+is_sticker_set_allowed = to_async(db_connection.is_sticker_set_allowed)
+get_media_stats = to_async(db_connection.get_media_stats)
+retrieve_users_number = to_async(db_connection.retrieve_users_number)
+reset_users_status = to_async(db_connection.reset_users_status)
+get_cache_stats = to_async(db_connection.get_cache_stats)
+
+# Async facade of the matchmaker, pairing also runs on the DB thread
+search = to_async(matchmaker.search)
+cancel_search = to_async(matchmaker.cancel)
@@ -0,0 +1,221 @@
+import asyncio
+import itertools
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Update, User
+from telegram.error import Forbidden, RetryAfter
+from telegram.ext import Application, ApplicationBuilder, BaseUpdateProcessor, ExtBot, TypeHandler
+
+import db_connection
+import main
+from matchmaking import matchmaker
+
+# Seconds every Bot API call takes
+API_LATENCY = 0.02
+
+_update_ids = itertools.count(1)
+
+
+class FakeFile:
+    """
+    Result of FakeBot.get_file, downloaded from memory. The content is either bytes or a function
+    returning a fresh body on every download, like an HTTP response.
+    """
+
+    def __init__(self, bot: "FakeBot", content):
+        self.bot = bot
+        self.content = content
+
+    def body(self) -> bytes:
+        data = self.content() if callable(self.content) else self.content
+        with self.bot._unfrozen():
+            self.bot.downloaded_bytes += len(data)
+
+        return data
+
+    async def download_as_bytearray(self) -> bytearray:
+        await asyncio.sleep(self.bot.latency)
+
+        return bytearray(self.body())
+
+    async def download_to_memory(self, out) -> None:
+        await asyncio.sleep(self.bot.latency)
+        out.write(self.body())
+
+
+class FakeBot(ExtBot):
+    """
+    Local stand-in for the bot: every Bot API call takes a fixed latency, files are served from memory,
+    sent messages, relayed (copied) messages and downloads are recorded. Optionally, some users blocked
+    the bot and messages sent over rate_limit per second get a flood-wait error, like Telegram's.
+    """
+
+    def __init__(
+        self, latency: float = API_LATENCY, files: dict = None, blocked: set = None, rate_limit: float = None
+    ):
+        super().__init__("123456:harness")
+        with self._unfrozen():
+            self.latency = latency
+            self.files = files if files is not None else {}
+            self.blocked = blocked or set()
+            self.rate_limit = rate_limit
+            self.sent: list[tuple[int, str]] = []
+            self.relayed: dict[int, float] = {}
+            self.downloads = 0
+            self.downloaded_bytes = 0
+            self.flood_errors = 0
+            self._window: list[float] = []
+
+    async def get_me(self, *args, **kwargs) -> User:
+        self._bot_user = User(123456, "Harness", True, username="harness_bot")
+
+        return self._bot_user
+
+    async def send_message(self, chat_id, text, *args, **kwargs) -> None:
+        await asyncio.sleep(self.latency)
+
+        # Sliding one-second window of accepted messages
+        now = time.monotonic()
+        if self.rate_limit:
+            self._window = [t for t in self._window if now - t < 1.0]
+            if len(self._window) >= self.rate_limit:
+                with self._unfrozen():
+                    self.flood_errors += 1
+                raise RetryAfter(1)
+
+        if chat_id in self.blocked:
+            raise Forbidden("Forbidden: bot was blocked by the user")
+
+        if self.rate_limit:
+            self._window.append(now)
+        self.sent.append((chat_id, text))
+
+    async def copy_message(self, chat_id, from_chat_id, message_id, *args, **kwargs) -> None:
+        await asyncio.sleep(self.latency)
+        self.relayed[message_id] = time.perf_counter()
+
+    async def get_file(self, file_id, *args, **kwargs) -> FakeFile:
+        await asyncio.sleep(self.latency)
+        with self._unfrozen():
+            self.downloads += 1
+
+        return FakeFile(self, self.files[getattr(file_id, "file_id", file_id)])
+
+
+def make_update(bot: FakeBot, user_id: int, text: str = None, **fields) -> Update:
+    # Private chat message, commands get their bot_command entity like Telegram sends them
+    update_id = next(_update_ids)
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"},
+        **fields,
+    }
+    if text is not None:
+        message["text"] = text
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+
+    return Update.de_json({"update_id": update_id, "message": message}, bot)
+
+
+def make_photo_update(bot: FakeBot, user_id: int, file_id: str, data: bytes, side: int) -> Update:
+    # Photo message with a single size, served by the bot from data
+    bot.files[file_id] = data
+
+    return make_update(
+        bot,
+        user_id,
+        photo=[{"file_id": file_id, "file_unique_id": file_id, "width": side, "height": side, "file_size": len(data)}],
+    )
+
+
+class Harness:
+    """
+    The bot's Application on a FakeBot and a temporary database with chatting pairs of users.
+    Updates go through the update queue and the update processor like polling feeds them,
+    the time each update waited and took until fully processed is recorded.
+    """
+
+    def __init__(self, pairs: int, update_processor: BaseUpdateProcessor = None, latency: float = API_LATENCY):
+        self.bot = FakeBot(latency)
+        self.users = list(range(1, pairs * 2 + 1))
+        self.queued: dict[int, float] = {}
+        self.processed: dict[int, float] = {}
+        self.errors: list[BaseException] = []
+        self._tmp = tempfile.TemporaryDirectory()
+
+        # Fresh database, every thread reconnects to it
+        db_connection.DB_PATH = os.path.join(self._tmp.name, "harness.db")
+        db_connection.close_db()
+        db_connection.user_cache.clear()
+        db_connection.media_cache.clear()
+        db_connection.create_db()
+
+        # Users who already passed the captcha, paired two by two
+        for user_id in self.users:
+            db_connection.insert_user(user_id)
+            db_connection.set_user_start_bot_time(user_id)
+        for user_id in self.users:
+            matchmaker.search(user_id)
+
+        self.application: Application = main.build_application(
+            ApplicationBuilder().bot(self.bot).updater(None), update_processor
+        )
+
+        # Runs after the bot's handlers (group 0) are done with the update
+        self.application.add_handler(TypeHandler(Update, self._record), group=1)
+        self.application.add_error_handler(self._error)
+
+    async def _record(self, update: Update, context) -> None:
+        self.processed[update.update_id] = time.perf_counter()
+
+    async def _error(self, update: object, context) -> None:
+        self.errors.append(context.error)
+
+    async def __aenter__(self) -> "Harness":
+        await self.application.initialize()
+        await self.application.start()
+
+        # Every user enters the conversation, like after a restart
+        await self.feed([make_update(self.bot, user_id, "/start") for user_id in self.users])
+        self.bot.sent.clear()
+
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.application.stop()
+        await self.application.shutdown()
+        db_connection.close_db()
+        self._tmp.cleanup()
+
+    async def put(self, update: Update) -> None:
+        # Queue one update, as polling does
+        self.queued[update.update_id] = time.perf_counter()
+        await self.application.update_queue.put(update)
+
+    async def feed(self, updates: list[Update], interval: float = 0.0) -> None:
+        # Queue the updates (interval seconds apart) and wait until every queued update is processed
+        for update in updates:
+            await self.put(update)
+            if interval:
+                await asyncio.sleep(interval)
+
+        await self.application.update_queue.join()
+
+    def latencies(self, updates: list[Update]) -> list[float]:
+        # Seconds from queueing to the end of processing, per update
+        return [self.processed[update.update_id] - self.queued[update.update_id] for update in updates]
+
+
+def percentile(latencies: list[float], p: float) -> float:
+    # Milliseconds
+    latencies = sorted(latencies)
+
+    return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1e3
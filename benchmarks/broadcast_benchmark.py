@@ -0,0 +1,123 @@
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram.error import Forbidden, RetryAfter
+
+import async_db
+import broadcast
+import db_connection
+from bot_harness import FakeBot
+
+USERS = 2000
+BLOCKED_RATIO = 0.05
+
+# Bot API latency, and Telegram's global limit of messages per second
+API_LATENCY = 0.05
+RATE_LIMIT = 30.0
+
+
+def make_bot(blocked: set) -> FakeBot:
+    return FakeBot(API_LATENCY, blocked=blocked, rate_limit=RATE_LIMIT)
+
+
+async def legacy_broadcast(bot: FakeBot, user_ids: list) -> None:
+    # Previous behaviour: one awaited message after the other, stopping at the first error
+    for user_id in user_ids:
+        await bot.send_message(chat_id=user_id, text="online")
+
+
+async def interrupted_broadcast(bot: FakeBot, after: float, kind: str = "online") -> None:
+    # Start a broadcast and cancel it midway, like a bot restart
+    task = asyncio.create_task(broadcast.broadcast(bot, kind, text=kind))
+    await asyncio.sleep(after)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+async def shared_offline(bot: FakeBot) -> None:
+    # Previous shutdown: the bot and the dashboard send the offline announcement at the same time
+    await asyncio.gather(
+        broadcast.broadcast(bot, "offline", text="offline"),
+        broadcast.broadcast(bot, "offline", text="offline"),
+    )
+
+
+async def handed_over_offline(bot: FakeBot, interrupt_after: float) -> None:
+    # Shutdown: the bot sends the offline announcement (killed midway if interrupt_after is set),
+    # the dashboard only takes over once the bot process is gone
+    if interrupt_after:
+        await interrupted_broadcast(bot, interrupt_after, "offline")
+    else:
+        await broadcast.broadcast(bot, "offline", text="offline")
+
+    await broadcast.broadcast(bot, "offline", once=True, text="offline")
+
+
+def report(name: str, bot: FakeBot, elapsed: float) -> bool:
+    # True if every user got the message at most once without hitting flood control
+    duplicates = len(bot.sent) - len(set(bot.sent))
+    print(
+        f"{name}: {elapsed:.1f} s, {len(bot.sent)} sent, flood errors {bot.flood_errors}, duplicates {duplicates}"
+    )
+
+    return not duplicates and not bot.flood_errors
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        db_connection.DB_PATH = os.path.join(tmp, "bench.db")
+        db_connection.create_db()
+        for user_id in range(USERS):
+            db_connection.insert_user(user_id)
+
+        user_ids = db_connection.get_all_user_ids()
+        blocked = set(random.Random(0).sample(user_ids, int(USERS * BLOCKED_RATIO)))
+
+        # Legacy loop
+        bot = make_bot(blocked)
+        try:
+            asyncio.run(legacy_broadcast(bot, user_ids))
+        except (Forbidden, RetryAfter) as e:
+            print(f"legacy loop stopped after {len(bot.sent)} messages: {type(e).__name__}")
+        print(f"legacy loop, even without errors: ~{USERS * bot.latency:.0f} s blocking post_init")
+
+        # Broadcast engine, interrupted once and resumed
+        bot = make_bot(blocked)
+        start = time.perf_counter()
+        asyncio.run(interrupted_broadcast(bot, after=10))
+        interrupted_at = len(bot.sent)
+        outcomes = asyncio.run(broadcast.broadcast(bot, "online", text="online"))
+        elapsed = time.perf_counter() - start
+
+        duplicates = len(bot.sent) - len(set(bot.sent))
+        print(
+            f"broadcast engine: {elapsed:.1f} s, {len(bot.sent) / elapsed:.1f} msg/s, "
+            f"interrupted after {interrupted_at} messages, outcomes {outcomes}, "
+            f"flood errors {bot.flood_errors}, duplicates {duplicates}"
+        )
+        print(f"recipients left for the next broadcast: {len(db_connection.get_all_user_ids())}")
+        passed = not duplicates and not bot.flood_errors
+
+        # Offline announcement at shutdown, a single owner at a time
+        bot = make_bot(blocked)
+        start = time.perf_counter()
+        asyncio.run(shared_offline(bot))
+        report("offline, bot and dashboard at once (previous)", bot, time.perf_counter() - start)
+
+        for name, interrupt_after in (("offline, sent by the bot", 0), ("offline, bot killed midway", 10)):
+            bot = make_bot(blocked)
+            start = time.perf_counter()
+            asyncio.run(handed_over_offline(bot, interrupt_after))
+            passed &= report(name, bot, time.perf_counter() - start)
+
+        async_db.shutdown()
+
+        # A duplicate or a flood error is a failure of the broadcast engine
+        if not passed:
+            sys.exit(1)
@@ -0,0 +1,50 @@
+import csv
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Run from the repository root, the model is loaded from model-creation/model-export
+import bulk_moderation
+import model_handler
+from text_preprocess import text_preprocessing
+
+WORKERS = (1, 2, 4)
+
+
+def load_rows() -> list[dict]:
+    with open(os.path.join(ROOT, "model-creation/data/test.csv"), encoding="utf-8") as f:
+        return list(csv.DictReader(f))
+
+
+def one_by_one(rows: list[dict]) -> list[bool]:
+    # Previous path: preprocess and score every message on its own
+    return [model_handler.predict_toxic_text(text_preprocessing.preprocess_text(row["Text"])) for row in rows]
+
+
+def streamed(rows: list[dict], workers: int) -> list[bool]:
+    # Chunked preprocessing and batched inference
+    return [row["toxic"] for row in bulk_moderation.score_rows(iter(rows), "Text", workers=workers)]
+
+
+if __name__ == "__main__":
+    rows = load_rows()
+    model_handler.load_models()
+    text_preprocessing.load_resources()
+    print(f"{len(rows)} texts from model-creation/data/test.csv")
+
+    start = time.perf_counter()
+    reference = one_by_one([dict(row) for row in rows])
+    elapsed = time.perf_counter() - start
+    print(f"one by one          {len(rows) / elapsed:8.0f} msg/s")
+
+    # Stem caches are warm for every run after the first, clear them for a fair comparison
+    for workers in WORKERS:
+        text_preprocessing.stem_word.cache_clear()
+        start = time.perf_counter()
+        verdicts = streamed([dict(row) for row in rows], workers)
+        elapsed = time.perf_counter() - start
+        mismatches = sum(a != b for a, b in zip(verdicts, reference))
+        print(f"streamed, {workers} worker(s) {len(rows) / elapsed:8.0f} msg/s, {mismatches} verdict mismatches")
@@ -0,0 +1,99 @@
+import asyncio
+import io
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+# Run from the repository root, the models are loaded from model-creation/model-export
+import async_db
+import db_connection
+import model_handler
+import moderation_pool
+import text_batcher
+import toxic_handler
+from bot_harness import FakeBot
+
+MESSAGES = 20
+
+# Simulated Telegram API latency of get_file plus the download, half each
+DOWNLOAD_LATENCY = 0.25
+
+# Simulated forward pass of the full-size IndoBERT model (the local test model is much smaller)
+TEXT_LATENCY = 0.08
+
+
+def make_message(i: int, data: bytes) -> SimpleNamespace:
+    # Captioned photo with Telegram's usual sizes, unique so the verdict store never answers
+    photo = [
+        SimpleNamespace(file_id=f"{i}-{side}", file_unique_id=f"{i}-{side}", file_size=len(data), width=side, height=side)
+        for side in (90, 320, 800)
+    ]
+
+    return SimpleNamespace(
+        text=None,
+        photo=photo,
+        caption="liburan ke pantai bersama keluarga, seru banget",
+        media_group_id=None,
+        animation=None,
+        sticker=None,
+    )
+
+
+async def sequential(context, message) -> bool:
+    # Previous order: the caption first, then the photo
+    if await toxic_handler.classify_text(message.caption):
+        return True
+
+    return await toxic_handler.classify_photo(context, message.photo)
+
+
+async def replay(moderate, offset: int, data: bytes) -> float:
+    # Mean latency per captioned photo in ms
+    # One JPEG served for every photo size
+    context = SimpleNamespace(bot=FakeBot(DOWNLOAD_LATENCY / 2, defaultdict(lambda: data)))
+    start = time.perf_counter()
+    for i in range(MESSAGES):
+        await moderate(context, make_message(offset + i, data))
+
+    return (time.perf_counter() - start) / MESSAGES * 1e3
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        db_connection.DB_PATH = os.path.join(tmp, "bench.db")
+        db_connection.create_db()
+        toxic_handler.load_moderation()
+
+        # Worst case is a clean message, every part runs to completion (the local test model flags anything)
+        model_handler.threshold_tensor.fill_(1.1)
+        model_handler.thresholds.update(dict.fromkeys(model_handler.thresholds, 1.1))
+        toxic_handler.NSFW_THRESHOLD = 1.1
+
+        def slow_text_model(texts: list[str]) -> tuple[list[bool], list[dict]]:
+            time.sleep(TEXT_LATENCY)
+            return model_handler.predict_toxic_text_scores(texts)
+
+        text_batcher.predict_toxic_text_scores = slow_text_model
+        text_batcher.text_batcher.cache.maxsize = 0  # Every caption is new
+
+        data = io.BytesIO()
+        Image.effect_noise((320, 320), 60).convert("RGB").save(data, "JPEG")
+
+        for offset, (name, moderate) in enumerate(
+            (("sequential", sequential), ("concurrent", toxic_handler.predict_toxicity))
+        ):
+            latency = asyncio.run(replay(moderate, offset * MESSAGES, data.getvalue()))
+            print(
+                f"{name:<11} {latency:7.1f} ms per captioned photo "
+                f"(download {DOWNLOAD_LATENCY * 1e3:.0f} ms, text model {TEXT_LATENCY * 1e3:.0f} ms)"
+            )
+
+        moderation_pool.shutdown()
+        async_db.shutdown()
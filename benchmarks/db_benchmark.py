@@ -0,0 +1,68 @@
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db_connection
+from matchmaking import matchmaker
+
+MESSAGES = 5000
+
+
+def legacy_query(query: str, params: tuple) -> tuple:
+    # Previous behaviour: open a fresh connection for every call
+    conn = sqlite3.connect(db_connection.DB_PATH)
+    c = conn.cursor()
+    c.execute(query, params)
+    row = c.fetchone()
+    conn.close()
+
+    return row
+
+
+def legacy_message(user_id: int) -> None:
+    # DB work done by handle_message and update_keyboard for a single relayed message
+    legacy_query("SELECT status FROM users WHERE user_id=?", (user_id,))
+    legacy_query("SELECT user_id FROM users WHERE partner_id=?", (user_id,))
+    legacy_query("SELECT status FROM users WHERE user_id=?", (user_id,))
+
+
+def pooled_message(user_id: int) -> None:
+    db_connection.get_user_status(user_id)
+    db_connection.get_partner_id(user_id)
+    db_connection.get_user_status(user_id)
+
+
+def seed() -> None:
+    # Create a database with a single coupled pair
+    db_connection.create_db()
+    for user_id in (1, 2):
+        db_connection.insert_user(user_id)
+        matchmaker.search(user_id)
+
+
+def measure(func) -> float:
+    start = time.perf_counter()
+    for _ in range(MESSAGES):
+        func(1)
+
+    return (time.perf_counter() - start) / MESSAGES * 1e6
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        db_connection.DB_PATH = os.path.join(tmp, "bench.db")
+        seed()
+
+        legacy = measure(legacy_message)
+        pooled = measure(pooled_message)
+
+        print(f"per-message DB cost, legacy open/close: {legacy:8.1f} us")
+        print(f"per-message DB cost, pooled WAL:        {pooled:8.1f} us")
+        print(f"speedup: {legacy / pooled:.1f}x")
+        print(f"users cache: {db_connection.get_cache_stats()}")
+
+        db_connection.close_db()
@@ -0,0 +1,64 @@
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db_connection
+from UserStatus import UserStatus
+
+USER_COUNTS = (1_000, 10_000, 100_000, 1_000_000)
+LOOKUPS = 5000
+
+
+def seed(user_count: int) -> None:
+    # Bulk insert users, one pair in ten is coupled and one user in a hundred is searching
+    conn, c = db_connection.connect_to_db()
+    rows = []
+    for user_id in range(user_count):
+        if user_id % 20 < 2:
+            status, partner_id = UserStatus.COUPLED, user_id ^ 1
+        elif user_id % 100 == 50:
+            status, partner_id = UserStatus.IN_SEARCH, None
+        else:
+            status, partner_id = UserStatus.IDLE, None
+        rows.append((user_id, None, None, 100, status, partner_id))
+
+    with conn:
+        c.executemany(
+            "INSERT INTO users (user_id, start_bot_time, start_chat_time, credit, status, partner_id) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+
+
+def measure(user_count: int) -> tuple[float, float]:
+    # Mean latency of the per-message lookups (status + partner) and of the dashboard counters
+    start = time.perf_counter()
+    for i in range(LOOKUPS):
+        user_id = (i * 20) % user_count
+        db_connection.get_user_status(user_id)
+        db_connection.get_partner_id(user_id)
+    per_message = (time.perf_counter() - start) / LOOKUPS * 1e6
+
+    start = time.perf_counter()
+    for _ in range(10):
+        db_connection.retrieve_users_number()
+    counters = (time.perf_counter() - start) / 10 * 1e3
+
+    return per_message, counters
+
+
+if __name__ == "__main__":
+    print(f"{'users':>10} {'per-message lookup':>20} {'users counters':>16}")
+    for user_count in USER_COUNTS:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_connection.DB_PATH = os.path.join(tmp, "bench.db")
+            db_connection.create_db()
+            seed(user_count)
+
+            per_message, counters = measure(user_count)
+            print(f"{user_count:>10} {per_message:>17.1f} us {counters:>13.2f} ms")
+
+            db_connection.close_db()
@@ -0,0 +1,82 @@
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import async_db
+import db_connection
+
+USERS = 200
+WRITES_PER_USER = 20
+LOCK_HOLD = 0.02  # Seconds another process keeps the write lock, like a busy dashboard
+
+
+def hold_write_lock(stop: threading.Event) -> None:
+    # Another connection repeatedly grabs the write lock
+    conn = sqlite3.connect(db_connection.DB_PATH, isolation_level=None)
+    while not stop.is_set():
+        conn.execute("BEGIN IMMEDIATE")
+        time.sleep(LOCK_HOLD)
+        conn.execute("COMMIT")
+        time.sleep(LOCK_HOLD)
+    conn.close()
+
+
+async def monitor_lag(stop: asyncio.Event, lags: list) -> None:
+    # Measure how late a 1 ms timer fires, i.e. how long the event loop was blocked
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append(time.perf_counter() - start - 0.001)
+
+
+async def sync_user(user_id: int) -> None:
+    for _ in range(WRITES_PER_USER):
+        db_connection.set_credit(user_id, -1)
+        db_connection.get_user_status(user_id)
+        await asyncio.sleep(0)
+
+
+async def async_user(user_id: int) -> None:
+    for _ in range(WRITES_PER_USER):
+        await async_db.set_credit(user_id, -1)
+        await async_db.get_user_status(user_id)
+
+
+async def measure(user) -> tuple[float, float, float]:
+    lags = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(monitor_lag(stop, lags))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user(user_id) for user_id in range(USERS)))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await monitor
+    lags.sort()
+
+    return elapsed, lags[int(len(lags) * 0.99)] * 1e3, lags[-1] * 1e3
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        db_connection.DB_PATH = os.path.join(tmp, "bench.db")
+        db_connection.create_db()
+        for user_id in range(USERS):
+            db_connection.insert_user(user_id)
+
+        stop_lock = threading.Event()
+        threading.Thread(target=hold_write_lock, args=(stop_lock,), daemon=True).start()
+
+        for name, user in (("sync db_connection", sync_user), ("async_db facade", async_user)):
+            elapsed, p99, worst = asyncio.run(measure(user))
+            print(f"{name:<20} total {elapsed:6.2f} s, loop lag p99 {p99:7.2f} ms, max {worst:7.2f} ms")
+
+        stop_lock.set()
+        async_db.shutdown()
@@ -0,0 +1,62 @@
+import asyncio
+import io
+import os
+import resource
+import subprocess
+import sys
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bot_harness import FakeBot
+
+# Burst of concurrent animations, a few of them above the animation size limit
+MESSAGES = 32
+FILE_SIZE = 8 * 2**20
+OVERSIZED = 4
+
+
+async def legacy_ingest(context, media):
+    # Previous get_to_memory: BytesIO download, read() copy, second BytesIO and getvalue()
+    file = await context.bot.get_file(media)
+    out = io.BytesIO()
+    await file.download_to_memory(out)
+    out.seek(0)
+
+    return io.BytesIO(out.read()).getvalue()
+
+
+async def burst(ingest) -> int:
+    # Every message holds its buffer until the whole burst is downloaded, like while waiting for inference
+    media = [
+        SimpleNamespace(file_id=str(i), file_unique_id=str(i), file_size=FILE_SIZE * (4 if i < OVERSIZED else 1))
+        for i in range(MESSAGES)
+    ]
+    # Every download returns a fresh body, like an HTTP response
+    files = {item.file_id: lambda size=item.file_size: os.urandom(size) for item in media}
+    context = SimpleNamespace(bot=FakeBot(0.005, files))
+    buffers = await asyncio.gather(*(ingest(context, item) for item in media))
+    del buffers
+
+    return context.bot.downloads
+
+
+def run(name: str) -> None:
+    # Measured in a fresh process, peak RSS cannot be reset
+    import toxic_handler
+
+    ingest = legacy_ingest if name == "legacy" else (lambda context, item: toxic_handler.get_to_memory(context, item, "animation"))
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    downloads = asyncio.run(burst(ingest))
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+    print(f"{name:<7} {downloads} downloads, peak RSS +{peak / 1024:.0f} MiB")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        run(sys.argv[1])
+    else:
+        print(f"{MESSAGES} concurrent animations of {FILE_SIZE / 2**20:.0f} MiB, {OVERSIZED} of them 4x larger")
+        for name in ("legacy", "ingest"):
+            subprocess.run([sys.executable, os.path.abspath(__file__), name], check=True)
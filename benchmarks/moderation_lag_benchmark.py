@@ -0,0 +1,106 @@
+import asyncio
+import csv
+import io
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+from PIL import Image
+from telegram.ext import SimpleUpdateProcessor
+
+# Run from the repository root, the models are loaded from their usual locations
+import model_handler
+import moderation_pool
+import toxic_handler
+from bot_harness import Harness, make_photo_update, make_update, percentile
+from update_processor import PerUserUpdateProcessor
+
+PAIRS = 8
+
+# Users sending heavy photos, and how many each
+PHOTO_USERS = 4
+PHOTOS_PER_USER = 4
+IMAGE_SIDE = 2560
+
+# The other users chat with plain texts, one every TEXT_INTERVAL seconds
+TEXTS_PER_USER = 20
+TEXT_INTERVAL = 0.05
+
+
+def heavy_image() -> bytes:
+    # Large noisy photo, expensive to decode and resize
+    pixels = np.random.default_rng(0).integers(0, 255, (IMAGE_SIDE, IMAGE_SIDE, 3), dtype=np.uint8)
+    out = io.BytesIO()
+    Image.fromarray(pixels).save(out, format="JPEG", quality=95)
+
+    return out.getvalue()
+
+
+def load_texts() -> list[str]:
+    with open(os.path.join(ROOT, "model-creation/data/test.csv"), encoding="utf-8") as f:
+        return [row["Text"] for row in csv.DictReader(f)]
+
+
+async def chat(update_processor, image: bytes, texts: list[str]) -> tuple[list[float], list[float]]:
+    # Heavy photos arrive first, then the other chats keep texting while they are classified
+    async with Harness(PAIRS, update_processor) as harness:
+        photo_users, text_users = harness.users[:PHOTO_USERS], harness.users[PHOTO_USERS:]
+        photos = [
+            make_photo_update(harness.bot, user_id, f"photo-{user_id}-{i}", image, IMAGE_SIDE)
+            for i in range(PHOTOS_PER_USER)
+            for user_id in photo_users
+        ]
+        messages = [
+            [make_update(harness.bot, user_id, texts[user_id * TEXTS_PER_USER + i]) for i in range(TEXTS_PER_USER)]
+            for user_id in text_users
+        ]
+
+        async def send(updates: list) -> None:
+            for update in updates:
+                await harness.put(update)
+                await asyncio.sleep(TEXT_INTERVAL)
+
+        for update in photos:
+            await harness.put(update)
+        await asyncio.gather(*(send(updates) for updates in messages))
+        await harness.application.update_queue.join()
+
+        sent = photos + [update for updates in messages for update in updates]
+        relayed = sum(update.message.message_id in harness.bot.relayed for update in sent)
+        if harness.errors or relayed != len(sent):
+            sys.exit(f"{relayed}/{len(sent)} messages relayed, errors: {harness.errors[:3]}")
+
+        return harness.latencies([update for updates in messages for update in updates]), harness.latencies(photos)
+
+
+if __name__ == "__main__":
+    image = heavy_image()
+    texts = load_texts()
+    toxic_handler.load_moderation()
+    toxic_handler.moderation_ready.set()
+
+    # Every message is relayed whatever the models say, so each pair keeps chatting
+    model_handler.threshold_tensor = model_handler.threshold_tensor + 1
+    model_handler.thresholds = {category: threshold + 1 for category, threshold in model_handler.thresholds.items()}
+    toxic_handler.NSFW_THRESHOLD = 2.0
+
+    scenarios = (
+        ("sequential updates", SimpleUpdateProcessor(1)),
+        ("per-user concurrent", PerUserUpdateProcessor()),
+    )
+    print(
+        f"{PAIRS * 2 - PHOTO_USERS} users texting while {PHOTO_USERS * PHOTOS_PER_USER} "
+        f"{IMAGE_SIDE}x{IMAGE_SIDE} photos are moderated"
+    )
+    for name, update_processor in scenarios:
+        text_latencies, photo_latencies = asyncio.run(chat(update_processor, image, texts))
+        print(
+            f"{name:<20} text handled in p50 {percentile(text_latencies, 0.50):8.1f} ms, "
+            f"p99 {percentile(text_latencies, 0.99):8.1f} ms, max {max(text_latencies) * 1e3:8.1f} ms; "
+            f"last photo after {max(photo_latencies):5.1f} s"
+        )
+
+    moderation_pool.shutdown()
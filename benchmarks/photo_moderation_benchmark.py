@@ -0,0 +1,96 @@
+import asyncio
+import io
+import os
+import random
+import sys
+import tempfile
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+# Run from the repository root, the models are loaded from model-creation/model-export
+import async_db
+import db_connection
+import moderation_pool
+import toxic_handler
+from bot_harness import FakeBot
+
+PHOTOS = 20
+
+# Long side of the sizes Telegram sends for a photo, smallest first
+PHOTO_SIDES = (90, 320, 800, 1280)
+
+
+def make_photo(seed: int) -> list[tuple[SimpleNamespace, bytes]]:
+    # A random 4:3 picture with its JPEG encoding at every Telegram resolution
+    rng = random.Random(seed)
+    image = Image.effect_noise((1280, 960), rng.uniform(20, 120)).convert("RGB")
+    image = Image.blend(image, Image.new("RGB", image.size, tuple(rng.randrange(256) for _ in range(3))), 0.5)
+
+    sizes = []
+    for side in PHOTO_SIDES:
+        resized = image.resize((side, side * 3 // 4))
+        data = io.BytesIO()
+        resized.save(data, "JPEG", quality=85)
+        photo = SimpleNamespace(
+            file_id=f"{seed}-{side}",
+            file_unique_id=f"{seed}-{side}",
+            file_size=data.tell(),
+            width=side,
+            height=side * 3 // 4,
+        )
+        sizes.append((photo, data.getvalue()))
+
+    return sizes
+
+
+async def legacy_photo(context, photos) -> bool:
+    # Previous behaviour: download and classify every size until one is toxic
+    for photo in photos:
+        data = await toxic_handler.get_to_memory(context, photo, "photo")
+        if await moderation_pool.run(toxic_handler.classify_image, data, default=False):
+            return True
+
+    return False
+
+
+async def replay(moderate, photos: list) -> tuple[FakeBot, int]:
+    # Moderate every fixture photo once, counting the inference calls sent to the pool
+    bot = FakeBot(0.0, {photo.file_id: data for sizes in photos for photo, data in sizes})
+    context = SimpleNamespace(bot=bot)
+    inferences = 0
+    run = moderation_pool.run
+
+    async def counting_run(func, *args, **kwargs):
+        nonlocal inferences
+        inferences += 1
+        return await run(func, *args, **kwargs)
+
+    moderation_pool.run = counting_run
+    try:
+        for sizes in photos:
+            await moderate(context, [photo for photo, _ in sizes])
+    finally:
+        moderation_pool.run = run
+
+    return bot, inferences
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        db_connection.DB_PATH = os.path.join(tmp, "bench.db")
+        db_connection.create_db()
+        photos = [make_photo(seed) for seed in range(PHOTOS)]
+        toxic_handler.load_moderation()
+
+        for name, moderate in (("every size", legacy_photo), ("resolution-aware", toxic_handler.classify_photo)):
+            bot, inferences = asyncio.run(replay(moderate, photos))
+            print(
+                f"{name:<17} per photo: {bot.downloads / PHOTOS:4.2f} downloads, "
+                f"{bot.downloaded_bytes / PHOTOS / 1024:7.1f} KiB, {inferences / PHOTOS:4.2f} inferences"
+            )
+
+        moderation_pool.shutdown()
+        async_db.shutdown()
@@ -0,0 +1,80 @@
+import csv
+import glob
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from text_preprocess import text_preprocessing
+
+# Text columns of the datasets in model-creation/data
+TEXT_COLUMNS = ("Text", "Tweet", "original_text", "processed_text")
+
+# Chat messages the datasets lack: emoji, links, hashtags, unusual whitespace and letters
+EXTRA_TEXTS = (
+    "",
+    "   ",
+    "wkwk 😂😂 #santai https://t.co/abc www.contoh.com",
+    "Halo\u00a0kak,\tapa\u200bkabar?? 🙏🏻",
+    "abis ak gk tau -_- ajep-ajep e.g. c/o",
+    "\u212aota İstanbul straße naïve café",
+    "xhttpabc yyywww.zz #️⃣ 1️⃣",
+)
+
+
+def load_texts() -> list[str]:
+    # Every text of every dataset, raw tweets and already preprocessed ones
+    texts = []
+    for path in sorted(glob.glob(os.path.join(ROOT, "model-creation/data/**/*.csv"), recursive=True)):
+        with open(path, encoding="utf-8", errors="replace", newline="") as f:
+            for row in csv.DictReader(f):
+                texts.extend(row[column] for column in TEXT_COLUMNS if row.get(column))
+
+    return texts + list(EXTRA_TEXTS)
+
+
+def throughput(preprocess, texts: list[str]) -> float:
+    # Messages per second, with a warm stemmer cache
+    start = time.perf_counter()
+    for text in texts:
+        preprocess(text)
+
+    return len(texts) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    texts = load_texts()
+    text_preprocessing.load_resources()
+
+    # Golden check: the single-pass engine must reproduce the step-by-step pipeline exactly
+    mismatches = []
+    for text in texts:
+        expected = text_preprocessing.preprocess_text_reference(text)
+        actual = text_preprocessing.preprocess_text(text)
+        if actual != expected:
+            mismatches.append((text, expected, actual))
+
+    print(f"{len(texts)} texts from model-creation/data, {len(mismatches)} mismatches")
+    for text, expected, actual in mismatches[:5]:
+        print(f"  {text!r}\n    expected {expected!r}\n    actual   {actual!r}")
+
+    for name, preprocess in (
+        ("step by step", text_preprocessing.preprocess_text_reference),
+        ("single pass", text_preprocessing.preprocess_text),
+    ):
+        print(f"{name:<13} {throughput(preprocess, texts):9.0f} msg/s")
+
+    # First pass after a restart: stems come from Sastrawi, or from the lexicon when it was built
+    lexicon = text_preprocessing.stem_lexicon
+    for name, stem_lexicon in (("cold, Sastrawi", None), ("cold, lexicon", lexicon)):
+        if name.endswith("lexicon") and stem_lexicon is None:
+            print(f"{name:<13} skipped: run model-creation/build_stem_lexicon.py first")
+            continue
+
+        text_preprocessing.stem_lexicon = stem_lexicon
+        text_preprocessing.stem_word.cache_clear()
+        print(f"{name:<13} {throughput(text_preprocessing.preprocess_text, texts):9.0f} msg/s")
+
+    sys.exit(1 if mismatches else 0)
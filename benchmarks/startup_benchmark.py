@@ -0,0 +1,84 @@
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import responses
+import toxic_handler
+from bot_harness import Harness, make_update, percentile
+
+# Chatting pairs of users when the bot starts
+PAIRS = 16
+
+# Each scenario runs in a fresh interpreter so nothing is cached between them, run from the repository root
+SCENARIOS = {
+    # Before: importing the handlers loaded every model and resource
+    "eager": """
+import time
+start = time.perf_counter()
+import bot_handler
+import toxic_handler
+toxic_handler.load_moderation()
+first_response = time.perf_counter() - start
+print(first_response, first_response)
+""",
+    # After: handlers answer once imported, moderation warms up in the background
+    "lazy": """
+import asyncio
+import time
+start = time.perf_counter()
+import bot_handler
+import toxic_handler
+first_response = time.perf_counter() - start
+asyncio.run(toxic_handler.warm_up())
+print(first_response, time.perf_counter() - start)
+""",
+}
+
+
+def measure(code: str) -> tuple[float, float]:
+    # Seconds until the handlers can answer and until moderation is ready
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=os.getcwd(), env={**os.environ, "PYTHONPATH": ROOT},
+        capture_output=True, text=True, check=True,
+    )
+    first_response, ready = result.stdout.split()[-2:]
+
+    return float(first_response), float(ready)
+
+
+async def during_warm_up() -> tuple[list[float], bool, float]:
+    # Right after startup, one user sends a chat message and every other user sends /help while moderation warms up
+    async with Harness(PAIRS) as harness:
+        start = time.perf_counter()
+        warm_up = asyncio.create_task(toxic_handler.warm_up())
+
+        message = make_update(harness.bot, harness.users[0], "halo")
+        commands = [make_update(harness.bot, user_id, "/help") for user_id in harness.users[1:]]
+        await harness.feed([message, *commands])
+
+        # The chat message is answered with a retry notice instead of waiting for the warm-up
+        retry_notice = (harness.users[0], responses.moderation_starting) in harness.bot.sent
+        latencies = harness.latencies([message, *commands])
+        await warm_up
+
+        return latencies, retry_notice, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    for name, code in SCENARIOS.items():
+        first_response, ready = measure(code)
+        print(f"{name:<6} first response after {first_response:6.2f} s, moderation ready after {ready:6.2f} s")
+
+    # Handlers of a running bot while moderation is still loading
+    latencies, retry_notice, ready = asyncio.run(during_warm_up())
+    print(
+        f"warm-up: chat message and {PAIRS * 2 - 1} /help answered in p99 {percentile(latencies, 0.99):6.1f} ms, "
+        f"max {max(latencies) * 1e3:6.1f} ms, moderation ready after {ready:6.2f} s"
+    )
+    if not retry_notice or max(latencies) > ready:
+        sys.exit("Updates waited for the moderation warm-up")
@@ -0,0 +1,400 @@
+"""
+Offline moderation benchmark suite with regression tracking.
+
+Run from the repository root, without network access:
+    python benchmarks/suite.py                    # measure, write benchmarks/results/latest.json, compare
+    python benchmarks/suite.py --update-baseline  # measure and store the results as the new baseline
+    python benchmarks/suite.py --groups text,image --tolerance 0.3
+
+The text model is loaded from model-creation/model-export. The NSFW classifier (model_handler.nsfw_model_name)
+is never downloaded by the suite: it must be a local directory or already be in the Hugging Face cache, e.g.
+after running the bot once with network access.
+
+Every metric is compared with benchmarks/baseline.json. A metric worse than its baseline by more than
+the tolerance is a regression and the suite exits with status 1. So do a metric of the baseline missing
+from the run, a benchmark skipped because it failed (e.g. animated stickers without the cairo library)
+and a missing baseline (unless --allow-missing-baseline is given). Baselines only make sense on the machine and with the model
+files they were measured with, both are recorded next to the results.
+Fixture images, animated stickers and video stickers are generated at runtime from fixed seeds.
+"""
+import argparse
+import csv
+import glob
+import io
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Models come from local files or the Hugging Face cache only, read before transformers is imported
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+
+import numpy as np
+import torch
+from PIL import Image
+
+# Run from the repository root, the models are loaded from model-creation/model-export
+import model_handler
+import toxic_handler
+from text_preprocess import text_preprocessing
+from tgs_render_benchmark import make_sticker
+from video_sampling_benchmark import make_clip
+
+BASELINE_PATH = os.path.join(ROOT, "benchmarks", "baseline.json")
+RESULTS_PATH = os.path.join(ROOT, "benchmarks", "results", "latest.json")
+
+# Relative slowdown tolerated before a metric counts as a regression, tail latencies are noisier.
+# Fast steps swing by up to 40% between runs of an unchanged tree on a shared machine
+TOLERANCE = 0.5
+TAIL_TOLERANCE_FACTOR = 2
+
+# Dataset texts used by the text benchmarks, sampled with a fixed seed
+TEXT_SAMPLES = 2000
+TEXT_COLUMNS = ("Text", "Tweet", "original_text", "processed_text")
+
+# Batch sizes of the text inference latency benchmark, and forward passes measured per size
+TEXT_BATCH_SIZES = (1, 8, 32)
+TEXT_LATENCY_RUNS = 50
+
+# Fixture media and timed runs per fixture kind
+IMAGE_FIXTURES = 8
+STICKER_FIXTURES = 3
+VIDEO_FIXTURES = 2
+MEDIA_RUNS = 3
+
+# Repeats of the throughput benchmarks, the best one is kept to filter out scheduling noise,
+# and seconds each repeat lasts at least (fast steps are called several times in a row)
+THROUGHPUT_REPEATS = 10
+THROUGHPUT_MIN_TIME = 0.2
+
+# Steps of preprocess_text_reference, measured one by one on the previous step's output
+PREPROCESS_STAGES = (
+    ("lower", text_preprocessing.lower_text),
+    ("url", text_preprocessing.remove_url),
+    ("punctuation", text_preprocessing.remove_punctuation),
+    ("hashtags", text_preprocessing.remove_hashtags),
+    ("whitespace", text_preprocessing.remove_whitespace),
+    ("encoded", text_preprocessing.remove_encoded_text),
+    ("emoji", text_preprocessing.remove_emoji),
+    ("slang", lambda text: text_preprocessing.replace_slang_words(text, text_preprocessing.slang_dict)),
+    ("stop_words", lambda text: text_preprocessing.remove_stop_words(text, text_preprocessing.stop_words)),
+    ("stem", lambda text: text_preprocessing.stemmer.delegatedStemmer.stem(text)),  # Without Sastrawi's cache
+)
+
+
+class Results:
+    """
+    Collected metrics: value, unit and direction of every measurement, plus the skipped benchmarks.
+    """
+
+    def __init__(self):
+        self.metrics: dict[str, dict] = {}
+        self.skipped: dict[str, str] = {}
+
+    def add(self, name: str, value: float, unit: str, higher_is_better: bool, tail: bool = False) -> None:
+        self.metrics[name] = {"value": value, "unit": unit, "higher_is_better": higher_is_better, "tail": tail}
+        print(f"  {name:<40} {value:12.2f} {unit}")
+
+    def add_latencies(self, name: str, seconds: list[float]) -> None:
+        # p50, p95 and p99 in milliseconds
+        p50, p95, p99 = np.percentile(np.array(seconds) * 1e3, (50, 95, 99)).tolist()
+        self.add(f"{name}.p50", p50, "ms", higher_is_better=False)
+        self.add(f"{name}.p95", p95, "ms", higher_is_better=False, tail=True)
+        self.add(f"{name}.p99", p99, "ms", higher_is_better=False, tail=True)
+
+    def skip(self, name: str, reason: str) -> None:
+        self.skipped[name] = reason
+        print(f"  {name:<40} skipped: {reason}")
+
+
+def timed(func, *args) -> float:
+    # Seconds taken by one call
+    start = time.perf_counter()
+    func(*args)
+
+    return time.perf_counter() - start
+
+
+def best_of(func) -> float:
+    # CPU seconds per call in the fastest of THROUGHPUT_REPEATS repeats, time spent preempted by other processes
+    # is not counted
+    best = float("inf")
+    for _ in range(THROUGHPUT_REPEATS):
+        calls, start = 0, time.process_time()
+        while (elapsed := time.process_time() - start) < THROUGHPUT_MIN_TIME or not calls:
+            func()
+            calls += 1
+        best = min(best, elapsed / calls)
+
+    return best
+
+
+def load_texts() -> list[str]:
+    # Dataset texts, the same sample on every run
+    texts = []
+    for path in sorted(glob.glob(os.path.join(ROOT, "model-creation/data/**/*.csv"), recursive=True)):
+        with open(path, encoding="utf-8", errors="replace", newline="") as f:
+            for row in csv.DictReader(f):
+                texts.extend(row[column] for column in TEXT_COLUMNS if row.get(column))
+
+    return random.Random(0).sample(texts, min(TEXT_SAMPLES, len(texts)))
+
+
+def bench_preprocess(results: Results, texts: list[str]) -> None:
+    text_preprocessing.load_resources()
+
+    # Every reference step on the output of the previous one
+    stage_texts = texts
+    for name, step in PREPROCESS_STAGES:
+        inputs = stage_texts
+        elapsed = best_of(lambda: [step(text) for text in inputs])
+        stage_texts = [step(text) for text in inputs]
+        results.add(f"preprocess.stage.{name}", len(texts) / elapsed, "msg/s", True)
+
+    # The single-pass engine, without and with the stems of the sample cached
+    def cold():
+        text_preprocessing.stem_word.cache_clear()
+        start = time.process_time()
+        [text_preprocessing.preprocess_text(text) for text in texts]
+        return time.process_time() - start
+
+    elapsed = min(cold() for _ in range(THROUGHPUT_REPEATS))
+    results.add("preprocess.single_pass.cold", len(texts) / elapsed, "msg/s", True)
+    elapsed = best_of(lambda: [text_preprocessing.preprocess_text(text) for text in texts])
+    results.add("preprocess.single_pass.warm", len(texts) / elapsed, "msg/s", True)
+
+
+def bench_tokenize(results: Results, texts: list[str]) -> None:
+    model_handler.load_models()
+
+    # Tokenization alone, in batches of the largest size the bot sends
+    batch_size = TEXT_BATCH_SIZES[-1]
+    max_length = model_handler.TOKEN_BUCKETS[-1]
+
+    def tokenize():
+        for i in range(0, len(texts), batch_size):
+            model_handler.tokenizer(texts[i:i + batch_size], truncation=True, max_length=max_length)
+
+    results.add("tokenize.throughput", len(texts) / best_of(tokenize), "msg/s", True)
+
+
+def bench_text_inference(results: Results, texts: list[str]) -> None:
+    model_handler.load_models()
+    texts = [text for text in texts if text]
+
+    for batch_size in TEXT_BATCH_SIZES:
+        batches = [
+            [texts[(i * batch_size + j) % len(texts)] for j in range(batch_size)] for i in range(TEXT_LATENCY_RUNS)
+        ]
+        model_handler.score_text_batch(batches[0])  # Warm up
+
+        seconds = [timed(model_handler.score_text_batch, batch) for batch in batches]
+        results.add_latencies(f"text.batch_{batch_size}", seconds)
+        results.add(f"text.batch_{batch_size}.throughput", batch_size / np.median(seconds), "msg/s", True)
+
+
+def make_image(seed: int) -> bytes:
+    # Random 4:3 photo at a size Telegram sends, JPEG encoded
+    rng = random.Random(seed)
+    image = Image.effect_noise((800, 600), rng.uniform(20, 120)).convert("RGB")
+    image = Image.blend(image, Image.new("RGB", image.size, tuple(rng.randrange(256) for _ in range(3))), 0.5)
+    data = io.BytesIO()
+    image.save(data, "JPEG", quality=85)
+
+    return data.getvalue()
+
+
+def bench_media(results: Results, name: str, classify, fixtures: list[bytes]) -> None:
+    # Latency of a blocking classification step of toxic_handler, over every fixture
+    try:
+        classify(memoryview(fixtures[0]))  # Warm up
+    except Exception as e:
+        # Animated stickers need cairosvg (with the cairo library) or glaxnimate
+        results.skip(name, f"{type(e).__name__}: {e}")
+        return
+
+    seconds = [timed(classify, memoryview(data)) for _ in range(MEDIA_RUNS) for data in fixtures]
+    results.add_latencies(name, seconds)
+
+
+def bench_image(results: Results) -> None:
+    toxic_handler.load_moderation()
+    bench_media(results, "image.photo", toxic_handler.classify_image, [make_image(seed) for seed in range(IMAGE_FIXTURES)])
+    bench_media(results, "image.tgs", toxic_handler.score_tgs, [make_sticker(seed) for seed in range(STICKER_FIXTURES)])
+    bench_media(
+        results,
+        "image.webm",
+        toxic_handler.score_video,
+        [make_clip(".webm", "libvpx-vp9", 3, 30, 512, 512) for _ in range(VIDEO_FIXTURES)],
+    )
+
+
+GROUPS = ("preprocess", "tokenize", "text", "image")
+
+# Groups calling model_handler.load_models, which also loads the NSFW classifier
+MODEL_GROUPS = ("tokenize", "text", "image")
+
+
+def get_missing_models() -> list[str]:
+    # Models the suite would have to download, nothing is fetched in offline mode
+    from huggingface_hub import try_to_load_from_cache
+
+    name = model_handler.nsfw_model_name
+    if os.path.isdir(name) or isinstance(try_to_load_from_cache(name, "config.json"), str):
+        return []
+
+    return [name]
+
+
+def get_environment() -> dict:
+    # What the numbers depend on, a baseline from another environment is not comparable
+    return {
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+        "text_model": model_handler.get_text_model_fingerprint(),
+        "nsfw_model": model_handler.get_nsfw_model_fingerprint(),
+    }
+
+
+def run(groups: list[str]) -> dict:
+    results = Results()
+    texts = load_texts()
+    torch.manual_seed(0)
+
+    for group in groups:
+        print(group)
+        if group == "preprocess":
+            bench_preprocess(results, texts)
+        elif group == "tokenize":
+            bench_tokenize(results, [text_preprocessing.preprocess_text(text) for text in texts])
+        elif group == "text":
+            bench_text_inference(results, [text_preprocessing.preprocess_text(text) for text in texts])
+        elif group == "image":
+            bench_image(results)
+
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": get_environment(),
+        "metrics": results.metrics,
+        "skipped": results.skipped,
+    }
+
+
+def compare(current: dict, baseline: dict, tolerance: float, groups: list[str]) -> list[str]:
+    """
+    Compare measured metrics with the baseline.
+    :param current: results of this run
+    :param baseline: stored results
+    :param tolerance: relative slowdown tolerated
+    :param groups: benchmark groups of this run
+    :return: the names of the regressed metrics, and of the baseline metrics of these groups missing from this run
+    """
+    if current["environment"] != baseline["environment"]:
+        print("Warning: the baseline was measured in another environment:")
+        for key, value in baseline["environment"].items():
+            if current["environment"].get(key) != value:
+                print(f"  {key}: {value} -> {current['environment'].get(key)}")
+
+    regressions = []
+    print(f"{'metric':<40} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, metric in current["metrics"].items():
+        reference = baseline["metrics"].get(name)
+        if reference is None:
+            print(f"{name:<40} {'-':>12} {metric['value']:12.2f}      new")
+            continue
+
+        # Positive change is an improvement whatever the direction of the metric
+        change = metric["value"] / reference["value"] - 1 if reference["value"] else 0.0
+        if not metric["higher_is_better"]:
+            change = -change
+
+        allowed = tolerance * (TAIL_TOLERANCE_FACTOR if metric["tail"] else 1)
+        regressed = change < -allowed
+        if regressed:
+            regressions.append(name)
+
+        print(
+            f"{name:<40} {reference['value']:12.2f} {metric['value']:12.2f} {change:+8.1%}"
+            f"{'  REGRESSION' if regressed else ''}"
+        )
+
+    # A benchmark that failed (skipped) or disappeared must not pass for an unchanged one
+    for name in sorted(baseline["metrics"].keys() - current["metrics"].keys()):
+        skipped = any(name.startswith(f"{benchmark}.") for benchmark in current["skipped"])
+        if name.split(".")[0] in groups and not skipped:
+            regressions.append(name)
+            print(f"{name:<40} {baseline['metrics'][name]['value']:12.2f} {'-':>12}           MISSING")
+
+    # A benchmark that cannot run in this environment is not checked either, whatever the baseline says
+    for name, reason in current["skipped"].items():
+        if name.split(".")[0] in groups:
+            regressions.append(name)
+            print(f"{name:<40} SKIPPED: {reason}")
+
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline moderation benchmarks, compared with a stored baseline.")
+    parser.add_argument("--groups", default=",".join(GROUPS), help=f"comma-separated subset of {','.join(GROUPS)}")
+    parser.add_argument("--output", default=RESULTS_PATH, help="results file (JSON)")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline file (JSON)")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="relative slowdown tolerated")
+    parser.add_argument("--update-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument(
+        "--allow-missing-baseline", action="store_true", help="only measure when there is no baseline, exit with 0"
+    )
+    args = parser.parse_args()
+
+    groups = args.groups.split(",")
+    unknown = set(groups) - set(GROUPS)
+    if unknown:
+        parser.error(f"unknown groups {', '.join(sorted(unknown))}, expected some of {', '.join(GROUPS)}")
+
+    # Fail before measuring anything rather than halfway through
+    if set(groups) & set(MODEL_GROUPS) and (missing := get_missing_models()):
+        sys.exit(
+            f"Not in the Hugging Face cache: {', '.join(missing)}. Run the bot once with network access "
+            f"to download it, or run only --groups preprocess"
+        )
+    if not args.update_baseline and not args.allow_missing_baseline and not os.path.exists(args.baseline):
+        sys.exit(f"No baseline at {args.baseline}, store one with --update-baseline (or pass --allow-missing-baseline)")
+
+    current = run(groups)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(current, f, indent=2)
+    print(f"Saved results to {args.output}")
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(current, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, nothing to compare with")
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    regressions = compare(current, baseline, args.tolerance, groups)
+    if regressions:
+        print(f"{len(regressions)} regressed or missing metric(s): {', '.join(regressions)}")
+        sys.exit(1)
+
+    print("No regression")
+
+
+if __name__ == "__main__":
+    main()
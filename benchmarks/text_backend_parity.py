@@ -0,0 +1,81 @@
+import csv
+import gc
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import psutil
+import torch
+
+# Run from the repository root, after model-creation/export_text_model.py
+import model_handler
+
+BATCH_SIZE = 32
+LATENCY_SAMPLES = 200
+
+
+def load_texts() -> list[str]:
+    with open(os.path.join(ROOT, "model-creation/data/test.csv"), encoding="utf-8") as f:
+        return [row["Text"] for row in csv.DictReader(f)]
+
+
+def score(run_model, texts: list[str], batch_size: int) -> torch.Tensor:
+    # Category probabilities of every text
+    probabilities = []
+    for i in range(0, len(texts), batch_size):
+        inputs = model_handler.tokenizer(
+            texts[i:i + batch_size], padding=True, truncation=True, max_length=128, return_tensors="pt"
+        )
+        probabilities.append(torch.sigmoid(run_model(inputs)))
+
+    return torch.cat(probabilities)
+
+
+def latency(run_model, texts: list[str]) -> float:
+    # Mean single-message latency in ms
+    start = time.perf_counter()
+    score(run_model, texts[:LATENCY_SAMPLES], batch_size=1)
+
+    return (time.perf_counter() - start) / LATENCY_SAMPLES * 1e3
+
+
+if __name__ == "__main__":
+    texts = load_texts()
+    model_handler.load_models()  # Loads the tokenizer
+    process = psutil.Process()
+    reference = None
+
+    print(f"{len(texts)} texts from model-creation/data/test.csv")
+    for backend in model_handler.text_backends:
+        gc.collect()
+        rss_before = process.memory_info().rss
+
+        try:
+            run_model = model_handler.load_text_model(backend)
+        except (FileNotFoundError, ImportError) as e:
+            print(f"{backend:<11} skipped: {e}")
+            continue
+
+        rss = (process.memory_info().rss - rss_before) / 2**20
+        flags = score(run_model, texts, BATCH_SIZE) >= model_handler.threshold_tensor
+
+        if reference is None:
+            reference = flags
+
+        # Agreement of the thresholded decisions with the float32 PyTorch model
+        per_category = (flags == reference).float().mean(dim=0).tolist()
+        verdicts = (flags.any(dim=1) == reference.any(dim=1)).float().mean().item()
+        categories = ", ".join(
+            f"{category} {agreement:.2%}"
+            for category, agreement in zip(model_handler.category_columns, per_category)
+        )
+
+        print(
+            f"{backend:<11} {latency(run_model, texts):7.2f} ms/msg, +{rss:6.1f} MiB, "
+            f"verdict agreement {verdicts:.2%} ({categories})"
+        )
+
+        del run_model
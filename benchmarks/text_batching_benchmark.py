@@ -0,0 +1,92 @@
+import asyncio
+import csv
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from telegram.ext import SimpleUpdateProcessor
+
+# Run from the repository root, the models are loaded from their usual locations
+import model_handler
+import text_batcher
+import toxic_handler
+from bot_harness import Harness, make_update, percentile
+from text_preprocess import text_preprocessing
+from update_processor import PerUserUpdateProcessor
+
+PAIRS = 32
+MESSAGES_PER_USER = 8
+
+# Texts sent to the model per forward pass
+batch_sizes = []
+
+
+def count_batch(texts: list[str]):
+    batch_sizes.append(len(texts))
+
+    return model_handler.predict_toxic_text_scores(texts)
+
+
+def load_texts() -> list[str]:
+    with open(os.path.join(ROOT, "model-creation/data/test.csv"), encoding="utf-8") as f:
+        return [row["Text"] for row in csv.DictReader(f)]
+
+
+async def chat(update_processor, texts: list[str]) -> tuple[float, list[float], int]:
+    # Every user of PAIRS chats sends MESSAGES_PER_USER texts, all arriving at once like a burst of polled updates
+    async with Harness(PAIRS, update_processor) as harness:
+        updates = [
+            make_update(harness.bot, user_id, texts[(i * len(harness.users) + j) % len(texts)])
+            for i in range(MESSAGES_PER_USER)
+            for j, user_id in enumerate(harness.users)
+        ]
+
+        start = time.perf_counter()
+        await harness.feed(updates)
+        elapsed = time.perf_counter() - start
+
+        relayed = sum(update.message.message_id in harness.bot.relayed for update in updates)
+        if harness.errors or relayed != len(updates):
+            sys.exit(f"{relayed}/{len(updates)} messages relayed, errors: {harness.errors[:3]}")
+
+        # Each user's messages must reach the partner in the order they were sent
+        for user_id in harness.users:
+            times = [
+                harness.bot.relayed[update.message.message_id]
+                for update in updates
+                if update.effective_user.id == user_id
+            ]
+            if times != sorted(times):
+                sys.exit(f"Messages of user {user_id} relayed out of order")
+
+        return elapsed, harness.latencies(updates), len(updates)
+
+
+if __name__ == "__main__":
+    texts = load_texts()
+    toxic_handler.load_moderation()
+    toxic_handler.moderation_ready.set()
+
+    # Every message is relayed whatever the model says, so each pair keeps chatting
+    model_handler.threshold_tensor = model_handler.threshold_tensor + 1
+    model_handler.thresholds = {category: threshold + 1 for category, threshold in model_handler.thresholds.items()}
+    text_batcher.predict_toxic_text_scores = count_batch
+
+    scenarios = (
+        ("sequential updates", SimpleUpdateProcessor(1)),
+        ("per-user concurrent", PerUserUpdateProcessor()),
+    )
+    for name, update_processor in scenarios:
+        # Cold caches for both runs
+        text_batcher.text_batcher.cache.clear()
+        text_preprocessing.stem_word.cache_clear()
+        batch_sizes.clear()
+
+        elapsed, latencies, messages = asyncio.run(chat(update_processor, texts))
+        print(
+            f"{name:<20} {messages / elapsed:8.1f} msg/s, p50 {percentile(latencies, 0.50):8.1f} ms, "
+            f"p99 {percentile(latencies, 0.99):8.1f} ms, {sum(batch_sizes) / len(batch_sizes):5.1f} texts per forward pass"
+        )
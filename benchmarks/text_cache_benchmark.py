@@ -0,0 +1,52 @@
+import asyncio
+import csv
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Run from the repository root, the model is loaded from model-creation/model-export
+import model_handler
+from text_batcher import TextBatcher
+
+MESSAGES = 2000
+DISTINCT = 200
+CONCURRENCY = 16
+
+
+def load_traffic() -> list[str]:
+    # Chat-like traffic: a few distinct preprocessed messages, the most common ones repeated a lot
+    with open(os.path.join(ROOT, "model-creation/data/test.csv"), encoding="utf-8") as f:
+        texts = [row["Text"] for row in csv.DictReader(f)][:DISTINCT]
+
+    weights = [1 / rank for rank in range(1, len(texts) + 1)]
+
+    return random.Random(0).choices(texts, weights, k=MESSAGES)
+
+
+async def replay(batcher: TextBatcher, traffic: list[str]) -> float:
+    # Messages per second with CONCURRENCY chats sending at once
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def chat(text: str) -> None:
+        async with semaphore:
+            await batcher.submit(text)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(chat(text) for text in traffic))
+
+    return len(traffic) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    traffic = load_traffic()
+    model_handler.predict_toxic_text_scores(traffic[:8])  # Warm up
+
+    for name, cache_size in (("uncached", 0), ("cached", 4096)):
+        batcher = TextBatcher(cache_size=cache_size)
+        throughput = asyncio.run(replay(batcher, traffic))
+        stats = batcher.get_cache_stats()
+        print(f"{name:<9} {throughput:9.1f} msg/s, cache hit rate {stats['hit_rate']:.1%} ({stats['size']} entries)")
@@ -0,0 +1,68 @@
+import csv
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import torch
+
+# Run from the repository root, the model is loaded from model-creation/model-export
+import model_handler
+
+SAMPLES = 512
+BATCH_SIZE = 32
+
+
+def load_texts() -> list[str]:
+    # Messages drawn from the length distribution of the test split, plus some left empty by preprocessing
+    with open(os.path.join(ROOT, "model-creation/data/test.csv"), encoding="utf-8") as f:
+        texts = [row["Text"] for row in csv.DictReader(f)]
+
+    rng = random.Random(0)
+
+    return rng.sample(texts, SAMPLES - SAMPLES // 16) + [""] * (SAMPLES // 16)
+
+
+def padded_to_longest(texts: list[str]) -> list[bool]:
+    # Previous path: every batch padded to its longest text, empty texts included
+    inputs = model_handler.tokenizer(texts, padding=True, truncation=True, max_length=128, return_tensors="pt")
+    probabilities = torch.sigmoid(model_handler.run_text_model(inputs))
+
+    return (probabilities >= model_handler.threshold_tensor).any(dim=1).tolist()
+
+
+def bucketed(texts: list[str]) -> list[bool]:
+    verdicts, _ = model_handler.predict_toxic_text_scores(texts)
+
+    return verdicts
+
+
+def measure(predict, texts: list[str], batch_size: int) -> float:
+    # Mean time per message in ms
+    start = time.perf_counter()
+    for i in range(0, len(texts), batch_size):
+        predict(texts[i:i + batch_size])
+
+    return (time.perf_counter() - start) / len(texts) * 1e3
+
+
+if __name__ == "__main__":
+    texts = load_texts()
+    random.Random(1).shuffle(texts)
+    model_handler.load_models()
+    bucketed(texts[:BATCH_SIZE] + [""])  # Warm up
+
+    lengths = sorted(len(ids) for ids in model_handler.tokenizer(texts)["input_ids"])
+    print(f"{len(texts)} messages, tokens p50 {lengths[len(lengths) // 2]}, p90 {lengths[len(lengths) * 9 // 10]}")
+
+    for name, predict in (("padded to longest", padded_to_longest), ("length buckets", bucketed)):
+        single = measure(predict, texts, 1)
+        batched = measure(predict, texts, BATCH_SIZE)
+        empty = measure(predict, [""] * 64, 1)
+        print(
+            f"{name:<18} single {single:6.2f} ms/msg, batch of {BATCH_SIZE} {batched:6.2f} ms/msg, "
+            f"empty text {empty:6.3f} ms"
+        )
@@ -0,0 +1,74 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+RUNS = 5
+
+# Each scenario runs in a fresh interpreter so nothing is cached between them
+SCENARIOS = {
+    # Before: pandas for the stop words, JSON for the slang words, StemmerFactory for the dictionary
+    "pandas": """
+import time
+start = time.perf_counter()
+import json
+import pandas as pd
+from Sastrawi.Stemmer.StemmerFactory import StemmerFactory
+from text_preprocess import text_preprocessing
+imported = time.perf_counter()
+with open(text_preprocessing.slang_path, "r") as f:
+    slang_dict = json.load(f)
+stop_words = frozenset(pd.read_csv(text_preprocessing.stop_words_path, header=None)[0].tolist())
+stemmer = StemmerFactory().create_stemmer()
+""",
+    # No bundle: the sources are parsed without pandas
+    "sources": """
+import time
+start = time.perf_counter()
+from text_preprocess import text_preprocessing
+imported = time.perf_counter()
+text_preprocessing.resource_bundle_path += ".missing"
+text_preprocessing.load_resources()
+""",
+    # After: resources loaded from model-creation/build_text_resources.py's bundle
+    "bundle": """
+import time
+start = time.perf_counter()
+from text_preprocess import text_preprocessing
+imported = time.perf_counter()
+assert text_preprocessing.read_bundle(text_preprocessing.resource_bundle_path, text_preprocessing.resource_sources)
+text_preprocessing.load_resources()
+""",
+}
+
+REPORT = """
+loaded = time.perf_counter()
+import psutil
+print(imported - start, loaded - imported, psutil.Process().memory_info().rss)
+"""
+
+
+def measure(code: str) -> tuple[float, float, int]:
+    # Seconds to import text_preprocessing, seconds to load its resources, resident memory in bytes
+    result = subprocess.run(
+        [sys.executable, "-c", code + REPORT], cwd=ROOT, env={**os.environ, "PYTHONPATH": ROOT},
+        capture_output=True, text=True, check=True,
+    )
+    imported, loaded, rss = result.stdout.split()[-3:]
+
+    return float(imported), float(loaded), int(rss)
+
+
+if __name__ == "__main__":
+    if not os.path.exists(os.path.join(ROOT, "text_preprocess", "resources.bin")):
+        sys.exit("Build the bundle first: python model-creation/build_text_resources.py")
+
+    for name, code in SCENARIOS.items():
+        # Median of a few runs, the first one also warms the OS file cache
+        runs = sorted(measure(code) for _ in range(RUNS))
+        imported, loaded, rss = runs[RUNS // 2]
+        print(
+            f"{name:<8} import {imported * 1e3:7.1f} ms, load {loaded * 1e3:6.1f} ms, "
+            f"total {(imported + loaded) * 1e3:7.1f} ms, RSS {rss / 2**20:6.1f} MiB"
+        )
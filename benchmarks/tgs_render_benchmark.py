@@ -0,0 +1,112 @@
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lottie
+import numpy as np
+from lottie import objects
+from lottie.exporters.core import export_tgs
+from PIL import Image
+
+# Run from the repository root, the models are loaded from model-creation/model-export
+import model_handler
+import toxic_handler
+
+STICKERS = 10
+
+# Mean absolute difference (0-255) allowed between a frame rendered directly and the same frame from lottie's PNG export
+PARITY_TOLERANCE = 4.0
+
+
+def make_sticker(seed: int) -> bytes:
+    # 512x512, 60 frames: a few moving, coloured shapes like a typical animated sticker
+    animation = objects.Animation(60)
+    layer = objects.ShapeLayer()
+    animation.add_layer(layer)
+
+    for i in range(4):
+        shape = layer.add_shape(objects.Ellipse() if (seed + i) % 2 else objects.Rect())
+        shape.size.value = lottie.NVector(120 + 20 * i, 100 + 15 * i)
+        shape.position.add_keyframe(0, lottie.NVector(60 + 40 * i, 80 + seed * 10))
+        shape.position.add_keyframe(59, lottie.NVector(450 - 30 * i, 400 - seed * 5))
+        layer.add_shape(objects.Fill(lottie.Color((seed * 0.1) % 1, 0.2 * i, 0.8)))
+
+    data = io.BytesIO()
+    export_tgs(animation, data)
+
+    return data.getvalue()
+
+
+def full_size_png(data: bytes) -> bool:
+    # Previous path: frame 0 at full canvas size, PNG encoded, copied, decoded and resized by the pipeline
+    animation = lottie.parsers.tgs.parse_tgs(io.BytesIO(data))
+    image = io.BytesIO()
+    lottie.exporters.cairo.export_png(animation, image)
+    image.seek(0)
+
+    return model_handler.predict_toxic_image(io.BytesIO(image.read()))
+
+
+def png_export(data: bytes) -> float:
+    # Current path: every sampled frame through lottie's PNG export
+    toxic_handler.TGS_DIRECT_RENDER = False
+
+    return toxic_handler.score_tgs(data)
+
+
+def direct(data: bytes) -> float:
+    toxic_handler.TGS_DIRECT_RENDER = True
+
+    return toxic_handler.score_tgs(data)
+
+
+def render_frame(animation: lottie.objects.Animation, frame: float, direct_render: bool) -> Image.Image:
+    toxic_handler.TGS_DIRECT_RENDER = direct_render
+
+    return toxic_handler.render_tgs_frame(animation, frame)
+
+
+def check_parity(stickers: list[bytes]) -> None:
+    # Every sampled frame rendered directly must look like lottie's PNG export, at the classifier's resolution
+    size = (toxic_handler.TGS_RENDER_SIZE, toxic_handler.TGS_RENDER_SIZE)
+    for seed, data in enumerate(stickers):
+        animation = lottie.parsers.tgs.parse_tgs(io.BytesIO(data))
+        for frame in (animation.in_point, (animation.in_point + animation.out_point) / 2, animation.out_point - 1):
+            image = render_frame(animation, frame, True)
+            expected = render_frame(animation, frame, False)
+            if image.mode != "RGB" or image.size != size:
+                sys.exit(f"Sticker {seed} frame {frame}: rendered {image.mode} {image.size}, expected RGB {size}")
+
+            difference = np.abs(np.asarray(image, dtype=np.int16) - np.asarray(expected, dtype=np.int16)).mean()
+            if difference > PARITY_TOLERANCE:
+                sys.exit(f"Sticker {seed} frame {frame}: differs from the PNG export by {difference:.1f} per channel")
+
+
+if __name__ == "__main__":
+    # Checks and times the direct path before TGS_DIRECT_RENDER is turned on, it needs the cairo library
+    if not toxic_handler.has_cairosvg:
+        sys.exit("cairosvg or the cairo library is missing, the direct rendering path cannot be checked")
+
+    toxic_handler.load_moderation()
+    stickers = [make_sticker(seed) for seed in range(STICKERS)]
+
+    check_parity(stickers)
+    print(f"direct rendering matches lottie's PNG export on {STICKERS} stickers")
+
+    frames = toxic_handler.TGS_SAMPLED_FRAMES
+    scenarios = (
+        ("full-size PNG, 1 frame", full_size_png),
+        (f"PNG export, {frames} frames", png_export),
+        (f"direct, {frames} frames", direct),
+    )
+    for name, classify in scenarios:
+        for data in stickers:
+            classify(data)  # Warm up
+        start = time.process_time()
+        for data in stickers:
+            classify(data)
+        elapsed = time.process_time() - start
+        print(f"{name:<24} {elapsed / STICKERS * 1e3:8.1f} ms CPU per sticker")
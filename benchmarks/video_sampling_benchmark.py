@@ -0,0 +1,109 @@
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import av
+import imageio.v3 as iio
+import numpy as np
+from PIL import Image
+
+# Run from the repository root, the models are loaded from model-creation/model-export
+import model_handler
+import toxic_handler
+
+# (name, extension, codec, seconds, fps, width, height, keyframe interval, without duration) of the synthetic clips.
+# 250 frames between keyframes is x264's default, and so typical of GIFs converted to mp4
+CLIPS = (
+    ("video sticker", ".webm", "libvpx-vp9", 3, 30, 512, 512, None, False),
+    ("video sticker, no duration", ".webm", "libvpx-vp9", 3, 30, 512, 512, None, True),
+    ("short GIF", ".mp4", "libx264", 5, 25, 480, 360, 250, False),
+    ("GIF", ".mp4", "libx264", 20, 30, 480, 360, 250, False),
+    ("long GIF", ".mp4", "libx264", 40, 30, 640, 480, 250, False),
+    ("long GIF, keyframe every 12 frames", ".mp4", "libx264", 40, 30, 640, 480, 12, False),
+)
+
+
+def make_clip(
+    extension: str, codec: str, seconds: int, fps: int, width: int, height: int,
+    gop_size: int = None, no_duration: bool = False,
+) -> bytes:
+    # Moving gradient, cheap to encode and still a real multi-frame video
+    out = io.BytesIO()
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+
+    # A live webm has no duration in its header
+    with av.open(out, "w", format=extension[1:], options={"live": "1"} if no_duration else {}) as container:
+        # Keyframes every gop_size frames exactly, without extra ones on scene cuts
+        stream = container.add_stream(codec, rate=fps, options={"sc_threshold": "0"} if gop_size else {})
+        stream.width, stream.height, stream.pix_fmt = width, height, "yuv420p"
+        if gop_size:
+            stream.codec_context.gop_size = gop_size
+
+        for i in range(seconds * fps):
+            frame[..., 0] = (x + i * 3) % 256
+            frame[..., 1] = (y + i * 2) % 256
+            frame[..., 2] = (x + y + i) % 256
+            container.mux(stream.encode(av.VideoFrame.from_ndarray(frame, format="rgb24")))
+        container.mux(stream.encode())
+
+    return out.getvalue()
+
+
+def sampled_times(data: bytes) -> list[float]:
+    # Timestamps of the frames the sampler hands to the classifier
+    return [image.info["time"] for image in toxic_handler.sample_video_frames(data)]
+
+
+def first_frame(data: bytes, extension: str) -> int:
+    # Previous behaviour: only frame 0 is classified
+    model_handler.predict_toxic_image(Image.fromarray(iio.imread(data, extension=extension, index=0)))
+
+    return 1
+
+
+def every_frame(data: bytes, extension: str) -> int:
+    # Naive full coverage: decode and classify every frame
+    frames = [Image.fromarray(frame) for frame in iio.imiter(data, extension=extension)]
+    for i in range(0, len(frames), toxic_handler.VIDEO_BATCH_SIZE):
+        model_handler.predict_nsfw_scores(frames[i:i + toxic_handler.VIDEO_BATCH_SIZE])
+
+    return len(frames)
+
+
+def sampled(data: bytes, extension: str) -> int:
+    decoded = toxic_handler.video_counters["frames_decoded"]
+    toxic_handler.score_video(data)
+
+    return toxic_handler.video_counters["frames_decoded"] - decoded
+
+
+if __name__ == "__main__":
+    toxic_handler.load_moderation()
+    gaps = []
+
+    for name, extension, codec, seconds, fps, width, height, gop_size, no_duration in CLIPS:
+        data = make_clip(extension, codec, seconds, fps, width, height, gop_size, no_duration)
+        print(f"{name} ({extension}, {seconds * fps} frames {width}x{height}, {len(data) / 1024:.0f} KiB)")
+
+        for strategy, classify in (("first frame", first_frame), ("every frame", every_frame), ("sampled", sampled)):
+            start = time.perf_counter()
+            decoded = classify(data, extension)
+            elapsed = time.perf_counter() - start
+            print(f"  {strategy:<12} {decoded:5d} frames decoded, {elapsed * 1e3:8.1f} ms/clip")
+
+        # The samples must spread over the whole clip: in order, none repeated, the last one in the last
+        # 1/VIDEO_SAMPLED_FRAMES of the clip
+        times = sampled_times(data)
+        print(f"  sampled at   {', '.join(f'{t:.2f}' for t in times)} s")
+        samples = toxic_handler.VIDEO_SAMPLED_FRAMES
+        last_target = seconds * (samples - 1) / samples
+        if len(times) != samples or times != sorted(set(times)) or times[-1] < last_target - 1 / fps:
+            gaps.append(name)
+
+    if gaps:
+        sys.exit(f"Clips not sampled across their whole duration: {', '.join(gaps)}")
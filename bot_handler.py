@@ -6,9 +6,9 @@ from captcha.image import ImageCaptcha
 from telegram import ChatMember, ReplyKeyboardMarkup, ReplyKeyboardRemove, Update, Message
 from telegram.ext import ContextTypes, ConversationHandler
 
-import db_connection
+import async_db
 import responses
-from toxic_handler import predict_toxicity
+from toxic_handler import moderation_ready, predict_toxicity
 from UserStatus import UserStatus
 
 # Define status for states
@@ -16,9 +16,13 @@ CAPTCHA = 0
 USER_ACTION = 1
 
 
-def update_keyboard(user_id: int) -> ReplyKeyboardMarkup:
-    user_status = db_connection.get_user_status(user_id=user_id)  # Get user's status
+async def update_keyboard(user_id: int) -> ReplyKeyboardMarkup:
+    user_status = await async_db.get_user_status(user_id=user_id)  # Get user's status
 
+    return build_keyboard(user_status)
+
+
+def build_keyboard(user_status: str) -> ReplyKeyboardMarkup:
     # Return ReplyKeyboardMarkup based on user's status
     if user_status == UserStatus.IDLE or user_status == UserStatus.PARTNER_LEFT:
         return ReplyKeyboardMarkup(
@@ -38,9 +42,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_id = update.effective_user.id
 
     # Check if the user exists in the database, returns to captcha state if not
-    if db_connection.check_user(user_id):
+    if await async_db.check_user(user_id):
         # Check if user's duration on bot is within min_duration (24h), returns to captcha state if not
-        if db_connection.check_user_duration(user_id):
+        if await async_db.check_user_duration(user_id):
             return USER_ACTION
 
         else:
@@ -77,17 +81,17 @@ async def verify_captcha(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if user_input == correct_captcha:
         user_id = update.effective_user.id  # Retrieve user id
         # Check if user is already exist in database, insert user to database if not
-        if not db_connection.check_user(user_id):
-            db_connection.insert_user(user_id)
+        if not await async_db.check_user(user_id):
+            await async_db.insert_user(user_id)
 
-        db_connection.set_user_start_bot_time(user_id)  # Set user start bot timestamp
+        await async_db.set_user_start_bot_time(user_id)  # Set user start bot timestamp
 
         await context.bot.send_message(
             chat_id=update.effective_chat.id, text=responses.captcha_true
         )
 
         await context.bot.send_message(
-            reply_markup=update_keyboard(user_id),
+            reply_markup=await update_keyboard(user_id),
             chat_id=update.effective_chat.id,
             text=responses.start,
         )
@@ -106,9 +110,9 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     user_id = update.effective_user.id
 
     # Check if the user is in chat
-    if db_connection.get_user_status(user_id=user_id) == UserStatus.COUPLED:
+    if await async_db.get_user_status(user_id=user_id) == UserStatus.COUPLED:
         # User is in chat, retrieve the other user
-        other_user_id = db_connection.get_partner_id(user_id)
+        other_user_id = await async_db.get_partner_id(user_id)
 
         if other_user_id is None:
             return await handle_not_in_chat(update, context)
@@ -123,12 +127,12 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 async def handle_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     # Handle the command /chat in different cases, based on the status of the user
     current_user_id = update.effective_user.id
-    current_user_status = db_connection.get_user_status(user_id=current_user_id)
+    current_user_status = await async_db.get_user_status(user_id=current_user_id)
 
     # Check user eligibility
-    if not db_connection.is_eligible_to_chat(current_user_id):
+    if not await async_db.is_eligible_to_chat(current_user_id):
         await context.bot.send_message(
-            reply_markup=update_keyboard(current_user_id),
+            reply_markup=await update_keyboard(current_user_id),
             chat_id=current_user_id,
             text=responses.not_eligible,
         )
@@ -137,7 +141,7 @@ async def handle_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
 
     if current_user_status == UserStatus.PARTNER_LEFT:
         # First, check if the user has been left by partner
-        db_connection.set_user_status(
+        await async_db.set_user_status(
             user_id=current_user_id, new_status=UserStatus.IDLE
         )
 
@@ -149,12 +153,12 @@ async def handle_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     
     elif current_user_status == UserStatus.COUPLED:
         # Double check if the user is in chat
-        other_user = db_connection.get_partner_id(current_user_id)
+        other_user = await async_db.get_partner_id(current_user_id)
 
         if other_user is not None:
             # If the user has been paired, then he/she is already in a chat, so warn him/her
             await context.bot.send_message(
-                reply_markup=update_keyboard(current_user_id),
+                reply_markup=await update_keyboard(current_user_id),
                 chat_id=current_user_id,
                 text=responses.in_chat,
             )
@@ -172,11 +176,11 @@ async def handle_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
 async def handle_not_in_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     # Handle user that is not in chat but sent non-command message regardless
     current_user_id = update.effective_user.id
-    current_user_status = db_connection.get_user_status(user_id=current_user_id)
+    current_user_status = await async_db.get_user_status(user_id=current_user_id)
 
     if current_user_status in [UserStatus.IDLE, UserStatus.PARTNER_LEFT]:
         await context.bot.send_message(
-            reply_markup=update_keyboard(current_user_id),
+            reply_markup=await update_keyboard(current_user_id),
             chat_id=current_user_id,
             text=responses.not_in_chat,
         )
@@ -192,7 +196,7 @@ async def handle_not_in_chat(update: Update, context: ContextTypes.DEFAULT_TYPE)
 async def handle_already_in_search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     # Handle user that is searching but sent message regardless
     await context.bot.send_message(
-        reply_markup=update_keyboard(update.effective_user.id),
+        reply_markup=await update_keyboard(update.effective_user.id),
         chat_id=update.effective_chat.id,
         text=responses.in_searching,
     )
@@ -205,27 +209,23 @@ async def start_search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
     current_user_id = update.effective_chat.id
 
-    # Set the user status to in_search
-    db_connection.set_user_status(
-        user_id=current_user_id, new_status=UserStatus.IN_SEARCH
-    )
+    # Set the user status to in_search and search for a partner in the waiting queue
+    other_user_id = await async_db.search(current_user_id)
     await context.bot.send_message(
-        reply_markup=update_keyboard(current_user_id),
+        reply_markup=await update_keyboard(current_user_id),
         chat_id=current_user_id,
         text=responses.start_searching,
     )
 
-    # Search for a partner
-    other_user_id = db_connection.couple(current_user_id=current_user_id)
     # If a partner is found, notify both the users
     if other_user_id is not None:
         await context.bot.send_message(
-            reply_markup=update_keyboard(current_user_id),
+            reply_markup=await update_keyboard(current_user_id),
             chat_id=current_user_id,
             text=responses.searching_found,
         )
         await context.bot.send_message(
-            reply_markup=update_keyboard(other_user_id),
+            reply_markup=await update_keyboard(other_user_id),
             chat_id=other_user_id,
             text=responses.searching_found,
         )
@@ -235,9 +235,9 @@ async def handle_credit(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     # Handle the /credit command, send message of user's credit value
     user_id = update.effective_user.id
     await context.bot.send_message(
-        reply_markup=update_keyboard(user_id),
+        reply_markup=await update_keyboard(user_id),
         chat_id=user_id,
-        text=f"{responses.credit_score}{db_connection.get_user_credit(user_id)}",
+        text=f"{responses.credit_score}{await async_db.get_user_credit(user_id)}",
     )
 
 
@@ -245,7 +245,7 @@ async def handle_help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     # Handles the /help command, send message of bot command's list
     user_id = update.effective_user.id
     await context.bot.send_message(
-        reply_markup=update_keyboard(user_id), chat_id=user_id, text=responses.help
+        reply_markup=await update_keyboard(user_id), chat_id=user_id, text=responses.help
     )
 
     return
@@ -255,7 +255,7 @@ async def handle_rules(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     # Handles the /rules command, send message of bot's rules
     user_id = update.effective_user.id
     await context.bot.send_message(
-        reply_markup=update_keyboard(user_id), chat_id=user_id, text=responses.rules
+        reply_markup=await update_keyboard(user_id), chat_id=user_id, text=responses.rules
     )
 
 
@@ -263,65 +263,58 @@ async def handle_stop(update: Update, context: ContextTypes.DEFAULT_TYPE, toxic=
     # Handles the /stop command, able to stop ongoing search or chat
     current_user = update.effective_user.id
 
-    if db_connection.get_user_status(user_id=current_user) == UserStatus.IN_SEARCH:
-        db_connection.set_user_status(user_id=current_user, new_status=UserStatus.IDLE)
+    current_user_status = await async_db.get_user_status(user_id=current_user)
+
+    if current_user_status == UserStatus.IN_SEARCH:
+        await async_db.cancel_search(current_user)
         await context.bot.send_message(
-            reply_markup=update_keyboard(current_user),
+            reply_markup=build_keyboard(UserStatus.IDLE),
             chat_id=current_user,
             text=responses.searching_stopped,
         )
 
         return
 
-    if db_connection.get_user_status(user_id=current_user) != UserStatus.COUPLED:
+    if current_user_status != UserStatus.COUPLED:
         await context.bot.send_message(
-            reply_markup=update_keyboard(current_user),
+            reply_markup=build_keyboard(current_user_status),
             chat_id=current_user,
             text=responses.not_in_chat,
         )
 
         return
 
-    other_user = db_connection.get_partner_id(current_user)
-    if other_user is None:
-        return
-
+    # Uncouple both users in one transaction
     # If parameters toxic is True, reduce user credit by 25
     # User's credit increase by 5 if toxic is false and chat duration is over 5min
-    if toxic is True:
-        db_connection.set_credit(current_user, -25)
-
-        if db_connection.check_chat_duration(other_user):
-            db_connection.set_credit(other_user, 5)
-
-    else:
-        if db_connection.check_chat_duration(current_user):
-            db_connection.set_credit(current_user, 5)
-            db_connection.set_credit(other_user, 5)
+    session = await async_db.end_session(current_user, toxic=toxic)
+    if session is None:
+        return
 
-    # Perform the uncoupling
-    db_connection.uncouple(user_id=current_user)
+    other_user = session["partner_id"]
+    current_user_keyboard = build_keyboard(session["user_status"])
+    other_user_keyboard = build_keyboard(session["partner_status"])
 
     await context.bot.send_message(
-        reply_markup=update_keyboard(current_user),
+        reply_markup=current_user_keyboard,
         chat_id=current_user,
         text=responses.ending_chat,
     )
     await context.bot.send_message(
-        reply_markup=update_keyboard(other_user),
+        reply_markup=other_user_keyboard,
         chat_id=other_user,
         text=responses.stopped_chat,
     )
     await context.bot.send_message(
-        reply_markup=update_keyboard(other_user),
+        reply_markup=other_user_keyboard,
         chat_id=other_user,
-        text=f"{responses.credit_score}{db_connection.get_user_credit(other_user)}",
+        text=f"{responses.credit_score}{session['partner_credit']}",
     )
     await update.message.reply_text(responses.stop_chat)
     await context.bot.send_message(
-        reply_markup=update_keyboard(current_user),
+        reply_markup=current_user_keyboard,
         chat_id=current_user,
-        text=f"{responses.credit_score}{db_connection.get_user_credit(current_user)}",
+        text=f"{responses.credit_score}{session['user_credit']}",
     )
 
 
@@ -329,7 +322,7 @@ async def handle_next(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     # Handles the /next command, exiting from the chat and starting a new search if the user is in chat
     current_user = update.effective_user.id
 
-    if db_connection.get_user_status(user_id=current_user) == UserStatus.IN_SEARCH:
+    if await async_db.get_user_status(user_id=current_user) == UserStatus.IN_SEARCH:
         return await handle_already_in_search(update, context)
     
     # If exit_chat returns True, then the user was in chat and successfully exited
@@ -343,7 +336,7 @@ async def is_message_incompatible(update: Update, context: ContextTypes.DEFAULT_
     # Check if message is incompatible in this bot specs (inc. document, audio, video)
     if message.audio or message.video or message.video_note or message.voice or (message.document and not message.animation):
         await context.bot.send_message(
-            reply_markup=update_keyboard(update.effective_user.id),
+            reply_markup=await update_keyboard(update.effective_user.id),
             chat_id=update.effective_user.id,
             text=responses.incompatible_message,
         )
@@ -360,23 +353,51 @@ async def in_chat(update: Update, context: ContextTypes.DEFAULT_TYPE, other_user
     if await is_message_incompatible(update, context, message):
         return
 
+    # Nothing is relayed until the moderation models are loaded, the sender is asked to retry instead of
+    # holding the update (and the user's next updates) until the warm-up is done
+    if not moderation_ready.is_set():
+        await context.bot.send_message(
+            reply_markup=build_keyboard(UserStatus.COUPLED),
+            chat_id=update.effective_user.id,
+            text=responses.moderation_starting,
+        )
+
+        return
+
     # Check for toxicity
-    if await predict_toxicity(context, message):
+    toxic = await predict_toxicity(context, message)
+
+    # The partner's updates run while the message is moderated, drop it if the chat ended meanwhile
+    if await async_db.get_partner_id(update.effective_user.id) != other_user_id:
+        return
+
+    # Nothing is relayed without a verdict (media too large or too slow to download, moderation timed out),
+    # the sender may retry
+    if toxic is None:
+        await context.bot.send_message(
+            reply_markup=build_keyboard(UserStatus.COUPLED),
+            chat_id=update.effective_user.id,
+            text=responses.not_moderated,
+        )
+
+        return
+
+    if toxic:
         # Notify the sender about toxic content
         await context.bot.send_message(
-            reply_markup=update_keyboard(update.effective_user.id),
+            reply_markup=build_keyboard(UserStatus.COUPLED),
             chat_id=update.effective_user.id,
             text=responses.toxic_stop_chat,
         )
 
         # Notify the other user that the chat has ended
         await context.bot.send_message(
-            reply_markup=update_keyboard(other_user_id),
+            reply_markup=build_keyboard(UserStatus.COUPLED),
             chat_id=other_user_id,
             text=responses.toxic_stopped_chat,
         )
 
-        # Exit chat
+        # Exit chat, the sender's penalty and the partner's bonus are applied with the uncoupling
         await handle_stop(update, context, True)
 
         return
@@ -443,16 +464,24 @@ async def blocked_bot_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
     if is_bot_blocked_by_user(update):
         # Check if user was in chat
         user_id = update.effective_user.id
-        user_status = db_connection.get_user_status(user_id=user_id)
+        user_status = await async_db.get_user_status(user_id=user_id)
 
         if user_status == UserStatus.COUPLED:
-            other_user = db_connection.get_partner_id(user_id)
-            db_connection.uncouple(user_id=user_id)
-            await context.bot.send_message(
-                reply_markup=update_keyboard(user_id),
-                chat_id=other_user,
-                text=responses.stopped_chat,
-            )
+            # End the chat without touching credits
+            session = await async_db.end_session(user_id, reward=False)
+            if session is not None:
+                await context.bot.send_message(
+                    reply_markup=build_keyboard(session["partner_status"]),
+                    chat_id=session["partner_id"],
+                    text=responses.stopped_chat,
+                )
+
+        elif user_status == UserStatus.IN_SEARCH:
+            # Never pair anyone with a user who blocked the bot
+            await async_db.cancel_search(user_id)
+
+        # Skip the user in broadcasts until the captcha is passed again
+        await async_db.set_user_blocked(user_id)
 
         return ConversationHandler.END
     
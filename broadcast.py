@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import time
+from datetime import timedelta
+
+from telegram import Bot
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+import async_db
+
+# Telegram allows about 30 messages per second overall and 1 message per second to the same chat
+GLOBAL_RATE = 25.0
+GLOBAL_BURST = 5
+PER_CHAT_INTERVAL = 1.0
+
+# Number of messages in flight at the same time
+MAX_CONCURRENCY = 16
+
+# Attempts per user for flood-wait and network errors
+MAX_ATTEMPTS = 4
+
+# Deliveries buffered before a checkpoint is written to the database
+CHECKPOINT_SIZE = 200
+
+
+class TokenBucket:
+    """
+    Async token bucket: allows `rate` acquisitions per second with bursts up to `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        # Stop handing out tokens, e.g. while Telegram asks us to wait after a flood error
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                # Refill according to the elapsed time
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    # Depending on the library version, retry_after is either seconds or a timedelta
+    if isinstance(error.retry_after, timedelta):
+        return error.retry_after.total_seconds()
+
+    return float(error.retry_after)
+
+
+async def deliver(bot: Bot, bucket: TokenBucket, user_id, **message) -> str:
+    """
+    Send the message to a single user, honouring the rate limits.
+    :return: the delivery outcome, "sent", "blocked" or "failed"
+    """
+    last_attempt = 0.0
+
+    for attempt in range(MAX_ATTEMPTS):
+        # Never hit the same chat more than once per PER_CHAT_INTERVAL when retrying
+        wait = last_attempt + PER_CHAT_INTERVAL - time.monotonic()
+        if attempt and wait > 0:
+            await asyncio.sleep(wait)
+
+        await bucket.acquire()
+        last_attempt = time.monotonic()
+
+        try:
+            await bot.send_message(chat_id=user_id, **message)
+            return "sent"
+
+        except RetryAfter as e:
+            # Flood control applies to the whole bot, so pause every sender
+            bucket.pause(retry_after_seconds(e))
+
+        except Forbidden:
+            # The user blocked the bot or deleted the account
+            return "blocked"
+
+        except BadRequest as e:
+            if "chat not found" in str(e).lower():
+                return "blocked"
+            logging.warning(f"Broadcast to {user_id} rejected: {e}")
+            return "failed"
+
+        except NetworkError as e:
+            # Includes TimedOut, back off and retry
+            logging.warning(f"Broadcast to {user_id} failed (attempt {attempt + 1}): {e}")
+            await asyncio.sleep(2 ** attempt)
+
+    return "failed"
+
+
+async def broadcast(bot: Bot, kind: str, once: bool = False, **message) -> dict:
+    """
+    Send a message to every user, resuming the unfinished broadcast of the same kind if there is one.
+    Only one process may run a given broadcast at a time, they would otherwise share its recipients.
+    :param bot: bot used to send the messages
+    :param kind: name of the announcement (e.g. "online"), used to resume interrupted broadcasts
+    :param once: only resume or start the announcement if it is not already the last one delivered
+    :param message: keyword arguments for bot.send_message, except chat_id
+    :return: number of users per delivery outcome
+    """
+    broadcast_id = await async_db.start_broadcast(kind, once)
+    if broadcast_id is None:
+        logging.info(f"Broadcast '{kind}' already delivered")
+        return {}
+
+    recipients = iter(await async_db.get_broadcast_recipients(broadcast_id))
+    bucket = TokenBucket(GLOBAL_RATE, GLOBAL_BURST)
+    checkpoint = []
+
+    async def flush() -> None:
+        # Persist progress so an interrupted broadcast resumes where it stopped
+        deliveries = checkpoint.copy()
+        checkpoint.clear()
+        if deliveries:
+            await async_db.record_broadcast_deliveries(broadcast_id, deliveries)
+
+    async def worker() -> None:
+        # Workers share the recipients iterator, which bounds the number of messages in flight
+        for user_id in recipients:
+            outcome = await deliver(bot, bucket, user_id, **message)
+            checkpoint.append((user_id, outcome))
+
+            if len(checkpoint) >= CHECKPOINT_SIZE:
+                await flush()
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(MAX_CONCURRENCY)))
+
+    finally:
+        # Also checkpoint when cancelled (e.g. the bot is stopping)
+        await asyncio.shield(flush())
+
+    outcomes = await async_db.finish_broadcast(broadcast_id)
+    logging.info(f"Broadcast '{kind}' finished: {outcomes}")
+
+    return outcomes
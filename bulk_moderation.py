@@ -0,0 +1,131 @@
+"""
+Score a corpus of messages with the text moderation model, streaming rows in and out.
+
+Run from the repository root:
+    python bulk_moderation.py model-creation/data/test.csv scores.csv
+    python bulk_moderation.py traffic.jsonl - --column message --workers 4
+
+CSV and JSONL (one JSON object per line) are read and written, chosen by the file extension ("-" is
+stdin / stdout, as JSONL unless --format is given). Every input row is written back with the
+probability of each category ("<category> score", labelled datasets keep their label columns) and
+the "toxic" verdict under the current thresholds.
+"""
+import argparse
+import csv
+import json
+import sys
+from collections import deque
+from collections.abc import Iterator
+
+import model_handler
+from text_preprocess.text_preprocessing import PREPROCESS_CHUNK_SIZE, preprocess_texts
+
+# Output fields of the category probabilities
+score_fields = [f"{category} score" for category in model_handler.category_columns]
+
+
+def get_format(path: str, default: str) -> str:
+    # File format from the extension
+    if path.endswith(".csv"):
+        return "csv"
+    if path.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+
+    return default
+
+
+def read_rows(f, file_format: str) -> Iterator[dict]:
+    # One dict per input row, read lazily
+    if file_format == "csv":
+        yield from csv.DictReader(f)
+    else:
+        yield from (json.loads(line) for line in f if line.strip())
+
+
+class RowWriter:
+    """
+    Writes scored rows as CSV or JSONL, the CSV header is taken from the first row.
+    """
+
+    def __init__(self, f, file_format: str):
+        self.f = f
+        self.file_format = file_format
+        self._csv: csv.DictWriter = None
+
+    def write(self, row: dict) -> None:
+        if self.file_format == "jsonl":
+            self.f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            return
+
+        if self._csv is None:
+            self._csv = csv.DictWriter(self.f, fieldnames=list(row), extrasaction="ignore")
+            self._csv.writeheader()
+        self._csv.writerow(row)
+
+
+def score_rows(
+    rows: Iterator[dict], column: str, preprocess: bool = True, workers: int = 1,
+    batch_size: int = model_handler.BULK_BATCH_SIZE,
+) -> Iterator[dict]:
+    """
+    Add the category probabilities and the verdict to every row.
+    :param rows: input rows
+    :param column: field holding the message text
+    :param preprocess: False if the texts are already preprocessed
+    :param workers: preprocessing processes
+    :param batch_size: texts scored per forward pass
+    :return: the scored rows, in input order
+    """
+    # Rows wait here while their text goes through preprocessing and inference
+    pending = deque()
+
+    def texts() -> Iterator[str]:
+        for row in rows:
+            pending.append(row)
+            yield row.get(column) or ""
+
+    stream = preprocess_texts(texts(), workers=workers) if preprocess else texts()
+    for verdicts, probabilities in model_handler.predict_toxic_texts(stream, batch_size=batch_size):
+        for verdict, scores in zip(verdicts.tolist(), probabilities.tolist()):
+            row = pending.popleft()
+            row.update(zip(score_fields, scores))
+            row["toxic"] = verdict
+            yield row
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Score a CSV or JSONL corpus with the text moderation model.")
+    parser.add_argument("input", help="CSV or JSONL file, - for stdin")
+    parser.add_argument("output", help="CSV or JSONL file, - for stdout")
+    parser.add_argument("--column", default="Text", help="field holding the message text (default: Text)")
+    parser.add_argument("--format", choices=("csv", "jsonl"), help="format of stdin / stdout")
+    parser.add_argument("--raw", action="store_true", help="the texts are already preprocessed")
+    parser.add_argument("--workers", type=int, default=1, help="preprocessing processes (default: 1)")
+    parser.add_argument("--batch-size", type=int, default=model_handler.BULK_BATCH_SIZE)
+    args = parser.parse_args()
+
+    input_format = get_format(args.input, args.format or "jsonl")
+    output_format = get_format(args.output, args.format or input_format)
+
+    fin = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8", newline="")
+    fout = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8", newline="")
+
+    with fin, fout:
+        writer = RowWriter(fout, output_format)
+        count = toxic = 0
+        rows = score_rows(read_rows(fin, input_format), args.column, not args.raw, args.workers, args.batch_size)
+
+        for row in rows:
+            writer.write(row)
+            count += 1
+            toxic += row["toxic"]
+
+            # Progress on stderr, the output may be stdout
+            if count % (PREPROCESS_CHUNK_SIZE * 10) == 0:
+                print(f"{count} rows scored", file=sys.stderr)
+
+    print(f"{count} rows scored, {toxic} toxic", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
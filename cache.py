@@ -0,0 +1,77 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Thread-safe, size-bounded LRU cache with optional per-entry time-to-live and hit/miss counters.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+
+            # Expired entries count as misses and are dropped
+            if entry is not None and self.ttl is not None and entry[1] < time.monotonic():
+                del self._data[key]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+
+            return entry[0]
+
+    def peek(self, key, default=None):
+        # Read an entry without touching the LRU order or the counters
+        with self._lock:
+            entry = self._data.get(key)
+
+            return default if entry is None else entry[0]
+
+    def set(self, key, value) -> None:
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+
+            # Evict the least recently used entries
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+
+            return default if entry is None else entry[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
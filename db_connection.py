@@ -1,33 +1,217 @@
+import os
 import sqlite3
-from datetime import datetime
+import threading
+import time
+import weakref
 
+from cache import LRUCache
 from UserStatus import UserStatus
 
+# Path of the chatbot database
+DB_PATH = "users_database.db"
+
+# Pragmas applied once to every pooled connection
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",  # Readers never block the writer (bot and dashboard)
+    "PRAGMA synchronous=NORMAL",  # Safe with WAL, fsync only on checkpoint
+    "PRAGMA cache_size=-16384",  # 16 MiB page cache per connection
+    "PRAGMA mmap_size=268435456",  # Map up to 256 MiB of the database file
+    "PRAGMA temp_store=MEMORY",
+)
+
+# Seconds to wait for a lock held by another connection before failing
+BUSY_TIMEOUT = 5.0
+
+# Number of users rows kept in the in-process cache
+USER_CACHE_SIZE = 10000
+
+# Columns of a cached users row
+USER_COLUMNS = ("start_bot_time", "start_chat_time", "credit", "status", "partner_id")
+
+# Version of the database schema, stored in PRAGMA user_version
+SCHEMA_VERSION = 3
+
+# Current time as integer epoch seconds, evaluated inside SQLite
+SQL_NOW = "CAST(strftime('%s', 'now') AS INTEGER)"
+
+# Seconds between two checks of the database for changes made by other connections
+USER_CACHE_CHECK_INTERVAL = 0.05
+
+# Number of media scores and sticker sets kept in the in-process caches
+MEDIA_CACHE_SIZE = 20000
+STICKER_SET_CACHE_SIZE = 1000
+
+# Seconds a stored media score is trusted, the file is moderated again afterwards
+MEDIA_SCORE_TTL = 30 * 86400
+
+# Write-through cache of users rows keyed on the user_id text, in front of the database
+user_cache = LRUCache(maxsize=USER_CACHE_SIZE)
+
+# Caches of media scores keyed on the file_unique_id, and of the allowlisted state of sticker sets
+media_cache = LRUCache(maxsize=MEDIA_CACHE_SIZE)
+sticker_set_cache = LRUCache(maxsize=STICKER_SET_CACHE_SIZE)
+
+# Media resolved from a stored score, and the download bytes it avoided
+media_counters = {"hits": 0, "misses": 0, "allowlisted": 0, "bytes_saved": 0}
+
+
+class PooledConnection:
+    """
+    Connection owned by one thread, closed as soon as the thread exits and its thread-local storage is freed.
+    """
+
+    __slots__ = ("conn", "__weakref__")
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __del__(self):
+        self.conn.close()
+
+
+_local = threading.local()
+# Weak references only, a finished thread (e.g. a dashboard script run) must not keep its connection open
+_connections: weakref.WeakSet[PooledConnection] = weakref.WeakSet()
+_connections_lock = threading.Lock()
+_generation = 0
+
+
+def get_connection() -> sqlite3.Connection:
+    # Each thread (async handlers, dashboard script runs) keeps its own long-lived connection
+    pooled = getattr(_local, "pooled", None)
+    if pooled is not None and _local.generation == _generation:
+        return pooled.conn
+
+    conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT, check_same_thread=False)
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+
+    pooled = PooledConnection(conn)
+    with _connections_lock:
+        _connections.add(pooled)
+    _local.pooled = pooled
+    _local.generation = _generation
+    _local.data_version = None
+    _local.data_version_checked = 0.0
+
+    return conn
+
 
 def connect_to_db() -> tuple[sqlite3.Connection, sqlite3.Cursor]:
-    # Connect to the chatbot database
-    conn = sqlite3.connect("users_database.db")
+    # Hand out the pooled connection of the current thread
+    conn = get_connection()
+
+    # Never leak a transaction left open by a failed statement into the next caller
+    if conn.in_transaction:
+        conn.rollback()
+
     c = conn.cursor()
 
     return conn, c
 
 
+def close_db() -> None:
+    # Close every pooled connection, threads reconnect lazily on next use
+    global _generation
+
+    with _connections_lock:
+        for pooled in list(_connections):
+            pooled.conn.close()
+        _connections.clear()
+        _generation += 1
+
+
+def remove_db() -> bool:
+    # Close the pool and delete the database together with its WAL files
+    close_db()
+
+    if not os.path.exists(DB_PATH):
+        return False
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(DB_PATH + suffix):
+            os.remove(DB_PATH + suffix)
+
+    return True
+
+
+def validate_user_cache(conn: sqlite3.Connection) -> None:
+    # Limit how often the database is polled on the hot path
+    now = time.monotonic()
+    if now - _local.data_version_checked < USER_CACHE_CHECK_INTERVAL:
+        return
+    _local.data_version_checked = now
+
+    # PRAGMA data_version changes whenever another connection (e.g. the admin dashboard) committed,
+    # drop the cached rows in that case since they may be stale
+    data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+    if _local.data_version != data_version:
+        user_cache.clear()
+        sticker_set_cache.clear()
+        _local.data_version = data_version
+
+
+def get_user_row(user_id: int) -> dict:
+    conn, c = connect_to_db()  # Get the pooled connection
+    validate_user_cache(conn)
+
+    # Serve the row from the cache, read it from the database on a miss
+    key = str(user_id)
+    row = user_cache.get(key)
+    if row is None:
+        c.execute(
+            f"SELECT {', '.join(USER_COLUMNS)} FROM users WHERE user_id=?", (user_id,)
+        )
+        values = c.fetchone()
+        if values is None:
+            return None
+
+        row = dict(zip(USER_COLUMNS, values))
+        user_cache.set(key, row)
+
+    return row
+
+
+def update_cached_user(user_id: int, **fields) -> None:
+    # Write-through: patch the cached row once the change is committed
+    key = str(user_id)
+    row = user_cache.peek(key)
+    if row is not None:
+        user_cache.set(key, {**row, **fields})
+
+
+def get_cache_stats() -> dict:
+    # Hit/miss counters of the users cache
+    return user_cache.stats()
+
+
 def create_db() -> None:
-    conn, c = connect_to_db()  # Connect to the chatbot database
+    conn, c = connect_to_db()  # Get the pooled connection
 
-    # Create the users table if it does not exist
+    # Create the users table if it does not exist, timestamps are integer epoch seconds
     c.execute(
         """
         CREATE TABLE IF NOT EXISTS users (
             user_id TEXT PRIMARY KEY,
-            start_bot_time TIMESTAMP,
-            start_chat_time TIMESTAMP,
+            start_bot_time INTEGER,
+            start_chat_time INTEGER,
             credit INT CHECK(credit >= 0 AND credit <= 100),
             status TEXT,
-            partner_id TEXT
+            partner_id TEXT,
+            blocked INTEGER NOT NULL DEFAULT 0
         )
         """
     )
+    conn.commit()
+
+    # Bring databases created by older versions to the current schema
+    migrate_db()
+
+    # Create the secondary indexes if they do not exist (also migrates existing databases)
+    c.execute("DROP INDEX IF EXISTS idx_users_partner_id")  # Partners are read by user_id, the primary key
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_status ON users (status)")
+    c.execute("DROP INDEX IF EXISTS idx_users_in_search")  # Only served the startup reload of the search queue
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_start_bot_time ON users (start_bot_time)")
 
     # Create the bot_status table if it does not exist
     c.execute(
@@ -39,6 +223,60 @@ def create_db() -> None:
         """
     )
 
+    # The waiting queue only lives in memory (see matchmaking.Matchmaker), earlier versions mirrored it here
+    c.execute("DROP TABLE IF EXISTS search_queue")
+
+    # Create the broadcasts table if it does not exist, one row per announcement sent to all users
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            broadcast_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT,
+            created INTEGER,
+            finished INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+
+    # Create the broadcast_deliveries table if it does not exist, the checkpoint of unfinished broadcasts
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+            broadcast_id INTEGER,
+            user_id TEXT,
+            outcome TEXT,
+            PRIMARY KEY (broadcast_id, user_id)
+        ) WITHOUT ROWID
+        """
+    )
+
+    # Create the media_scores table if it does not exist, NSFW scores of already seen media and the
+    # classifier (model and frame sampling) that produced them, the threshold is applied on lookup
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS media_scores (
+            file_unique_id TEXT PRIMARY KEY,
+            score REAL,
+            fingerprint TEXT,
+            file_size INTEGER,
+            checked INTEGER
+        ) WITHOUT ROWID
+        """
+    )
+
+    # Create the sticker_set_allowlist table if it does not exist, stickers of these sets are not moderated
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sticker_set_allowlist (
+            set_name TEXT PRIMARY KEY,
+            added INTEGER
+        ) WITHOUT ROWID
+        """
+    )
+
     # Insert the default row into bot_status if the table is empty
     c.execute(
         """
@@ -48,20 +286,76 @@ def create_db() -> None:
         """
     )
 
-    # Commit and close connection
+    # Commit changes
     conn.commit()
-    conn.close()
 
 
-def check_user(user_id: int) -> bool:
-    conn, c = connect_to_db()  # Connect to the chatbot database
+def migrate_db() -> None:
+    conn, c = connect_to_db()  # Get the pooled connection
+
+    # Take the write lock so the migration is atomic while the dashboard or the bot are running
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        version = c.execute("PRAGMA user_version").fetchone()[0]
+
+        if version < 1:
+            # Version 1: ISO timestamp strings (local time) become integer epoch columns
+            columns = {row[1]: row[2] for row in c.execute("PRAGMA table_info(users)")}
+            if columns["start_bot_time"] != "INTEGER":
+                to_epoch = (
+                    "CASE WHEN typeof({0})='text' "
+                    "THEN CAST(strftime('%s', {0}, 'utc') AS INTEGER) ELSE {0} END"
+                )
+                c.execute(
+                    """
+                    CREATE TABLE users_migration (
+                        user_id TEXT PRIMARY KEY,
+                        start_bot_time INTEGER,
+                        start_chat_time INTEGER,
+                        credit INT CHECK(credit >= 0 AND credit <= 100),
+                        status TEXT,
+                        partner_id TEXT
+                    )
+                    """
+                )
+                c.execute(
+                    f"""
+                    INSERT INTO users_migration
+                    SELECT user_id, {to_epoch.format("start_bot_time")}, {to_epoch.format("start_chat_time")},
+                        credit, status, partner_id
+                    FROM users
+                    """
+                )
+                c.execute("DROP TABLE users")
+                c.execute("ALTER TABLE users_migration RENAME TO users")
+
+        if version < 2:
+            # Version 2: users who blocked the bot are flagged and skipped by broadcasts
+            columns = {row[1] for row in c.execute("PRAGMA table_info(users)")}
+            if "blocked" not in columns:
+                c.execute("ALTER TABLE users ADD COLUMN blocked INTEGER NOT NULL DEFAULT 0")
+
+        if version < 3:
+            # Version 3: media scores replace the boolean media verdicts, which cannot follow a new threshold
+            # and partly come from the first-frame-only video check
+            c.execute("DROP TABLE IF EXISTS media_verdicts")
+
+        c.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+        # Commit changes
+        conn.commit()
+
+    except Exception:
+        conn.rollback()
+        raise
+
+    user_cache.clear()
 
-    # Check if the user is already in the users table
-    c.execute("SELECT * FROM users WHERE user_id=?", (user_id,))
 
-    if c.fetchone():
+def check_user(user_id: int) -> bool:
+    # Check if the user is already in the users table
+    if get_user_row(user_id):
         # If the user is already in the users table, returns True
-        conn.close()
         return True
     
     else:
@@ -69,11 +363,14 @@ def check_user(user_id: int) -> bool:
 
 
 def insert_user(user_id: int) -> None:
-    conn, c = connect_to_db()  # Connect to the chatbot database
+    conn, c = connect_to_db()  # Get the pooled connection
 
     # Insert the user into the users table
     c.execute(
-        "INSERT INTO users VALUES (?, ?, ?, ?, ?, ?)",
+        """
+        INSERT INTO users (user_id, start_bot_time, start_chat_time, credit, status, partner_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
         (
             user_id,
             None,
@@ -84,13 +381,15 @@ def insert_user(user_id: int) -> None:
         ),
     )
 
-    # Commit and close connection
+    # Commit changes
     conn.commit()
-    conn.close()
+    user_cache.set(
+        str(user_id), dict(zip(USER_COLUMNS, (None, None, 100, UserStatus.IDLE, None)))
+    )
 
 
 def set_bot_status(online: bool, pid: int) -> None:
-    conn, c = connect_to_db()  # Connect to the chatbot database
+    conn, c = connect_to_db()  # Get the pooled connection
 
     # Ensure there's only one row in the table
     c.execute("DELETE FROM bot_status")
@@ -98,65 +397,47 @@ def set_bot_status(online: bool, pid: int) -> None:
     # Insert the single row
     c.execute("INSERT INTO bot_status (online, pid) VALUES (?, ?)", (online, pid))
 
-    # Commit and close connection
+    # Commit changes
     conn.commit()
-    conn.close()
 
 
 def get_bot_pid() -> int:
-    conn, c = connect_to_db()  # Connect to the chatbot database
+    conn, c = connect_to_db()  # Get the pooled connection
 
     # Get pid
     c.execute("SELECT pid FROM bot_status")
     pid = c.fetchone()[0]
 
-    # Close connection
-    conn.close()
-
     return pid
 
 
 def is_online() -> bool:
-    conn, c = connect_to_db()  # Connect to the chatbot database
+    conn, c = connect_to_db()  # Get the pooled connection
 
     # Get online status
     c.execute("SELECT online FROM bot_status")
     is_online = c.fetchone()[0] 
 
-    # Close connection
-    conn.close()
-
     return is_online
 
 
 def get_all_user_ids() -> list:
-    conn, c = connect_to_db()  # Connect to the chatbot database
+    conn, c = connect_to_db()  # Get the pooled connection
 
-    # Get all user_ids
-    c.execute("SELECT user_id FROM users")
+    # Get all user_ids, except users who blocked the bot
+    c.execute("SELECT user_id FROM users WHERE blocked=0")
     user_ids = [row[0] for row in c.fetchall()]
 
-    # Close connection
-    conn.close()
-
     return user_ids
 
 
 def get_user_status(user_id: int) -> str:
-    conn, c = connect_to_db()  # Connect to the chatbot database
-
     # Get the status of the user
-    c.execute("SELECT status FROM users WHERE user_id=?", (user_id,))
-    status = c.fetchone()[0]
-
-    # Close connection
-    conn.close()
-
-    return status
+    return get_user_row(user_id)["status"]
 
 
 def set_user_status(user_id: int, new_status: str) -> None:
-    conn, c = connect_to_db()  # Connect to the chatbot database
+    conn, c = connect_to_db()  # Get the pooled connection
 
     # Update the status of the user
     c.execute(
@@ -167,34 +448,34 @@ def set_user_status(user_id: int, new_status: str) -> None:
         ),
     )
 
-    # Commit and close connection
+    # Commit changes
     conn.commit()
-    conn.close()
+    update_cached_user(user_id, status=new_status)
 
 
 def set_user_start_bot_time(user_id) -> None:
-    conn, c = connect_to_db()  # Connect to the chatbot database
+    conn, c = connect_to_db()  # Get the pooled connection
 
-    # Update the user's start bot time
+    # Update the user's start bot time, a user passing the captcha has unblocked the bot
+    start_bot_time = int(time.time())
     c.execute(
-        "UPDATE users SET start_bot_time=? WHERE user_id=?",
+        "UPDATE users SET start_bot_time=?, blocked=0 WHERE user_id=?",
         (
-            datetime.now(),
+            start_bot_time,
             user_id,
         ),
     )
 
-    # Commit and close connection
+    # Commit changes
     conn.commit()
-    conn.close()
+    update_cached_user(user_id, start_bot_time=start_bot_time)
 
 
 def set_credit(user_id: int, delta: int) -> None:
-    conn, c = connect_to_db()  # Connect to the chatbot database
+    conn, c = connect_to_db()  # Get the pooled connection
 
     # Get the current credit
-    c.execute("SELECT credit FROM users WHERE user_id=?", (user_id,))
-    current_credit = c.fetchone()[0]
+    current_credit = get_user_credit(user_id)
 
     # Set credit value within bounds
     new_credit = max(0, min(100, current_credit + delta))
@@ -208,22 +489,14 @@ def set_credit(user_id: int, delta: int) -> None:
         ),
     )
 
-    # Commit and close connection
+    # Commit changes
     conn.commit()
-    conn.close()
+    update_cached_user(user_id, credit=new_credit)
 
 
 def get_user_credit(user_id: int) -> int:
-    conn, c = connect_to_db()  # Connect to the chatbot database
-
     # Get the user's credit
-    c.execute("SELECT credit FROM users WHERE user_id=?", (user_id,))
-    credit = c.fetchone()[0]
-
-    # Close connection
-    conn.close()
-
-    return credit
+    return get_user_row(user_id)["credit"]
 
 
 def is_eligible_to_chat(user_id: int) -> bool:
@@ -237,104 +510,123 @@ def is_eligible_to_chat(user_id: int) -> bool:
 
 
 def get_partner_id(user_id: int) -> int:
-    conn, c = connect_to_db()  # Connect to the chatbot database
-
-    # If the user is a guest, then search for the host
-    c.execute("SELECT user_id FROM users WHERE partner_id=?", (user_id,))
-    other_user_id = c.fetchone()
+    # Coupling is symmetric, so read the partner straight from the user's own row (primary key lookup)
+    row = get_user_row(user_id)
 
-    if not other_user_id:
+    if not row:
         # If no user is found, return None
-        conn.close()
         return None
 
     # Otherwise, returns the other user's id
-    other_user_id = other_user_id[0]
+    return row["partner_id"]
 
-    # Close connection
-    conn.close()
 
-    return other_user_id
+def enqueue_search(user_id: int) -> None:
+    conn, c = connect_to_db()  # Get the pooled connection
 
+    # Mark the user as searching, its place in the waiting queue is kept by the matchmaker
+    with conn:
+        c.execute(
+            "UPDATE users SET partner_id=?, start_chat_time=?, status=? WHERE user_id=?",
+            (None, None, UserStatus.IN_SEARCH, user_id),
+        )
 
-def couple(current_user_id: int) -> int:
-    conn, c = connect_to_db() # Connect to the chatbot database
+    update_cached_user(user_id, partner_id=None, start_chat_time=None, status=UserStatus.IN_SEARCH)
 
-    # If the user is not the current one and is in search, then couple them
-    c.execute(
-        "SELECT user_id FROM users WHERE status=? AND user_id!=?",
-        (
-            UserStatus.IN_SEARCH,
-            current_user_id,
-        ),
-    )
 
-    # Verify if another user in search is found
-    other_user_id = c.fetchone()
-    if not other_user_id:
-        # If no user is found, return None
-        return None
-    
-    # If another user in search is found, couple the users
-    other_user_id = other_user_id[0]
+def dequeue_search(user_id: int) -> None:
+    conn, c = connect_to_db()  # Get the pooled connection
+
+    # Go back to idle, only if the user is still searching
+    with conn:
+        c.execute(
+            "UPDATE users SET status=? WHERE user_id=? AND status=?",
+            (UserStatus.IDLE, user_id, UserStatus.IN_SEARCH),
+        )
+        dequeued = c.rowcount == 1
+
+    if dequeued:
+        update_cached_user(user_id, status=UserStatus.IDLE)
 
-    # Update both users' partner_id and start chat time to reflect the coupling
-    start_chat_time = datetime.now()
-    c.execute(
-        "UPDATE users SET partner_id=?, start_chat_time=?, status=? WHERE user_id=?",
-        (other_user_id, start_chat_time, UserStatus.COUPLED, current_user_id),
-    )
-    c.execute(
-        "UPDATE users SET partner_id=?, start_chat_time=?, status=? WHERE user_id=?",
-        (current_user_id, start_chat_time, UserStatus.COUPLED, other_user_id),
-    )
 
-    # Commit and close connection
+def couple(current_user_id: int, other_user_id: int) -> bool:
+    conn, c = connect_to_db()  # Get the pooled connection
+
+    # Update both users' partner_id and start chat time to reflect the coupling,
+    # but only if both of them are still searching
+    start_chat_time = int(time.time())
+    for user_id, partner_id in (
+        (current_user_id, other_user_id),
+        (other_user_id, current_user_id),
+    ):
+        c.execute(
+            "UPDATE users SET partner_id=?, start_chat_time=?, status=? WHERE user_id=? AND status=?",
+            (partner_id, start_chat_time, UserStatus.COUPLED, user_id, UserStatus.IN_SEARCH),
+        )
+
+        if c.rowcount != 1:
+            # One of the users is no longer searching, leave both untouched
+            conn.rollback()
+            return False
+
+    # Commit changes
     conn.commit()
-    conn.close()
+    update_cached_user(
+        current_user_id,
+        partner_id=str(other_user_id),
+        start_chat_time=start_chat_time,
+        status=UserStatus.COUPLED,
+    )
+    update_cached_user(
+        other_user_id,
+        partner_id=str(current_user_id),
+        start_chat_time=start_chat_time,
+        status=UserStatus.COUPLED,
+    )
 
-    return other_user_id
+    return True
 
 
 def check_user_duration(user_id: int, max_duration: float=86400.0) -> bool:
-    conn, c = connect_to_db()  # Connect to the chatbot database
+    conn, c = connect_to_db()  # Get the pooled connection
 
-    # Get user's start bot time and check if its exist, if not returns false
-    c.execute("SELECT start_bot_time FROM users WHERE user_id=?", (user_id,))
-    start_bot_time = c.fetchone()
-    if not start_bot_time[0]:
-        conn.close()
-        return False
+    # Check inside the query if the user's start bot time exists and is within max_duration
+    c.execute(
+        f"SELECT start_bot_time IS NOT NULL AND {SQL_NOW} - start_bot_time < ? FROM users WHERE user_id=?",
+        (max_duration, user_id),
+    )
+    row = c.fetchone()
 
-    # Calculate duration in seconds
-    start_bot_time = datetime.fromisoformat(start_bot_time[0])
-    duration = datetime.now() - start_bot_time
+    return bool(row and row[0])
 
-    # Close connection
-    conn.close()
 
-    return duration.total_seconds() < max_duration
+def check_chat_duration(user_id: int, min_duration: float=300.0) -> bool:
+    conn, c = connect_to_db()  # Get the pooled connection
 
+    # Check inside the query if the user's chat lasted at least min_duration
+    c.execute(
+        f"SELECT start_chat_time IS NOT NULL AND {SQL_NOW} - start_chat_time >= ? FROM users WHERE user_id=?",
+        (min_duration, user_id),
+    )
+    row = c.fetchone()
 
-def check_chat_duration(user_id: int, min_duration: float=300.0) -> bool:
-    conn, c = connect_to_db()  # Connect to the chatbot database
+    return bool(row and row[0])
 
-    # Get user's start chat time
-    c.execute("SELECT start_chat_time FROM users WHERE user_id=?", (user_id,))
-    start_chat_time = c.fetchone()[0]
 
-    # Calculate duration in seconds
-    start_chat_time = datetime.fromisoformat(start_chat_time)
-    duration = datetime.now() - start_chat_time
+def get_expired_user_ids(max_duration: float=86400.0) -> list:
+    conn, c = connect_to_db()  # Get the pooled connection
 
-    # Close connection
-    conn.close()
+    # Get all users whose bot session is older than max_duration (range scan on idx_users_start_bot_time)
+    c.execute(
+        f"SELECT user_id FROM users WHERE start_bot_time <= {SQL_NOW} - ?",
+        (max_duration,),
+    )
 
-    return duration.total_seconds() >= min_duration
+    return [row[0] for row in c.fetchall()]
 
 
 def uncouple(user_id: int) -> None:
-    conn, c = connect_to_db()  # Connect to the chatbot database
+    conn, c = connect_to_db()  # Get the pooled connection
 
     # Get partner_id of the user
     partner_id = get_partner_id(user_id)
@@ -362,13 +654,297 @@ def uncouple(user_id: int) -> None:
         ),
     )
 
-    # Commit and close connection
+    # Commit changes
+    conn.commit()
+    for uncoupled_user_id in (user_id, partner_id):
+        update_cached_user(
+            uncoupled_user_id, partner_id=None, start_chat_time=None, status=UserStatus.IDLE
+        )
+
+
+def end_session(user_id: int, toxic: bool=False, reward: bool=True, min_duration: float=300.0) -> dict:
+    """
+    End the chat of the user in a single transaction: apply the credit changes and uncouple both users.
+    :param user_id: user ending the chat
+    :param toxic: if True, the user loses 25 credits and the partner gains 5 if the chat lasted min_duration
+    :param reward: if False, credits are left untouched (e.g. the user blocked the bot)
+    :param min_duration: minimum chat duration in seconds to earn the 5 credits bonus
+    :return: the partner's id with both users' new credit and status, None if the user was not coupled
+    """
+    conn, c = connect_to_db()  # Get the pooled connection
+
+    # Take the write lock first so both rows cannot change until the commit
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        c.execute(
+            f"""
+            SELECT partner_id, credit, start_chat_time IS NOT NULL AND {SQL_NOW} - start_chat_time >= ?
+            FROM users WHERE user_id=? AND status=?
+            """,
+            (min_duration, user_id, UserStatus.COUPLED),
+        )
+        row = c.fetchone()
+        if not row or row[0] is None:
+            # If the user is not coupled, return None
+            conn.rollback()
+            return None
+
+        partner_id, user_credit, long_enough = row
+        c.execute("SELECT credit FROM users WHERE user_id=?", (partner_id,))
+        partner_credit = c.fetchone()[0]
+
+        # If toxic, reduce user credit by 25, the partner earns 5 if the chat lasted long enough
+        # Otherwise both users earn 5 if the chat lasted long enough
+        if reward:
+            if toxic:
+                user_credit -= 25
+                partner_credit += 5 if long_enough else 0
+
+            elif long_enough:
+                user_credit += 5
+                partner_credit += 5
+
+        # Set credit values within bounds
+        user_credit = max(0, min(100, user_credit))
+        partner_credit = max(0, min(100, partner_credit))
+
+        # Update both users to reflect the uncoupling
+        c.executemany(
+            "UPDATE users SET partner_id=?, start_chat_time=?, status=?, credit=? WHERE user_id=?",
+            (
+                (None, None, UserStatus.IDLE, user_credit, user_id),
+                (None, None, UserStatus.IDLE, partner_credit, partner_id),
+            ),
+        )
+
+        # Commit changes
+        conn.commit()
+
+    except Exception:
+        conn.rollback()
+        raise
+
+    update_cached_user(
+        user_id, partner_id=None, start_chat_time=None, status=UserStatus.IDLE, credit=user_credit
+    )
+    update_cached_user(
+        partner_id, partner_id=None, start_chat_time=None, status=UserStatus.IDLE, credit=partner_credit
+    )
+
+    return {
+        "partner_id": partner_id,
+        "user_credit": user_credit,
+        "user_status": UserStatus.IDLE,
+        "partner_credit": partner_credit,
+        "partner_status": UserStatus.IDLE,
+    }
+
+
+def set_user_blocked(user_id: int, blocked: bool=True) -> None:
+    conn, c = connect_to_db()  # Get the pooled connection
+
+    # Flag (or unflag) the user as having blocked the bot
+    c.execute("UPDATE users SET blocked=? WHERE user_id=?", (blocked, user_id))
+
+    # Commit changes
     conn.commit()
-    conn.close()
+
+
+def start_broadcast(kind: str, once: bool = False) -> int | None:
+    conn, c = connect_to_db()  # Get the pooled connection
+
+    # Id of the broadcast to deliver, None if there is nothing to send
+
+    with conn:
+        # With once, an announcement that is already the last one delivered is not sent again
+        # (e.g. the offline notice the bot finished sending itself before exiting)
+        if once:
+            c.execute("SELECT kind, finished FROM broadcasts ORDER BY broadcast_id DESC LIMIT 1")
+            row = c.fetchone()
+            if row is not None and row[0] == kind and row[1]:
+                return None
+
+        # Announcements of another kind are outdated (e.g. an interrupted offline notice once back online)
+        c.execute("UPDATE broadcasts SET finished=1 WHERE finished=0 AND kind!=?", (kind,))
+
+        # Resume the unfinished broadcast of the same kind, or start a new one
+        c.execute(
+            "SELECT broadcast_id FROM broadcasts WHERE finished=0 AND kind=? ORDER BY broadcast_id DESC",
+            (kind,),
+        )
+        row = c.fetchone()
+        if row:
+            return row[0]
+
+        c.execute(
+            f"INSERT INTO broadcasts (kind, created) VALUES (?, {SQL_NOW})", (kind,)
+        )
+
+        return c.lastrowid
+
+
+def get_broadcast_recipients(broadcast_id: int) -> list:
+    conn, c = connect_to_db()  # Get the pooled connection
+
+    # Get the users who have not been handled by the broadcast yet
+    c.execute(
+        """
+        SELECT user_id FROM users
+        WHERE blocked=0 AND user_id NOT IN (
+            SELECT user_id FROM broadcast_deliveries WHERE broadcast_id=?
+        )
+        ORDER BY user_id
+        """,
+        (broadcast_id,),
+    )
+
+    return [row[0] for row in c.fetchall()]
+
+
+def record_broadcast_deliveries(broadcast_id: int, deliveries: list[tuple]) -> None:
+    conn, c = connect_to_db()  # Get the pooled connection
+
+    # Checkpoint a batch of (user_id, outcome) deliveries, blocked users are pruned from future broadcasts
+    with conn:
+        c.executemany(
+            "INSERT OR REPLACE INTO broadcast_deliveries (broadcast_id, user_id, outcome) VALUES (?, ?, ?)",
+            [(broadcast_id, user_id, outcome) for user_id, outcome in deliveries],
+        )
+        c.executemany(
+            "UPDATE users SET blocked=1 WHERE user_id=?",
+            [(user_id,) for user_id, outcome in deliveries if outcome == "blocked"],
+        )
+
+
+def finish_broadcast(broadcast_id: int) -> dict:
+    conn, c = connect_to_db()  # Get the pooled connection
+
+    with conn:
+        # Summarize the checkpoint into the broadcasts row, then drop it
+        c.execute(
+            "SELECT outcome, COUNT(*) FROM broadcast_deliveries WHERE broadcast_id=? GROUP BY outcome",
+            (broadcast_id,),
+        )
+        outcomes = dict(c.fetchall())
+        c.execute(
+            "UPDATE broadcasts SET finished=1, sent=?, blocked=?, failed=? WHERE broadcast_id=?",
+            (
+                outcomes.get("sent", 0),
+                outcomes.get("blocked", 0),
+                outcomes.get("failed", 0),
+                broadcast_id,
+            ),
+        )
+        c.execute("DELETE FROM broadcast_deliveries WHERE broadcast_id=?", (broadcast_id,))
+
+    return outcomes
+
+
+def get_media_score(file_unique_id: str, fingerprint: str, max_age: float=MEDIA_SCORE_TTL) -> float:
+    """
+    NSFW score of an already moderated file.
+    :param file_unique_id: file_unique_id of the media
+    :param fingerprint: classifier the score must come from
+    :param max_age: seconds the score is trusted for
+    :return: the stored score, None if the file was never seen, was scored by another classifier or too long ago
+    """
+    entry = media_cache.get(file_unique_id)
+    if entry is None:
+        conn, c = connect_to_db()  # Get the pooled connection
+        c.execute(
+            "SELECT score, fingerprint, file_size, checked FROM media_scores WHERE file_unique_id=?",
+            (file_unique_id,),
+        )
+        row = c.fetchone()
+        if row is not None:
+            entry = tuple(row)
+            media_cache.set(file_unique_id, entry)
+
+    # Scores of another classifier or past their time to live are moderated again, and replaced
+    if entry is None or entry[1] != fingerprint or entry[3] < time.time() - max_age:
+        media_counters["misses"] += 1
+        return None
+
+    media_counters["hits"] += 1
+    media_counters["bytes_saved"] += entry[2]
+
+    return entry[0]
+
+
+def set_media_score(file_unique_id: str, score: float, fingerprint: str, file_size: int) -> None:
+    conn, c = connect_to_db()  # Get the pooled connection
+
+    # Store the score of a moderated file
+    checked = int(time.time())
+    c.execute(
+        """
+        INSERT OR REPLACE INTO media_scores (file_unique_id, score, fingerprint, file_size, checked)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        (file_unique_id, score, fingerprint, file_size, checked),
+    )
+
+    # Commit changes
+    conn.commit()
+    media_cache.set(file_unique_id, (score, fingerprint, file_size, checked))
+
+
+def is_sticker_set_allowed(set_name: str) -> bool:
+    conn, c = connect_to_db()  # Get the pooled connection
+    validate_user_cache(conn)
+
+    # Serve the allowlisted state from the cache, read it from the database on a miss
+    allowed = sticker_set_cache.get(set_name)
+    if allowed is None:
+        c.execute("SELECT 1 FROM sticker_set_allowlist WHERE set_name=?", (set_name,))
+        allowed = c.fetchone() is not None
+        sticker_set_cache.set(set_name, allowed)
+
+    if allowed:
+        media_counters["allowlisted"] += 1
+
+    return allowed
+
+
+def set_sticker_set_allowed(set_name: str, allowed: bool=True) -> None:
+    conn, c = connect_to_db()  # Get the pooled connection
+
+    # Add the sticker set to the allowlist, or remove it
+    if allowed:
+        c.execute(
+            f"INSERT OR IGNORE INTO sticker_set_allowlist (set_name, added) VALUES (?, {SQL_NOW})",
+            (set_name,),
+        )
+    else:
+        c.execute("DELETE FROM sticker_set_allowlist WHERE set_name=?", (set_name,))
+
+    # Commit changes
+    conn.commit()
+    sticker_set_cache.pop(set_name)
+
+
+def get_allowed_sticker_sets() -> list:
+    conn, c = connect_to_db()  # Get the pooled connection
+
+    # Get the allowlisted sticker sets, most recent first
+    c.execute("SELECT set_name FROM sticker_set_allowlist ORDER BY added DESC")
+
+    return [row[0] for row in c.fetchall()]
+
+
+def get_media_stats() -> dict:
+    # Counters of the media score store
+    lookups = media_counters["hits"] + media_counters["misses"]
+
+    return {
+        **media_counters,
+        "cached": len(media_cache),
+        "hit_rate": media_counters["hits"] / lookups if lookups else 0.0,
+    }
 
 
 def retrieve_users_number() -> tuple[int, int]:
-    conn, c = connect_to_db()  # Connect to the chatbot database
+    conn, c = connect_to_db()  # Get the pooled connection
 
     # Retrieve the number of users in the users table
     c.execute("SELECT COUNT(*) FROM users")
@@ -378,25 +954,24 @@ def retrieve_users_number() -> tuple[int, int]:
     c.execute("SELECT COUNT(*) FROM users WHERE status='coupled'")
     paired_users_number = c.fetchone()[0]
 
-    # Close connection
-    conn.close()
-
     return total_users_number, paired_users_number
 
 
 def reset_users_status() -> None:
-    conn, c = connect_to_db()  # Connect to the chatbot database
+    conn, c = connect_to_db()  # Get the pooled connection
 
-    # Reset the status of all users to UserStatus.IDLE
+    # Reset the status of all users to UserStatus.IDLE, searching users included: conversation states are not
+    # persisted, so nobody can chat before sending /start again and must not be paired until then
     c.execute(
-        "UPDATE users SET start_bot_time=?, start_chat_time=?, status=?",
+        "UPDATE users SET start_bot_time=?, start_chat_time=?, partner_id=?, status=?",
         (
+            None,
             None,
             None,
             UserStatus.IDLE,
         ),
     )
 
-    # Commit and close connection
+    # Commit changes
     conn.commit()
-    conn.close()
+    user_cache.clear()
@@ -1,74 +1,79 @@
+import asyncio
 import logging
 import os
 
 from telegram.ext import (
     Application,
     ApplicationBuilder,
+    BaseUpdateProcessor,
     ChatMemberHandler,
     CommandHandler,
     MessageHandler,
     filters,
 )
 
+import async_db
 import db_connection
+import moderation_pool
 from bot_handler import *
-from config import BOT_TOKEN
+from broadcast import broadcast
+from text_batcher import text_batcher
+from toxic_handler import warm_up
+from update_processor import PerUserUpdateProcessor
 from LogHandler import LogHandler
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[
-        LogHandler(),
-        logging.StreamHandler(),
-    ],
-)
-
 
 async def turn_online(application: Application) -> None:
-    # Process for post_init
-    db_connection.set_bot_status(True, os.getpid())
-    user_ids = db_connection.get_all_user_ids()
-    for user_id in user_ids:
-        await application.bot.send_message(
+    # Process for post_init, warm-up and announcement run in the background so polling starts right away
+    await async_db.set_bot_status(True, os.getpid())
+    application.bot_data["warm_up"] = asyncio.create_task(warm_up())
+    application.bot_data["online_broadcast"] = asyncio.create_task(
+        broadcast(
+            application.bot,
+            "online",
             reply_markup=ReplyKeyboardMarkup(
                 [["/start"]],
                 resize_keyboard=True,
                 one_time_keyboard=True,
                 is_persistent=True,
             ),
-            chat_id=user_id,
             text=responses.turn_online,
         )
+    )
 
 
 async def turn_offline(application: Application) -> None:
-    # Process for post_stop
-    db_connection.set_bot_status(False, 0)
-    user_ids = db_connection.get_all_user_ids()
-    for user_id in user_ids:
-        await application.bot.send_message(
-            reply_markup=ReplyKeyboardRemove(),
-            chat_id=user_id,
-            text=responses.turn_offline,
-        )
+    # Process for post_stop, interrupt the online announcement if it is still running (its progress is kept)
+    online_broadcast = application.bot_data.get("online_broadcast")
+    if online_broadcast is not None and not online_broadcast.done():
+        online_broadcast.cancel()
+        await asyncio.gather(online_broadcast, return_exceptions=True)
 
+    await async_db.set_bot_status(False, 0)
+    await broadcast(
+        application.bot,
+        "offline",
+        reply_markup=ReplyKeyboardRemove(),
+        text=responses.turn_offline,
+    )
 
-if __name__ == "__main__":
+
+def build_application(builder: ApplicationBuilder, update_processor: BaseUpdateProcessor = None) -> Application:
+    """
+    Build the bot application and register its handlers.
+    :param builder: ApplicationBuilder with the bot (or its token) already set
+    :param update_processor: how updates are processed, by default concurrently across users and in order per user
+    :return: the application, ready to be run
+    """
+    # Different users are handled concurrently, so their moderation requests can be batched together
     application = (
-        ApplicationBuilder()
-        .token(BOT_TOKEN)
+        builder
+        .concurrent_updates(update_processor or PerUserUpdateProcessor())
         .post_init(turn_online)
         .post_stop(turn_offline)
         .build()
     )
 
-    # Create the database, if not already present
-    db_connection.create_db()
-
-    # Reset the status of all the previous existent users to IDLE, if the bot is restarted
-    db_connection.reset_users_status()
-
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler("start", start)],
         states={
@@ -96,4 +101,34 @@ if __name__ == "__main__":
         fallbacks=[MessageHandler(filters.TEXT, handle_not_in_chat)],
     )
     application.add_handler(conv_handler)
+
+    return application
+
+
+if __name__ == "__main__":
+    from config import BOT_TOKEN
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        handlers=[
+            LogHandler(),
+            logging.StreamHandler(),
+        ],
+    )
+
+    # Create the database, if not already present
+    db_connection.create_db()
+
+    # Reset the status of all the previous existent users to IDLE and empty the search queue, if the bot is restarted
+    db_connection.reset_users_status()
+
+    application = build_application(ApplicationBuilder().token(BOT_TOKEN))
     application.run_polling()
+
+    logging.info(f"Text verdict cache: {text_batcher.get_cache_stats()}")
+    logging.info(f"Media score store: {db_connection.get_media_stats()}")
+
+    # Stop the moderation workers and the DB thread, release the pooled database connections
+    moderation_pool.shutdown()
+    async_db.shutdown()
@@ -0,0 +1,61 @@
+import threading
+from collections import OrderedDict
+
+import db_connection
+
+
+class Matchmaker:
+    """
+    FIFO waiting queue of users searching for a partner.
+    The queue lives in memory only, for O(1) pairing: it starts empty when the bot restarts and searching
+    users are set back to idle (see db_connection.reset_users_status).
+    """
+
+    def __init__(self):
+        self._queue: OrderedDict[int, None] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def __contains__(self, user_id: int) -> bool:
+        return int(user_id) in self._queue
+
+    def search(self, user_id: int) -> int:
+        """
+        Put the user in search and pair it with the longest waiting user, if any.
+        :param user_id: user starting the search
+        :return: the partner's id if the user was paired, None if it is now waiting in the queue
+        """
+        user_id = int(user_id)
+
+        with self._lock:
+            if user_id in self._queue:
+                # Already waiting, never hand out a second session
+                return None
+
+            db_connection.enqueue_search(user_id)
+
+            while self._queue:
+                other_user_id, _ = self._queue.popitem(last=False)
+
+                # Pairing is a single transaction that fails if the other user stopped searching meanwhile
+                if db_connection.couple(user_id, other_user_id):
+                    return other_user_id
+
+            # Nobody is waiting, keep the user in the queue
+            self._queue[user_id] = None
+
+            return None
+
+    def cancel(self, user_id: int) -> None:
+        # Remove the user from the queue and set it back to idle
+        user_id = int(user_id)
+
+        with self._lock:
+            self._queue.pop(user_id, None)
+            db_connection.dequeue_search(user_id)
+
+
+# Shared matchmaker used by the bot handlers
+matchmaker = Matchmaker()
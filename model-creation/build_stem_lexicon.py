@@ -0,0 +1,57 @@
+"""
+Precompute the Sastrawi stems of the vocabulary the bot sees, for text_preprocess/text_preprocessing.
+
+Run from the repository root:
+    python model-creation/build_stem_lexicon.py [traffic.txt ...]
+
+Words are collected from every dataset in model-creation/data, from the values of the slang dictionary
+and from the optional traffic files (one message per line). The result is written to
+text_preprocess/stem_lexicon.bin, memory-mapped by the bot at startup. Words missing from it are
+still stemmed by Sastrawi. The lexicon is ignored once Sastrawi's dictionary or the slang file changes:
+rebuild it after editing them.
+"""
+import csv
+import glob
+import sys
+
+sys.path.insert(0, ".")
+
+from text_preprocess import text_preprocessing
+from text_preprocess.stem_lexicon import StemLexicon, write_lexicon
+
+# Text columns of the datasets in model-creation/data
+TEXT_COLUMNS = ("Text", "Tweet", "original_text", "processed_text")
+
+
+def iter_texts(traffic_paths: list[str]):
+    # Dataset texts, then observed messages
+    for path in sorted(glob.glob("model-creation/data/**/*.csv", recursive=True)):
+        with open(path, encoding="utf-8", errors="replace", newline="") as f:
+            for row in csv.DictReader(f):
+                yield from (row[column] for column in TEXT_COLUMNS if row.get(column))
+
+    for path in traffic_paths:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            yield from f
+
+
+if __name__ == "__main__":
+    text_preprocessing.load_resources()
+
+    words = set()
+    for text in iter_texts(sys.argv[1:]):
+        words.update(text_preprocessing.iter_stem_words(text))
+
+    # Words that slang replacements introduce, normalized like the stemmer does
+    for replacement in text_preprocessing.slang_dict.values():
+        for word in replacement.split():
+            normalized = text_preprocessing.stem_normalize_pattern.sub(" ", word.lower())
+            words.update(part for part in normalized.split(" ") if part)
+
+    stems = {word: text_preprocessing.stemmer.delegatedStemmer.stem_word(word) for word in words}
+    write_lexicon(text_preprocessing.stem_lexicon_path, text_preprocessing.stem_lexicon_sources, stems)
+
+    # Read the file back to check every entry
+    lexicon = StemLexicon(text_preprocessing.stem_lexicon_path, text_preprocessing.stem_lexicon_sources)
+    assert all(lexicon.get(word) == stem for word, stem in stems.items())
+    print(f"Saved {len(lexicon)} stems to {text_preprocessing.stem_lexicon_path}")
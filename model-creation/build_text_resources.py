@@ -0,0 +1,48 @@
+"""
+Compile the text preprocessing resources of text_preprocess/text_preprocessing into one binary bundle.
+
+Run from the repository root:
+    python model-creation/build_text_resources.py
+
+The stop words (stopwordbahasa.csv), the slang dictionary (combined_slang_words.txt) and Sastrawi's
+stemmer dictionary are written to text_preprocess/resources.bin, loaded by the bot without parsing
+them. The bundle is ignored, and the sources parsed again, once a source file changes or another
+Python version reads it: rebuild it after editing the sources or upgrading Python.
+"""
+import json
+import sys
+
+sys.path.insert(0, ".")
+
+from text_preprocess import text_preprocessing
+from text_preprocess.resource_bundle import read_bundle, read_dictionary_words, read_stop_words, write_bundle
+
+if __name__ == "__main__":
+    stop_words = read_stop_words(text_preprocessing.stop_words_path)
+    with open(text_preprocessing.slang_path, "r", encoding="utf-8") as f:
+        slang_dict = json.load(f)
+    dictionary_words = read_dictionary_words()
+
+    # The CSV reader must agree with the pandas parsing it replaces
+    try:
+        import pandas as pd
+    except ImportError:
+        pass
+    else:
+        assert stop_words == frozenset(pd.read_csv(text_preprocessing.stop_words_path, header=None)[0].tolist())
+
+    write_bundle(
+        text_preprocessing.resource_bundle_path,
+        text_preprocessing.resource_sources,
+        stop_words,
+        slang_dict,
+        dictionary_words,
+    )
+
+    # Read the file back to check every resource
+    resources = read_bundle(text_preprocessing.resource_bundle_path, text_preprocessing.resource_sources)
+    assert resources == (stop_words, slang_dict, tuple(dictionary_words))
+    print(
+        f"Saved {len(stop_words)} stop words, {len(slang_dict)} slang words and {len(dictionary_words)} "
+        f"dictionary words to {text_preprocessing.resource_bundle_path}"
+    )
@@ -0,0 +1,76 @@
+"""
+Export the IndoBERT toxicity model for the alternative inference backends of model_handler.
+
+Run from the repository root:
+    python model-creation/export_text_model.py
+
+Produces, next to model.pth in model-creation/model-export:
+    model-int8.pth   dynamically int8-quantized PyTorch model ("torch-int8")
+    model.onnx       ONNX export ("onnx", needs onnx and onnxruntime)
+    model-int8.onnx  dynamically int8-quantized ONNX export ("onnx-int8")
+"""
+import torch
+from transformers import BertTokenizer
+
+model_path = "model-creation/model-export"
+
+
+class LogitsOnly(torch.nn.Module):
+    # Wrap the classifier so the exported graph has plain tensor inputs and a single output
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask, token_type_ids):
+        return self.model(
+            input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids
+        ).logits
+
+
+def export_quantized(model) -> None:
+    # Dynamic quantization: int8 weights for every Linear layer, activations quantized on the fly
+    quantized = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    torch.save(quantized, f"{model_path}/model-int8.pth")
+
+
+def export_onnx(model, tokenizer) -> None:
+    # Trace with a sample batch, batch size and sequence length stay dynamic
+    sample = tokenizer(
+        ["contoh kalimat", "contoh kalimat yang lebih panjang"],
+        padding=True,
+        return_tensors="pt",
+    )
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in sample}
+    dynamic_axes["logits"] = {0: "batch"}
+
+    torch.onnx.export(
+        LogitsOnly(model),
+        (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"]),
+        f"{model_path}/model.onnx",
+        input_names=["input_ids", "attention_mask", "token_type_ids"],
+        output_names=["logits"],
+        dynamic_axes=dynamic_axes,
+        opset_version=17,
+        dynamo=False,
+    )
+
+    # Int8 weights for the ONNX graph as well
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(
+        f"{model_path}/model.onnx",
+        f"{model_path}/model-int8.onnx",
+        weight_type=QuantType.QInt8,
+    )
+
+
+if __name__ == "__main__":
+    model = torch.load(f"{model_path}/model.pth", weights_only=False)
+    model.eval()
+    tokenizer = BertTokenizer.from_pretrained(model_path)
+
+    export_quantized(model)
+    print(f"Saved {model_path}/model-int8.pth")
+
+    export_onnx(model, tokenizer)
+    print(f"Saved {model_path}/model.onnx and {model_path}/model-int8.onnx")
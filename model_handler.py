@@ -1,12 +1,108 @@
+import itertools
+import os
+import threading
+from collections.abc import Iterable, Iterator
+
 import torch
 from PIL import Image
-from transformers import BertTokenizer, pipeline
 
-# Load the model and tokenizer for text detection
+# Text inference backend:
+#   "torch"      float32 PyTorch model (model.pth)
+#   "torch-int8" dynamically int8-quantized PyTorch model (model-int8.pth, or quantized at load time)
+#   "onnx"       ONNX Runtime on model.onnx
+#   "onnx-int8"  ONNX Runtime on the int8-quantized model-int8.onnx
+# The exported files are produced by model-creation/export_text_model.py
+TEXT_BACKEND = "torch"
+text_backends = ("torch", "torch-int8", "onnx", "onnx-int8")
+
 model_path = "model-creation/model-export"
-bert_model = torch.load(f"{model_path}/model.pth")
-tokenizer = BertTokenizer.from_pretrained(model_path)
-bert_model.eval()  # Set model to evaluation mode
+
+# NSFW image classifier, a Hugging Face Hub model id (or a local directory)
+nsfw_model_name = "Falconsai/nsfw_image_detection"
+
+
+def load_text_model(backend: str = TEXT_BACKEND):
+    """
+    Load the toxicity model with the selected inference backend.
+    :param backend: one of text_backends
+    :return: function mapping the tokenizer's PyTorch tensors to the model's logits
+    """
+    if backend in ("torch", "torch-int8"):
+        quantized_path = f"{model_path}/model-int8.pth"
+
+        if backend == "torch-int8" and os.path.exists(quantized_path):
+            model = torch.load(quantized_path, weights_only=False)
+
+        else:
+            # The export is a pickled model, not a state dict
+            model = torch.load(f"{model_path}/model.pth", weights_only=False)
+
+            if backend == "torch-int8":
+                model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+        model.eval()  # Set model to evaluation mode
+
+        def run(inputs: dict) -> torch.Tensor:
+            with torch.no_grad():
+                return model(**inputs).logits
+
+        return run
+
+    if backend in ("onnx", "onnx-int8"):
+        # Optional dependency, only needed for the ONNX backends
+        import onnxruntime
+
+        filename = "model-int8.onnx" if backend == "onnx-int8" else "model.onnx"
+        session = onnxruntime.InferenceSession(
+            f"{model_path}/{filename}", providers=["CPUExecutionProvider"]
+        )
+        input_names = {model_input.name for model_input in session.get_inputs()}
+
+        def run(inputs: dict) -> torch.Tensor:
+            feeds = {name: tensor.numpy() for name, tensor in inputs.items() if name in input_names}
+            return torch.from_numpy(session.run(["logits"], feeds)[0])
+
+        return run
+
+    raise ValueError(f"Unknown text backend '{backend}', expected one of {text_backends}")
+
+
+def get_text_model_fingerprint(backend: str = TEXT_BACKEND) -> str:
+    """
+    Identify the loaded text model, so cached scores are dropped when the model files are replaced.
+    :param backend: one of text_backends
+    :return: the backend with the size and modification time of every model file
+    """
+    parts = [backend]
+    for filename in ("model.pth", "model-int8.pth", "model.onnx", "model-int8.onnx", "vocab.txt"):
+        path = f"{model_path}/{filename}"
+        if os.path.exists(path):
+            stat = os.stat(path)
+            parts.append(f"{filename}:{stat.st_size}:{stat.st_mtime_ns}")
+
+    return "|".join(parts)
+
+
+def get_nsfw_model_fingerprint() -> str:
+    """
+    Identify the NSFW classifier, so stored media scores are dropped when the model is replaced.
+    :return: the model name with its cached Hub revision, or with the size and modification time of its local files
+    """
+    parts = [nsfw_model_name]
+    if os.path.isdir(nsfw_model_name):
+        for filename in sorted(os.listdir(nsfw_model_name)):
+            stat = os.stat(f"{nsfw_model_name}/{filename}")
+            parts.append(f"{filename}:{stat.st_size}:{stat.st_mtime_ns}")
+
+    else:
+        from huggingface_hub import try_to_load_from_cache
+
+        # Cached files live in snapshots/<commit hash>/
+        config_path = try_to_load_from_cache(nsfw_model_name, "config.json")
+        parts.append(os.path.basename(os.path.dirname(config_path)) if isinstance(config_path, str) else "not cached")
+
+    return "|".join(parts)
+
 
 # Define category labels and their respective thresholds
 category_columns = ['Hate Speech', 'Abusive Speech', 'SARA', 'Radicalism', 'Defamation']
@@ -18,8 +114,140 @@ thresholds = {
     'Defamation': 0.20
 }
 
-# Initialize the NSFW detector model
-nsfw_model = pipeline("image-classification", model="Falconsai/nsfw_image_detection")
+# Thresholds as a tensor aligned with category_columns, for vectorized comparison
+threshold_tensor = torch.tensor([thresholds[category] for category in category_columns])
+
+# Sequence lengths batches are padded to, a text goes to the smallest bucket fitting its tokens
+TOKEN_BUCKETS = (16, 32, 64, 128)
+
+# Models are loaded lazily by load_models(), on first use or by the warm-up task
+run_text_model = None
+empty_text_scores: list[float] = None
+tokenizer = None
+nsfw_model = None
+models_loaded = False
+_load_lock = threading.Lock()
+
+
+def load_models() -> None:
+    # Load the text model, its tokenizer and the NSFW detector, only once
+    global run_text_model, tokenizer, nsfw_model, models_loaded
+
+    if models_loaded:
+        return
+
+    with _load_lock:
+        if models_loaded:
+            return
+
+        # transformers is slow to import, defer it until the models are needed
+        from transformers import BertTokenizerFast, pipeline
+
+        # Load the model and tokenizer for text detection
+        run_text_model = load_text_model(TEXT_BACKEND)
+        tokenizer = BertTokenizerFast.from_pretrained(model_path)  # Rust tokenizer built from vocab.txt
+
+        # Initialize the NSFW detector model
+        nsfw_model = pipeline("image-classification", model=nsfw_model_name)
+
+        models_loaded = True
+
+
+def score_text_batch(texts: list[str]) -> torch.Tensor:
+    """
+    Category probabilities of non-empty texts, with one forward pass per length bucket.
+    :param texts: input texts to analyze
+    :return: tensor of shape (len(texts), len(category_columns))
+    """
+    encodings = tokenizer(texts, truncation=True, max_length=TOKEN_BUCKETS[-1])
+
+    # Group the texts by bucket so short messages are not padded to the longest one of the batch
+    buckets = {}
+    for i, input_ids in enumerate(encodings["input_ids"]):
+        bucket = next(length for length in TOKEN_BUCKETS if len(input_ids) <= length)
+        buckets.setdefault(bucket, []).append(i)
+
+    probabilities = torch.empty(len(texts), len(category_columns))
+    for bucket, indices in buckets.items():
+        inputs = tokenizer.pad(
+            {name: [values[i] for i in indices] for name, values in encodings.items()},
+            padding="max_length",
+            max_length=bucket,
+            return_tensors="pt",
+        )
+        probabilities[indices] = torch.sigmoid(run_text_model(inputs))
+
+    return probabilities
+
+
+def score_texts(texts: list[str]) -> torch.Tensor:
+    """
+    Category probabilities of preprocessed texts, empty ones included.
+    :param texts: input texts to analyze
+    :return: tensor of shape (len(texts), len(category_columns))
+    """
+    global empty_text_scores
+
+    load_models()
+
+    # Texts left empty by preprocessing always get the same scores, computed once
+    if empty_text_scores is None and "" in texts:
+        empty_text_scores = score_text_batch([""])[0].tolist()
+
+    empty = [i for i, text in enumerate(texts) if not text]
+    non_empty = [i for i, text in enumerate(texts) if text]
+
+    probabilities = torch.empty(len(texts), len(category_columns))
+    if empty:
+        probabilities[empty] = torch.tensor(empty_text_scores)
+    if non_empty:
+        probabilities[non_empty] = score_text_batch([texts[i] for i in non_empty])
+
+    return probabilities
+
+
+def predict_toxic_text_scores(texts: list[str]) -> tuple[list[bool], list[dict]]:
+    """
+    Predict toxicity for a batch of texts.
+    :param texts: input texts to analyze
+    :return: per-text verdicts (True if toxic in any category) and per-text category scores
+    """
+    probabilities = score_texts(texts)
+
+    # Apply category-specific thresholds to the whole batch at once
+    verdicts = (probabilities >= threshold_tensor).any(dim=1).tolist()
+    scores = [dict(zip(category_columns, row)) for row in probabilities.tolist()]
+
+    return verdicts, scores
+
+
+# Texts scored per forward pass by predict_toxic_texts, split further by length bucket
+BULK_BATCH_SIZE = 64
+
+
+def predict_toxic_texts(
+    texts: Iterable[str], batch_size: int = BULK_BATCH_SIZE
+) -> Iterator[tuple[torch.Tensor, torch.Tensor]]:
+    """
+    Predict toxicity for a stream of preprocessed texts, holding one batch in memory at a time.
+    :param texts: input texts to analyze, in any iterable (a generator, a file...)
+    :param batch_size: texts scored together
+    :return: per batch, in input order, the verdicts (bool tensor of shape (n,)) and the category
+        probabilities (tensor of shape (n, len(category_columns)))
+    """
+    texts = iter(texts)
+    while batch := list(itertools.islice(texts, batch_size)):
+        probabilities = score_texts(batch)
+        yield (probabilities >= threshold_tensor).any(dim=1), probabilities
+
+
+def is_toxic_scores(scores: dict) -> bool:
+    """
+    Apply the current category thresholds to previously computed scores.
+    :param scores: per-category scores returned by predict_toxic_text_scores
+    :return: True if toxic in any category, False otherwise
+    """
+    return any(scores[category] >= thresholds[category] for category in category_columns)
 
 
 def predict_toxic_text(text: str) -> bool:
@@ -28,23 +256,24 @@ def predict_toxic_text(text: str) -> bool:
     :param text: input text to analyze
     :return: True if toxic in any category, False otherwise
     """
-    inputs = tokenizer(
-        text, padding=True, truncation=True, max_length=128, return_tensors="pt"
-    )
-    with torch.no_grad():
-        outputs = bert_model(**inputs)
-        probabilities = torch.sigmoid(outputs.logits).squeeze().numpy()
+    verdicts, _ = predict_toxic_text_scores([text])
 
-    # Apply category-specific thresholds
-    for i, prob in enumerate(probabilities):
-        category = category_columns[i]
-        if prob >= thresholds[category]:
-            return True
-    return False
+    return verdicts[0]
 
 
-def predict_toxic_image(image: any) -> bool:
+# NSFW score above which an image is considered toxic
+NSFW_THRESHOLD = 0.7
+
+
+def predict_nsfw_score(image: any) -> float:
+    """
+    Score an image with the NSFW detector.
+    :param image: PIL image, path or file-like object
+    :return: probability of the 'nsfw' label, 0.0 if the image could not be processed
+    """
     try:
+        load_models()
+
         # Check if parameter is already an instance of Image.Image
         if not isinstance(image, Image.Image):
             image = Image.open(image)
@@ -55,13 +284,30 @@ def predict_toxic_image(image: any) -> bool:
         for prediction in predictions:
             # Check if the label is 'nsfw' and extract the score
             if prediction["label"] == "nsfw":
-                nsfw_score = prediction["score"]
-
-                # If the 'nsfw' score exceeds the threshold, consider it NSFW
-                if nsfw_score > 0.7:
-                    return True
+                return prediction["score"]
 
     except Exception as e:
         print(f"Error processing image: {e}")
 
-    return False
+    return 0.0
+
+
+def predict_nsfw_scores(images: list[Image.Image]) -> list[float]:
+    """
+    Score several images with a single batched call of the NSFW detector.
+    :param images: PIL images
+    :return: probability of the 'nsfw' label of every image
+    """
+    load_models()
+
+    predictions = nsfw_model(images, batch_size=len(images))
+
+    return [
+        next((prediction["score"] for prediction in image_predictions if prediction["label"] == "nsfw"), 0.0)
+        for image_predictions in predictions
+    ]
+
+
+def predict_toxic_image(image: any) -> bool:
+    # If the 'nsfw' score exceeds the threshold, consider it NSFW
+    return predict_nsfw_score(image) > NSFW_THRESHOLD
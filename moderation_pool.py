@@ -0,0 +1,92 @@
+import asyncio
+import logging
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+# "thread" shares the loaded models between workers (PyTorch releases the GIL during inference),
+# "process" also isolates the pure Python decoding (lottie, imageio) from the bot process
+POOL_KIND = "thread"
+
+# Workers of each lane: text moderation (preprocessing and batched inference) has its own workers,
+# so a message never queues behind media decoding and image inference
+POOL_WORKERS = {"text": 2, "media": 2}
+
+# Moderation requests allowed per lane (running or queued), further requests wait for a slot
+MAX_PENDING = 32
+
+# Seconds before a moderation request is abandoned
+REQUEST_TIMEOUT = 15.0
+
+_executors: dict[str, Executor] = {}
+_slots: dict[str, asyncio.Semaphore] = {}
+
+
+def get_executor(lane: str) -> Executor:
+    # Create the pool of a lane on first use
+    if lane not in _executors:
+        if POOL_KIND == "process":
+            _executors[lane] = ProcessPoolExecutor(max_workers=POOL_WORKERS[lane])
+        else:
+            _executors[lane] = ThreadPoolExecutor(
+                max_workers=POOL_WORKERS[lane], thread_name_prefix=f"moderation-{lane}"
+            )
+
+    return _executors[lane]
+
+
+def release_slot(loop: asyncio.AbstractEventLoop, slots: asyncio.Semaphore) -> None:
+    # Called by the pool once a request is done, the slot is released on the event loop
+    try:
+        loop.call_soon_threadsafe(slots.release)
+
+    except RuntimeError:
+        # The event loop is already closed
+        pass
+
+
+async def run(func, *args, lane: str = "media", timeout: float = REQUEST_TIMEOUT, default=None):
+    """
+    Run a blocking moderation function in the worker pool without blocking the event loop.
+    :param func: module-level function (it must be picklable for the process pool)
+    :param args: arguments of the function
+    :param lane: "text" or "media", each lane has its own workers and slots
+    :param timeout: seconds before giving up on the result
+    :param default: value returned if the request timed out
+    :return: the function's result, or default on timeout
+    """
+    if lane not in _slots:
+        _slots[lane] = asyncio.Semaphore(MAX_PENDING)
+    slots = _slots[lane]
+
+    # Worker processes receive pickled arguments, downloaded buffers are sent as bytes
+    if POOL_KIND == "process":
+        args = tuple(bytes(arg) if isinstance(arg, memoryview) else arg for arg in args)
+
+    # Bounded queue: wait for a free slot before submitting more work
+    await slots.acquire()
+    try:
+        work: Future = get_executor(lane).submit(func, *args)
+
+    except BaseException:
+        slots.release()
+        raise
+
+    # The slot is held until a worker is done with the request, not until the caller stops waiting:
+    # timed out requests still running in a worker keep counting against MAX_PENDING
+    loop = asyncio.get_running_loop()
+    work.add_done_callback(lambda _: release_slot(loop, slots))
+
+    try:
+        # A request abandoned before a worker picked it up is cancelled and never runs
+        return await asyncio.wait_for(asyncio.wrap_future(work), timeout)
+
+    except asyncio.TimeoutError:
+        state = "still running" if work.running() else "cancelled"
+        logging.warning(f"Moderation {func.__name__} timed out after {timeout}s ({state})")
+        return default
+
+
+def shutdown() -> None:
+    # Stop the workers, pending requests are dropped
+    for executor in _executors.values():
+        executor.shutdown(wait=False, cancel_futures=True)
+    _executors.clear()
@@ -18,6 +18,8 @@ toxic_stop_chat = "🤖 Kamu mengirimkan pesan toxic, chat akan diakhiri dan cre
 toxic_stopped_chat = "🤖 Chat diakhiri karena lawan bicara mengirimkan pesan toxic"
 credit_score = "🤖 Skor kredit kamu sekarang adalah : "
 incompatible_message = "🤖 Tipe pesan tidak disupport pada bot ini, pesan tidak terkirimkan"
+moderation_starting = "🤖 Bot baru saja dinyalakan dan sedang bersiap, pesanmu belum terkirim. Coba kirim lagi sebentar lagi"
+not_moderated = "🤖 Pesanmu tidak dapat diperiksa (file terlalu besar atau bot sedang sibuk) sehingga tidak terkirim. Coba kirim lagi"
 not_eligible = "🤖 Skor kreditmu adalah 0, kamu tidak dapat menggunakan fitur chat lagi"
 help = "🤖 Daftar Perintah\
         \n/start - 🤖 memulai bot\
@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db_connection
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    # Fresh database file with empty caches, every pooled connection reconnects to it
+    monkeypatch.setattr(db_connection, "DB_PATH", str(tmp_path / "test.db"))
+    db_connection.close_db()
+    db_connection.user_cache.clear()
+    db_connection.media_cache.clear()
+
+    yield db_connection.DB_PATH
+
+    db_connection.close_db()
+    db_connection.user_cache.clear()
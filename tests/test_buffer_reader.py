@@ -0,0 +1,60 @@
+import io
+
+from PIL import Image
+
+from toxic_handler import BufferReader
+
+DATA = bytes(range(256)) * 4
+
+
+def test_read_in_chunks():
+    reader = BufferReader(bytearray(DATA))
+
+    assert reader.read(10) == DATA[:10]
+    assert reader.tell() == 10
+    assert reader.read() == DATA[10:]
+    assert reader.read(10) == b""
+
+
+def test_seek():
+    reader = BufferReader(memoryview(DATA))
+
+    assert reader.seek(100) == 100
+    assert reader.read(2) == DATA[100:102]
+    assert reader.seek(-2, io.SEEK_CUR) == 100
+    assert reader.seek(-4, io.SEEK_END) == len(DATA) - 4
+    assert reader.read() == DATA[-4:]
+
+    # Past the end reads nothing, before the start is clamped
+    reader.seek(len(DATA) + 10)
+    assert reader.read(1) == b""
+    assert reader.seek(-10) == 0
+
+
+def test_readinto():
+    reader = BufferReader(DATA)
+    buffer = bytearray(8)
+
+    assert reader.readinto(buffer) == 8
+    assert bytes(buffer) == DATA[:8]
+    reader.seek(-3, io.SEEK_END)
+    assert reader.readinto(buffer) == 3
+    assert bytes(buffer[:3]) == DATA[-3:]
+
+
+def test_no_copy_of_the_buffer():
+    buffer = bytearray(DATA)
+    reader = BufferReader(buffer)
+    buffer[0] = 255
+
+    assert reader.read(1) == b"\xff"
+
+
+def test_decoders_read_it():
+    image = Image.new("RGB", (32, 16), (10, 20, 30))
+    data = io.BytesIO()
+    image.save(data, "PNG")
+
+    with Image.open(BufferReader(memoryview(data.getvalue()))) as decoded:
+        assert decoded.size == (32, 16)
+        assert decoded.convert("RGB").getpixel((0, 0)) == (10, 20, 30)
@@ -0,0 +1,83 @@
+import sqlite3
+import time
+
+import db_connection
+from UserStatus import UserStatus
+
+# Schema and values written by the first version of the bot: datetime.now() stored as local ISO text
+LEGACY_START = "2024-01-02 03:04:05.678901"
+
+
+def create_legacy_db(path: str) -> None:
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        """
+        CREATE TABLE users (
+            user_id TEXT PRIMARY KEY,
+            start_bot_time TIMESTAMP,
+            start_chat_time TIMESTAMP,
+            credit INT CHECK(credit >= 0 AND credit <= 100),
+            status TEXT,
+            partner_id TEXT
+        );
+        CREATE TABLE bot_status (online BOOLEAN, pid INTEGER);
+        INSERT INTO bot_status VALUES (1, 1234);
+        CREATE TABLE media_verdicts (file_unique_id TEXT PRIMARY KEY, toxic INTEGER);
+        CREATE TABLE search_queue (position INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT UNIQUE);
+        CREATE INDEX idx_users_partner_id ON users (partner_id);
+        """
+    )
+    conn.execute(
+        "INSERT INTO users VALUES ('1', ?, ?, 80, ?, '2')", (LEGACY_START, LEGACY_START, UserStatus.COUPLED)
+    )
+    conn.execute("INSERT INTO users VALUES ('2', ?, NULL, 100, ?, NULL)", (LEGACY_START, UserStatus.IDLE))
+    conn.commit()
+    conn.close()
+
+
+def test_legacy_database_is_migrated(database):
+    create_legacy_db(database)
+
+    db_connection.create_db()
+
+    conn, c = db_connection.connect_to_db()
+    assert c.execute("PRAGMA user_version").fetchone()[0] == db_connection.SCHEMA_VERSION
+
+    # Local ISO timestamps become epoch seconds, the other columns are kept
+    expected = int(time.mktime(time.strptime(LEGACY_START.split(".")[0], "%Y-%m-%d %H:%M:%S")))
+    rows = c.execute(
+        "SELECT user_id, start_bot_time, start_chat_time, credit, partner_id, blocked FROM users ORDER BY user_id"
+    ).fetchall()
+    assert rows == [("1", expected, expected, 80, "2", 0), ("2", expected, None, 100, None, 0)]
+    assert db_connection.get_user_credit(1) == 80
+    assert db_connection.get_partner_id(1) == "2"
+
+    # Tables and indexes of earlier versions are dropped
+    names = {row[0] for row in c.execute("SELECT name FROM sqlite_master")}
+    assert "media_verdicts" not in names
+    assert "search_queue" not in names
+    assert "idx_users_partner_id" not in names
+    assert {"media_scores", "broadcasts", "sticker_set_allowlist"} <= names
+
+
+def test_migration_runs_once(database):
+    create_legacy_db(database)
+    db_connection.create_db()
+    db_connection.set_user_start_bot_time(2)
+    start_bot_time = db_connection.get_user_row(2)["start_bot_time"]
+
+    # Opening the database again leaves migrated data untouched
+    db_connection.close_db()
+    db_connection.user_cache.clear()
+    db_connection.create_db()
+
+    assert db_connection.get_user_row(2)["start_bot_time"] == start_bot_time
+
+
+def test_new_database(database):
+    db_connection.create_db()
+    db_connection.insert_user(1)
+
+    conn, c = db_connection.connect_to_db()
+    assert c.execute("PRAGMA user_version").fetchone()[0] == db_connection.SCHEMA_VERSION
+    assert db_connection.get_user_status(1) == UserStatus.IDLE
@@ -0,0 +1,59 @@
+import pytest
+
+import db_connection
+from matchmaking import Matchmaker
+from UserStatus import UserStatus
+
+
+@pytest.fixture
+def matchmaker(database):
+    db_connection.create_db()
+    for user_id in range(1, 6):
+        db_connection.insert_user(user_id)
+
+    return Matchmaker()
+
+
+def test_first_user_waits(matchmaker):
+    assert matchmaker.search(1) is None
+    assert 1 in matchmaker
+    assert db_connection.get_user_status(1) == UserStatus.IN_SEARCH
+
+
+def test_pairs_with_waiting_user(matchmaker):
+    matchmaker.search(1)
+
+    assert matchmaker.search(2) == 1
+    assert db_connection.get_partner_id(2) == "1"
+    assert db_connection.get_partner_id(1) == "2"
+    assert db_connection.get_user_status(1) == UserStatus.COUPLED
+    assert len(matchmaker) == 0
+
+
+def test_search_twice_does_not_pair_with_itself(matchmaker):
+    matchmaker.search(1)
+
+    assert matchmaker.search(1) is None
+    assert len(matchmaker) == 1
+    assert matchmaker.search(2) == 1
+    assert len(matchmaker) == 0
+
+
+def test_cancel_leaves_queue(matchmaker):
+    matchmaker.search(1)
+    matchmaker.cancel(1)
+
+    assert 1 not in matchmaker
+    assert db_connection.get_user_status(1) == UserStatus.IDLE
+    assert matchmaker.search(2) is None
+
+
+def test_skips_users_no_longer_searching(matchmaker):
+    matchmaker.search(3)
+
+    # User 3 left the search through another path (e.g. a restart reset) while still in the queue
+    db_connection.set_user_status(3, UserStatus.IDLE)
+
+    assert matchmaker.search(4) is None
+    assert db_connection.get_partner_id(4) is None
+    assert list(matchmaker._queue) == [4]
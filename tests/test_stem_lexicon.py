@@ -0,0 +1,67 @@
+import pytest
+
+from text_preprocess import stem_lexicon
+from text_preprocess.stem_lexicon import StemLexicon, write_lexicon
+
+STEMS = {"makanan": "makan", "berlari": "lari", "kucing": "kucing", "dimakan": "makan", "sétan": "sétan"}
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "kata-dasar.txt"
+    path.write_text("makan\nlari\n", encoding="utf-8")
+
+    return str(path)
+
+
+def test_round_trip(tmp_path, source):
+    path = str(tmp_path / "lexicon.bin")
+    write_lexicon(path, [source], STEMS)
+
+    lexicon = StemLexicon(path, [source])
+    assert len(lexicon) == len(STEMS)
+    for word, stem in STEMS.items():
+        assert lexicon.get(word) == stem
+    assert lexicon.get("tidakada") is None
+    assert lexicon.get("makana") is None
+    lexicon.close()
+
+
+def test_many_words_probe_chains(tmp_path, source):
+    path = str(tmp_path / "lexicon.bin")
+    stems = {f"kata{i}": f"k{i}" for i in range(5000)}
+    write_lexicon(path, [source], stems)
+
+    lexicon = StemLexicon(path, [source])
+    assert all(lexicon.get(word) == stem for word, stem in stems.items())
+    lexicon.close()
+
+
+def test_changed_source_is_refused(tmp_path, source):
+    path = str(tmp_path / "lexicon.bin")
+    write_lexicon(path, [source], STEMS)
+
+    with open(source, "a", encoding="utf-8") as f:
+        f.write("kucing\n")
+
+    with pytest.raises(ValueError):
+        StemLexicon(path, [source])
+
+
+def test_other_version_is_refused(tmp_path, source, monkeypatch):
+    path = str(tmp_path / "lexicon.bin")
+    monkeypatch.setattr(stem_lexicon, "LEXICON_VERSION", stem_lexicon.LEXICON_VERSION - 1)
+    write_lexicon(path, [source], STEMS)
+    monkeypatch.undo()
+
+    with pytest.raises(ValueError):
+        StemLexicon(path, [source])
+
+
+@pytest.mark.parametrize("content", [b"", b"not a lexicon at all, just some text"])
+def test_foreign_file_is_refused(tmp_path, source, content):
+    path = tmp_path / "lexicon.bin"
+    path.write_bytes(content)
+
+    with pytest.raises(ValueError):
+        StemLexicon(str(path), [source])
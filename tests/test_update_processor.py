@@ -0,0 +1,88 @@
+import asyncio
+from datetime import datetime
+
+from telegram import Chat, Message, Update, User
+
+from update_processor import PerUserUpdateProcessor, get_update_key
+
+_update_ids = iter(range(1, 10**6))
+
+
+def make_update(user_id: int) -> Update:
+    update_id = next(_update_ids)
+    message = Message(
+        update_id, datetime.now(), Chat(user_id, Chat.PRIVATE), from_user=User(user_id, "User", False), text="hi"
+    )
+
+    return Update(update_id, message=message)
+
+
+async def process_all(processor: PerUserUpdateProcessor, updates: list, work) -> None:
+    # Every update gets its own task, like Application does with concurrent updates
+    await asyncio.gather(*(processor.process_update(update, work(update)) for update in updates))
+
+
+def test_update_key():
+    assert get_update_key(make_update(7)) == 7
+    assert get_update_key("not an update") is None
+
+
+def test_same_user_in_order_without_overlap():
+    processor = PerUserUpdateProcessor()
+    updates = [make_update(1) for _ in range(10)]
+    running, order = [], []
+
+    async def work(update):
+        running.append(update.update_id)
+        assert len(running) == 1
+        await asyncio.sleep(0.001)
+        order.append(update.update_id)
+        running.remove(update.update_id)
+
+    asyncio.run(process_all(processor, updates, work))
+
+    assert order == [update.update_id for update in updates]
+    assert processor._locks == {}
+
+
+def test_users_run_concurrently():
+    processor = PerUserUpdateProcessor()
+
+    async def main():
+        both = asyncio.Barrier(2)
+
+        async def work(update):
+            # Deadlocks (and times out) unless both users are processed at the same time
+            await asyncio.wait_for(both.wait(), 1)
+
+        await process_all(processor, [make_update(1), make_update(2)], work)
+
+    asyncio.run(main())
+
+
+def test_flooding_user_holds_one_slot():
+    processor = PerUserUpdateProcessor(max_concurrent_updates=2)
+    done = {}
+
+    async def main():
+        release = asyncio.Event()
+
+        async def work(update):
+            if update.effective_user.id == 1:
+                await release.wait()
+            done[update.update_id] = update.effective_user.id
+
+        flood = [make_update(1) for _ in range(20)]
+        tasks = [asyncio.create_task(processor.process_update(update, work(update))) for update in flood]
+        await asyncio.sleep(0.01)
+
+        # The flood waits on its user's lock, another user gets a slot right away
+        other = make_update(2)
+        await asyncio.wait_for(processor.process_update(other, work(other)), 1)
+        assert list(done.values()) == [2]
+
+        release.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert len(done) == 21
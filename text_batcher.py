@@ -0,0 +1,130 @@
+import asyncio
+import hashlib
+
+import moderation_pool
+from cache import LRUCache
+from model_handler import get_text_model_fingerprint, is_toxic_scores, predict_toxic_text_scores
+
+# Largest batch sent to the model in one forward pass
+MAX_BATCH_SIZE = 32
+
+# Batches running at once, one per moderation worker. Requests arriving while every worker is busy
+# are queued and go together in the next batch, a lone request starts right away
+MAX_IN_FLIGHT = moderation_pool.POOL_WORKERS["text"]
+
+# Scores of recently seen texts, and how long (seconds) they are kept
+TEXT_CACHE_SIZE = 8192
+TEXT_CACHE_TTL = 6 * 3600
+
+
+class TextBatcher:
+    """
+    Collects the text moderation requests made while the model is busy (up to max_batch_size)
+    and runs them through the model as a single batch. Scores of already seen texts are served
+    from an LRU cache, the thresholds are applied on lookup.
+    """
+
+    def __init__(
+        self,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_in_flight: int = MAX_IN_FLIGHT,
+        cache_size: int = TEXT_CACHE_SIZE,
+        cache_ttl: float = TEXT_CACHE_TTL,
+    ):
+        self.max_batch_size = max_batch_size
+        self.max_in_flight = max_in_flight
+        self.cache = LRUCache(maxsize=cache_size, ttl=cache_ttl)
+        self._fingerprint: str = None
+        self._pending: list[tuple[str, asyncio.Future]] = []
+        self._scheduled = False
+        self._tasks: set[asyncio.Task] = set()
+
+    def cache_key(self, text: str) -> tuple:
+        # Digest of the preprocessed text, scoped to the model files (also read by process pool workers)
+        if self._fingerprint is None:
+            self._fingerprint = get_text_model_fingerprint()
+
+        return self._fingerprint, hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    async def submit(self, text: str) -> tuple[bool | None, dict]:
+        """
+        Queue a text for moderation.
+        :param text: preprocessed text to analyze
+        :return: the verdict (True if toxic, None if the model timed out) and the per-category scores
+        """
+        # Repeated content costs a lookup instead of a forward pass
+        scores = self.cache.get(self.cache_key(text))
+        if scores is not None:
+            return is_toxic_scores(scores), scores
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+
+        self._schedule()
+
+        return await future
+
+    def get_cache_stats(self) -> dict:
+        # Hit/miss counters of the text scores cache
+        return self.cache.stats()
+
+    def _schedule(self) -> None:
+        # Start a batch on the next loop iteration if a worker is free, requests made meanwhile join it
+        if not self._scheduled and self._pending and len(self._tasks) < self.max_in_flight:
+            self._scheduled = True
+            asyncio.get_running_loop().call_soon(self._flush)
+
+    def _flush(self) -> None:
+        self._scheduled = False
+        batch = self._pending[:self.max_batch_size]
+        del self._pending[:self.max_batch_size]
+
+        if batch:
+            # Keep a reference to the task until it is done
+            task = asyncio.create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._done)
+
+        # Requests left over from a full batch use the next free worker
+        self._schedule()
+
+    def _done(self, task: asyncio.Task) -> None:
+        # Requests queued while the workers were busy form the next batch
+        self._tasks.discard(task)
+        self._schedule()
+
+    async def _run(self, batch: list[tuple[str, asyncio.Future]]) -> None:
+        # Identical texts of the same batch share one row of the forward pass
+        texts = list(dict.fromkeys(text for text, _ in batch))
+
+        try:
+            # The forward pass runs in the text lane of the moderation pool
+            result = await moderation_pool.run(predict_toxic_text_scores, texts, lane="text", default=None)
+
+        except Exception as e:
+            # Fail every request of the batch
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        # A timed out batch has no verdict, its texts are not relayed and not cached
+        if result is None:
+            for _, future in batch:
+                if not future.done():
+                    future.set_result((None, {}))
+            return
+
+        verdicts, scores = result
+        results = dict(zip(texts, zip(verdicts, scores)))
+        for text, (_, score) in results.items():
+            self.cache.set(self.cache_key(text), score)
+
+        for text, future in batch:
+            if not future.done():
+                future.set_result(results[text])
+
+
+# Shared batcher used by the moderation handlers
+text_batcher = TextBatcher()
@@ -0,0 +1,97 @@
+import csv
+import hashlib
+import marshal
+import os
+import struct
+import sys
+
+import Sastrawi.Stemmer
+
+# File layout: header, then the marshal-serialized stop words, slang dictionary and stemmer dictionary words
+BUNDLE_MAGIC = b"TXTRES01"
+BUNDLE_VERSION = 1
+HEADER = struct.Struct("<8sHHBB16s")  # magic, bundle version, marshal version, python major/minor, source digest
+
+# Sastrawi's own dictionary, read by StemmerFactory
+sastrawi_words_path = os.path.join(os.path.dirname(Sastrawi.Stemmer.__file__), "data", "kata-dasar.txt")
+
+# Values pandas.read_csv turns into NaN by default
+PANDAS_NA_VALUES = frozenset({
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+})
+
+
+def read_stop_words(path: str) -> frozenset:
+    # First column of the CSV, like pandas.read_csv(path, header=None)[0] without the NaN rows
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        return frozenset(row[0] for row in csv.reader(f) if row and row[0] not in PANDAS_NA_VALUES)
+
+
+def read_dictionary_words(path: str = sastrawi_words_path) -> list[str]:
+    # One word per line, blank entries are skipped like ArrayDictionary.add does
+    with open(path, encoding="utf-8") as f:
+        return [word for word in f.read().split("\n") if word and word.strip()]
+
+
+def source_digest(paths: list[str]) -> bytes:
+    # Size and modification time of every source file, editing a source invalidates the bundle
+    stats = []
+    for path in paths:
+        stat = os.stat(path)
+        stats.append(f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}")
+
+    return hashlib.blake2b("|".join(stats).encode("utf-8"), digest_size=16).digest()
+
+
+def make_header(sources: list[str]) -> bytes:
+    # marshal's format may change between Python versions, the bundle is only read by the one that wrote it
+    return HEADER.pack(
+        BUNDLE_MAGIC, BUNDLE_VERSION, marshal.version, *sys.version_info[:2], source_digest(sources)
+    )
+
+
+def write_bundle(
+    path: str, sources: list[str], stop_words: frozenset, slang_dict: dict, dictionary_words: list[str]
+) -> None:
+    """
+    Write the text preprocessing resources to a single file that read_bundle loads in one call.
+    :param path: destination file, replaced atomically
+    :param sources: files the resources were read from, checked for changes on load
+    :param stop_words: stop words
+    :param slang_dict: slang word -> replacement
+    :param dictionary_words: root words of the stemmer dictionary
+    """
+    payload = marshal.dumps((tuple(sorted(stop_words)), slang_dict, tuple(dictionary_words)))
+
+    with open(path + ".tmp", "wb") as f:
+        f.write(make_header(sources))
+        f.write(payload)
+
+    os.replace(path + ".tmp", path)
+
+
+def read_bundle(path: str, sources: list[str]) -> tuple[frozenset, dict, tuple]:
+    """
+    Load the resources written by write_bundle.
+    :param path: bundle file
+    :param sources: files the resources were read from
+    :return: the stop words, the slang dictionary and the stemmer dictionary words, None if the bundle
+        is missing, was written by another version or is older than its sources
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+
+    # Stale or foreign bundles are ignored, the caller parses the sources instead
+    try:
+        if data[:HEADER.size] != make_header(sources):
+            return None
+    except FileNotFoundError:
+        return None
+
+    stop_words, slang_dict, dictionary_words = marshal.loads(memoryview(data)[HEADER.size:])
+
+    return frozenset(stop_words), slang_dict, dictionary_words
@@ -0,0 +1,99 @@
+import mmap
+import os
+import struct
+import zlib
+
+from text_preprocess.resource_bundle import source_digest
+
+# File layout: header, open-addressing slot table (linear probing on crc32), then the UTF-8 words and stems
+LEXICON_MAGIC = b"STEMLEX1"
+LEXICON_VERSION = 2
+HEADER = struct.Struct("<8sH16sII")  # magic, lexicon version, source digest, slot count (power of two), entry count
+SLOT = struct.Struct("<IHH")  # file offset of the word (stem follows it), word length, stem length
+EMPTY_SLOT = 0xFFFFFFFF
+
+
+def write_lexicon(path: str, sources: list[str], stems: dict[str, str]) -> None:
+    """
+    Write a word -> stem lexicon that StemLexicon can memory-map.
+    :param path: destination file, replaced atomically
+    :param sources: files the stems depend on, checked for changes on load
+    :param stems: stem of every word
+    """
+    # At most half of the slots are used, so probe chains stay short
+    slot_count = 8
+    while slot_count < len(stems) * 2:
+        slot_count *= 2
+    mask = slot_count - 1
+
+    slots = [(EMPTY_SLOT, 0, 0)] * slot_count
+    strings = bytearray()
+    strings_offset = HEADER.size + SLOT.size * slot_count
+
+    for word, stem in sorted(stems.items()):
+        key, value = word.encode("utf-8"), stem.encode("utf-8")
+        i = zlib.crc32(key) & mask
+        while slots[i][0] != EMPTY_SLOT:
+            i = (i + 1) & mask
+
+        slots[i] = (strings_offset + len(strings), len(key), len(value))
+        strings += key + value
+
+    with open(path + ".tmp", "wb") as f:
+        f.write(HEADER.pack(LEXICON_MAGIC, LEXICON_VERSION, source_digest(sources), slot_count, len(stems)))
+        for slot in slots:
+            f.write(SLOT.pack(*slot))
+        f.write(strings)
+
+    os.replace(path + ".tmp", path)
+
+
+class StemLexicon:
+    """
+    Read-only word -> stem lookups on a memory-mapped lexicon file, built by model-creation/build_stem_lexicon.py.
+    A lexicon written by another version or older than its sources (the stemmer dictionary, the slang file)
+    is refused with a ValueError, its stems could differ from Sastrawi's.
+    """
+
+    def __init__(self, path: str, sources: list[str]):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._map) < HEADER.size:
+            self._map.close()
+            raise ValueError(f"{path} is not a stem lexicon")
+
+        magic, version, digest, slot_count, self.entry_count = HEADER.unpack_from(self._map, 0)
+        if magic != LEXICON_MAGIC:
+            self._map.close()
+            raise ValueError(f"{path} is not a stem lexicon")
+
+        if version != LEXICON_VERSION or digest != source_digest(sources):
+            self._map.close()
+            raise ValueError(f"{path} was built by another version or from older sources")
+
+        self._mask = slot_count - 1
+
+    def __len__(self) -> int:
+        return self.entry_count
+
+    def get(self, word: str) -> str:
+        """
+        :param word: normalized word
+        :return: its stem, None if the word is not in the lexicon
+        """
+        key = word.encode("utf-8")
+        i = zlib.crc32(key) & self._mask
+
+        while True:
+            offset, key_length, stem_length = SLOT.unpack_from(self._map, HEADER.size + i * SLOT.size)
+            if offset == EMPTY_SLOT:
+                return None
+
+            if key_length == len(key) and self._map[offset:offset + key_length] == key:
+                return self._map[offset + key_length:offset + key_length + stem_length].decode("utf-8")
+
+            i = (i + 1) & self._mask
+
+    def close(self) -> None:
+        self._map.close()
@@ -1,26 +1,89 @@
 import re
 import os
+import logging
 import string
 import json
-import pandas as pd
+import threading
+import itertools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 import emoji
-from Sastrawi.Stemmer.StemmerFactory import StemmerFactory
+from Sastrawi.Dictionary.ArrayDictionary import ArrayDictionary
+from Sastrawi.Stemmer.Cache.ArrayCache import ArrayCache
+from Sastrawi.Stemmer.CachedStemmer import CachedStemmer
+from Sastrawi.Stemmer.Stemmer import Stemmer
 
-# Load resources
-# Load slang word dictionary
-slang_path = os.path.join(os.path.dirname(__file__), "combined_slang_words.txt")
-with open(slang_path, "r") as f:
-    slang_dict = json.load(f)
+from text_preprocess.resource_bundle import read_bundle, read_dictionary_words, read_stop_words, sastrawi_words_path
+from text_preprocess.stem_lexicon import StemLexicon
 
-# Load stop words
+# Resources are loaded lazily by load_resources(), on first use or by the warm-up task
+slang_path = os.path.join(os.path.dirname(__file__), "combined_slang_words.txt")
 stop_words_path = os.path.join(os.path.dirname(__file__), "stopwordbahasa.csv")
-stop_words = pd.read_csv(stop_words_path, header=None)[0].tolist()
+slang_dict = None
+stop_words: frozenset = None
+stemmer = None
+
+# Compiled stop words, slang dictionary and stemmer dictionary, built by model-creation/build_text_resources.py (optional)
+resource_bundle_path = os.path.join(os.path.dirname(__file__), "resources.bin")
+resource_sources = [stop_words_path, slang_path, sastrawi_words_path]
+
+# Precomputed stems, built by model-creation/build_stem_lexicon.py (optional)
+stem_lexicon_path = os.path.join(os.path.dirname(__file__), "stem_lexicon.bin")
+stem_lexicon_sources = [slang_path, sastrawi_words_path]
+stem_lexicon: StemLexicon = None
+
+# Stems of recently seen words kept in memory, in front of the lexicon and Sastrawi
+STEM_CACHE_SIZE = 20000
+
+# Texts preprocessed per worker task by preprocess_texts
+PREPROCESS_CHUNK_SIZE = 1000
+resources_loaded = False
+_load_lock = threading.Lock()
+
+
+def load_resources():
+    """Load the slang dictionary, the stop words and the stemmer, only once."""
+    global slang_dict, stop_words, stemmer, stem_lexicon, resources_loaded
+
+    if resources_loaded:
+        return
+
+    with _load_lock:
+        if resources_loaded:
+            return
+
+        # Load the compiled resources, or parse the sources if the bundle is missing or stale
+        resources = read_bundle(resource_bundle_path, resource_sources)
+        if resources is None:
+            with open(slang_path, "r", encoding="utf-8") as f:
+                slang = json.load(f)
+            resources = read_stop_words(stop_words_path), slang, read_dictionary_words()
+
+        stop_words, slang_dict, dictionary_words = resources
+
+        # Initialize stemmer, the words are already filtered like ArrayDictionary.add does
+        dictionary = ArrayDictionary()
+        dictionary.words = dict(zip(dictionary_words, dictionary_words))
+        stemmer = CachedStemmer(ArrayCache(), Stemmer(dictionary))
+
+        # Memory-map the stem lexicon, if it was built, a stale one is ignored and every word goes to Sastrawi
+        if os.path.exists(stem_lexicon_path):
+            try:
+                stem_lexicon = StemLexicon(stem_lexicon_path, stem_lexicon_sources)
+            except ValueError as e:
+                logging.warning(f"Stem lexicon ignored: {e}, rebuild it with model-creation/build_stem_lexicon.py")
+
+        resources_loaded = True
 
-# Initialize stemmer
-factory = StemmerFactory()
-stemmer = factory.create_stemmer()
+# Patterns compiled once, shared by the single-pass engine
+url_pattern = re.compile(r"http\S+|www\S+|https\S+", flags=re.MULTILINE)
+punctuation_table = str.maketrans("", "", string.punctuation)
 
-# Functions for each preprocessing step
+# Sastrawi's TextNormalizer, applied by its stemmer before splitting the text into words
+stem_normalize_pattern = re.compile(r"[^a-z0-9 -]", flags=re.IGNORECASE | re.MULTILINE)
+
+# Functions for each preprocessing step, preprocess_text_reference chains them
 
 def lower_text(text):
     """Convert text to lowercase."""
@@ -64,9 +127,48 @@ def stem_text(text):
     """Stem the text using Sastrawi stemmer."""
     return stemmer.stem(text)
 
-# Combine all steps into one function
+@lru_cache(maxsize=STEM_CACHE_SIZE)
+def stem_word(word):
+    """Stem a single normalized word, from the lexicon when it is known, otherwise with Sastrawi."""
+    if stem_lexicon is not None:
+        stem = stem_lexicon.get(word)
+        if stem is not None:
+            return stem
+
+    return stemmer.delegatedStemmer.stem_word(word)
+
+def iter_stem_words(text):
+    """Yield the normalized words of the text that reach the stemmer, in order."""
+    load_resources()
+    for token in text.lower().split():
+        # URLs, punctuation (hashtag signs included) and non-ASCII characters (emoji included)
+        token = url_pattern.sub("", token).translate(punctuation_table)
+        token = token.encode("ascii", "ignore").decode("ascii")
+        if not token:
+            continue
+
+        # A slang word can be replaced by several words
+        for word in slang_dict.get(token, token).split():
+            if word in stop_words:
+                continue
+
+            # The stemmer's normalization may split a word further
+            for part in stem_normalize_pattern.sub(" ", word.lower()).split(" "):
+                if part:
+                    yield part
+
 def preprocess_text(text):
-    """Perform all preprocessing steps on the given text."""
+    """
+    Perform all preprocessing steps on the given text in a single pass over its words.
+    The output is identical to preprocess_text_reference.
+    """
+    load_resources()
+
+    return " ".join([stem_word(word) for word in iter_stem_words(text)])
+
+def preprocess_text_reference(text):
+    """Perform all preprocessing steps on the given text, one step after the other."""
+    load_resources()
     text = lower_text(text)
     text = remove_url(text)
     text = remove_punctuation(text)
@@ -78,3 +180,32 @@ def preprocess_text(text):
     text = remove_stop_words(text, stop_words)
     text = stem_text(text)
     return text
+
+def preprocess_chunk(texts):
+    """Preprocess a list of texts, in a preprocess_texts worker."""
+    return [preprocess_text(text) for text in texts]
+
+def preprocess_texts(texts, workers=1, chunk_size=PREPROCESS_CHUNK_SIZE):
+    """
+    Preprocess a stream of texts in input order, holding a few chunks in memory at a time.
+    With workers > 1 the chunks are spread over that many processes, twice as many chunks stay in flight.
+    """
+    texts = iter(texts)
+    chunks = iter(lambda: list(itertools.islice(texts, chunk_size)), [])
+
+    if workers <= 1:
+        for chunk in chunks:
+            yield from preprocess_chunk(chunk)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(preprocess_chunk, chunk))
+
+            # Bounded lookahead: wait for the oldest chunk once enough are queued
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+
+        while pending:
+            yield from pending.popleft().result()
@@ -1,77 +1,511 @@
+import asyncio
 import io
+import logging
 import os
+import time
+from collections.abc import Iterator
 
 basepath = os.path.dirname(os.path.abspath(__file__))
 os.environ["PATH"] += os.path.join(basepath, "bin") + ";"
 import lottie
+from lottie.exporters.svg import export_svg
 
-import imageio.v3 as iio
+# Direct rasterization of animated stickers (see TGS_DIRECT_RENDER)
+try:
+    import cairosvg.parser
+    import cairosvg.surface
+    has_cairosvg = True
+except (ImportError, OSError):
+    has_cairosvg = False
+
+import av
 from PIL import Image
-from telegram import Message
+from telegram import Message, PhotoSize
 from telegram.ext import ContextTypes
 
-from model_handler import predict_toxic_image, predict_toxic_text
-from text_preprocess.text_preprocessing import preprocess_text
+import async_db
+import moderation_pool
+from model_handler import (
+    NSFW_THRESHOLD,
+    get_nsfw_model_fingerprint,
+    load_models,
+    predict_nsfw_score,
+    predict_nsfw_scores,
+    predict_toxic_image,
+    predict_toxic_text_scores,
+)
+from text_batcher import text_batcher
+from text_preprocess.text_preprocessing import load_resources, preprocess_text
 
+# Input resolution of the NSFW classifier, smaller photo sizes are upscaled and lose detail
+PHOTO_MIN_SIDE = 224
 
-async def get_to_memory(context: ContextTypes.DEFAULT_TYPE, data) -> io.BytesIO:
-    # Download file from bot, saving as BytesIO
-    file = await context.bot.get_file(data)
-    out = io.BytesIO()
-    await file.download_to_memory(out)
-    out.seek(0)
+# Scores this close to NSFW_THRESHOLD are checked again on the next larger photo size
+PHOTO_UNCERTAINTY_BAND = 0.1
 
-    return io.BytesIO(out.read())
+# Frames of an animation or video sticker sent to the NSFW classifier, and how many per batch
+VIDEO_SAMPLED_FRAMES = 8
+VIDEO_BATCH_SIZE = 4
 
+# Decoding stops after this many frames (shared evenly by the sampled frames) or bytes of raw pixels,
+# whichever comes first
+VIDEO_MAX_DECODED_FRAMES = 300
+VIDEO_MAX_DECODED_BYTES = 256 * 2**20
 
-async def predict_toxicity(context: ContextTypes.DEFAULT_TYPE, message: Message) -> bool:
-    # Processing toxicity detection on message (text, gif, photo, sticker)
-    if message.text:
-        text = preprocess_text(message.text)
-        return predict_toxic_text(text)
+# Frames decoded and classified since startup (per worker process with the process pool)
+video_counters = {"clips": 0, "frames_decoded": 0, "frames_classified": 0}
 
-    if message.photo:
+# Frames of an animated sticker rendered for the NSFW classifier, at the classifier's resolution
+TGS_SAMPLED_FRAMES = 3
+TGS_RENDER_SIZE = 224
 
-        if message.caption:
-            text = preprocess_text(message.caption)
+# Rasterize animated stickers with cairosvg straight at TGS_RENDER_SIZE instead of lottie's full-size PNG export.
+# Off until benchmarks/tgs_render_benchmark.py has checked and timed it on a host with the cairo library
+TGS_DIRECT_RENDER = False
 
-            if predict_toxic_text(text):
-                return True
+# Bumped whenever the frames or photo sizes given to the NSFW classifier change, so older media scores are dropped
+MEDIA_SAMPLING_VERSION = 2
+_media_fingerprint: str = None
+
+# Largest download (bytes) and longest download time (seconds, once a download slot is free) allowed per media kind,
+# oversized or slow files are not moderated and not relayed, instead of exhausting memory
+MEDIA_LIMITS = {
+    "photo": (10 * 2**20, 15.0),
+    "animation": (20 * 2**20, 30.0),
+    "sticker": (2**20, 10.0),
+}
+
+# Downloads running at once for the whole bot
+MAX_CONCURRENT_DOWNLOADS = 8
+
+_download_slots: asyncio.Semaphore = None
+
+# Set once every moderation worker loaded and warmed up the models and preprocessing resources,
+# the bot process itself never preprocesses nor runs a model (see classify_text)
+moderation_ready = asyncio.Event()
+
+
+def load_moderation() -> None:
+    # Load models and resources, then run a dummy inference to warm up the kernels
+    load_resources()
+    load_models()
+    predict_toxic_text_scores([preprocess_text("halo apa kabar")])
+    predict_toxic_image(Image.new("RGB", (224, 224)))
+
+
+async def warm_up() -> None:
+    # Background warm-up, in every worker of every lane of the moderation pool
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(
+            *(
+                moderation_pool.run(load_moderation, lane=lane, timeout=None)
+                for lane, workers in moderation_pool.POOL_WORKERS.items()
+                for _ in range(workers)
+            )
+        )
+        logging.info(f"Moderation ready in {time.perf_counter() - start:.1f}s")
+
+    except Exception:
+        # Do not refuse chats forever, moderation retries loading on first use
+        logging.exception("Moderation warm-up failed")
+
+    moderation_ready.set()
+
+
+class BufferReader(io.RawIOBase):
+    """
+    Read-only, seekable file object over a downloaded buffer, so the decoders read it without a copy.
+    """
+
+    def __init__(self, buffer):
+        self._buffer = memoryview(buffer).cast("B")
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        size = max(0, min(len(b), len(self._buffer) - self._position))
+        b[:size] = self._buffer[self._position:self._position + size]
+        self._position += size
+
+        return size
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._buffer)
+        self._position = max(0, offset)
+
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+
+async def download(context: ContextTypes.DEFAULT_TYPE, media, timeout: float) -> bytearray:
+    # Download file from bot into a single buffer, a shared limit keeps one chat from taking every connection
+    global _download_slots
+
+    if _download_slots is None:
+        _download_slots = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+
+    # Waiting for a slot is queueing, only the download itself counts against the timeout
+    async with _download_slots:
+        async def fetch() -> bytearray:
+            file = await context.bot.get_file(media)
+
+            return await file.download_as_bytearray()
 
-        for i, photo in enumerate(message.photo):
-            if predict_toxic_image(await get_to_memory(context, photo)):
+        return await asyncio.wait_for(fetch(), timeout)
+
+
+async def first_toxic(*checks) -> bool | None:
+    # Run the checks of a message concurrently, the first toxic one cancels the others,
+    # None if nothing is toxic but a check could not be done
+    tasks = [asyncio.ensure_future(check) for check in checks]
+    verdict = False
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            toxic = await next_done
+            if toxic:
                 return True
 
-        return False
+            if toxic is None:
+                verdict = None
+
+        return verdict
+
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def get_to_memory(context: ContextTypes.DEFAULT_TYPE, media, kind: str) -> memoryview:
+    # Download within the limits of the media kind, None if the file is too large or too slow (it is not relayed)
+    max_bytes, timeout = MEDIA_LIMITS[kind]
+
+    # Reject from the metadata, before downloading anything
+    if media.file_size and media.file_size > max_bytes:
+        logging.warning(f"Refused {kind} {media.file_unique_id}: {media.file_size} bytes")
+        return None
+
+    try:
+        data = await download(context, media, timeout)
+
+    except asyncio.TimeoutError:
+        logging.warning(f"Refused {kind} {media.file_unique_id}: download took over {timeout}s")
+        return None
+
+    if len(data) > max_bytes:
+        logging.warning(f"Refused {kind} {media.file_unique_id}: {len(data)} bytes")
+        return None
+
+    return memoryview(data)
+
+
+# Blocking decode and classification steps, executed in the moderation pool
+
+def classify_image(data: memoryview) -> bool:
+    # Still image (photo, static sticker)
+    return predict_toxic_image(BufferReader(data))
+
+
+def score_image(data: memoryview) -> float:
+    # NSFW score of a photo size, escalation is decided by the caller
+    return predict_nsfw_score(BufferReader(data))
+
+
+def get_clip_span(
+    container: av.container.InputContainer, stream: av.video.stream.VideoStream
+) -> tuple[float, float, list]:
+    """
+    Start and duration of a clip, and where its keyframes are, read from the packets without decoding.
+    :param container: opened clip
+    :param stream: video stream of the clip
+    :return: the start and duration (seconds) and the keyframe timestamps (in stream.time_base units)
+    """
+    keyframes = []
+    first = last = None
+    for packet in container.demux(stream):
+        if packet.pts is None:
+            continue
+
+        if packet.is_keyframe:
+            keyframes.append(packet.pts)
+        end = packet.pts + (packet.duration or 0)
+        first = packet.pts if first is None else min(first, packet.pts)
+        last = end if last is None else max(last, end)
+
+    start = float(first * stream.time_base) if first is not None else 0.0
+    fps = float(stream.average_rate or 0)
+
+    # Containers without a duration (some webm) fall back to the stream's duration, frame count, or packets
+    if container.duration:
+        duration = container.duration / av.time_base
+    elif stream.duration:
+        duration = float(stream.duration * stream.time_base)
+    elif stream.frames and fps:
+        duration = stream.frames / fps
+    elif first is not None:
+        duration = float((last - first) * stream.time_base)
+    else:
+        duration = 0.0
+
+    return start, duration, sorted(keyframes)
+
+
+def sample_video_frames(data: memoryview) -> Iterator[Image.Image]:
+    # Decode lazily and yield up to VIDEO_SAMPLED_FRAMES frames evenly spaced in time, within the decoding caps
+    with av.open(BufferReader(data)) as container:
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+
+        start, duration, keyframes = get_clip_span(container, stream)
+        fps = float(stream.average_rate or 0)
+        targets = [start + duration * i / VIDEO_SAMPLED_FRAMES for i in range(VIDEO_SAMPLED_FRAMES)]
+
+        frames = None
+        position = None
+        decoded_frames = decoded_bytes = 0
+
+        for i, target in enumerate(targets):
+            # Jump to the last keyframe before the target when it lies ahead of the decoded frames,
+            # otherwise keep decoding forward: a repeated keyframe would only decode the same frames again
+            keyframe = max((pts for pts in keyframes if pts * stream.time_base <= target), default=None)
+            if frames is None or (keyframe is not None and keyframe * stream.time_base > position):
+                container.seek(keyframe if keyframe is not None else 0, stream=stream)
+                frames = container.decode(stream)
+
+            # The frames left are shared by the remaining targets, the budget of a target it reached early carries over
+            budget = (VIDEO_MAX_DECODED_FRAMES - decoded_frames) // (len(targets) - i)
+            if budget < 1:
+                return
+
+            for spent, frame in enumerate(frames, 1):
+                decoded_frames += 1
+                decoded_bytes += frame.width * frame.height * 3
+                video_counters["frames_decoded"] += 1
+                position = frame.time if frame.time is not None else target
+
+                if decoded_bytes >= VIDEO_MAX_DECODED_BYTES:
+                    return
+
+                # The first frame shown at the target time, or the latest one reached once the budget is spent
+                if position + 0.5 / (fps or 1) >= target or spent >= budget:
+                    # Shrink right away, the classifier works on 224x224 anyway
+                    image = frame.to_image()
+                    image.thumbnail((PHOTO_MIN_SIDE * 2, PHOTO_MIN_SIDE * 2))
+                    image.info["time"] = position
+                    yield image
+                    break
+
+            else:
+                # End of the stream
+                return
+
+
+def score_video(data: memoryview) -> float:
+    # GIF (mp4) or video sticker (webm), highest NSFW score of frames sampled across the whole clip
+    video_counters["clips"] += 1
+    score = 0.0
+    batch = []
+    for image in sample_video_frames(data):
+        batch.append(image)
+        if len(batch) < VIDEO_BATCH_SIZE:
+            continue
+
+        # Stop decoding at the first batch with an NSFW frame (the score is then a lower bound)
+        video_counters["frames_classified"] += len(batch)
+        score = max(score, *predict_nsfw_scores(batch))
+        if score > NSFW_THRESHOLD:
+            return score
+        batch = []
+
+    if batch:
+        video_counters["frames_classified"] += len(batch)
+        score = max(score, *predict_nsfw_scores(batch))
+
+    return score
+
+
+def render_tgs_frame(animation: lottie.objects.Animation, frame: float) -> Image.Image:
+    # One frame as a TGS_RENDER_SIZE image, rasterized directly without a PNG encode/decode round trip if enabled
+    if not (TGS_DIRECT_RENDER and has_cairosvg):
+        png = io.BytesIO()
+        lottie.exporters.cairo.export_png(animation, png, frame)
+        png.seek(0)
+        image = Image.open(png).convert("RGB")
+        image.thumbnail((TGS_RENDER_SIZE, TGS_RENDER_SIZE))
+
+        return image
+
+    svg = io.BytesIO()
+    export_svg(animation, svg, frame, pretty=False)
+    tree = cairosvg.parser.Tree(bytestring=svg.getvalue())
+    surface = cairosvg.surface.PNGSurface(
+        tree, None, 96, output_width=TGS_RENDER_SIZE, output_height=TGS_RENDER_SIZE
+    )
+
+    # Cairo's premultiplied ARGB32 pixels (B, G, R, A bytes on little-endian)
+    surface.cairo.flush()
+    image = Image.frombuffer(
+        "RGBA",
+        (surface.width, surface.height),
+        bytes(surface.cairo.get_data()),
+        "raw",
+        "BGRa",
+        surface.cairo.get_stride(),
+        1,
+    ).convert("RGB")
+    surface.finish()
+
+    return image
+
+
+def render_tgs(data: memoryview) -> list[Image.Image]:
+    # Animated sticker, TGS_SAMPLED_FRAMES frames evenly spaced over the animation
+    animation = lottie.parsers.tgs.parse_tgs(BufferReader(data))
+    first, last = animation.in_point, max(animation.in_point, animation.out_point - 1)
+
+    return [
+        render_tgs_frame(animation, first + (last - first) * i / max(1, TGS_SAMPLED_FRAMES - 1))
+        for i in range(TGS_SAMPLED_FRAMES)
+    ]
+
+
+def score_tgs(data: memoryview) -> float:
+    # Repeated stickers are answered from their stored media score and never rendered again
+    return max(predict_nsfw_scores(render_tgs(data)))
+
+
+def get_media_fingerprint() -> str:
+    # Classifier and sampling a stored media score comes from, computed once
+    global _media_fingerprint
+
+    if _media_fingerprint is None:
+        _media_fingerprint = "|".join(
+            (
+                get_nsfw_model_fingerprint(),
+                f"sampling:{MEDIA_SAMPLING_VERSION}",
+                f"photo:{PHOTO_MIN_SIDE}",
+                f"video:{VIDEO_SAMPLED_FRAMES}",
+                f"tgs:{TGS_SAMPLED_FRAMES}x{TGS_RENDER_SIZE}",
+            )
+        )
+
+    return _media_fingerprint
+
+
+async def classify_media(context: ContextTypes.DEFAULT_TYPE, media, kind: str, score_media, *args) -> bool | None:
+    # Media already scored (same file_unique_id) by the current classifier is resolved without download or inference
+    fingerprint = get_media_fingerprint()
+    score = await async_db.get_media_score(media.file_unique_id, fingerprint)
+    if score is not None:
+        return score > NSFW_THRESHOLD
+
+    # A refused download leaves the media unmoderated
+    data = await get_to_memory(context, media, kind)
+    if data is None:
+        return None
+
+    score = await moderation_pool.run(score_media, data, *args, default=None)
+
+    # A timed out classification is not stored and the media is not relayed
+    if score is None:
+        return None
+
+    await async_db.set_media_score(media.file_unique_id, score, fingerprint, len(data))
+
+    return score > NSFW_THRESHOLD
+
+
+def select_photo_sizes(photos: list[PhotoSize]) -> list[PhotoSize]:
+    # Sizes to try, from the smallest one covering the classifier's input up to the largest one
+    sizes = sorted(photos, key=lambda photo: photo.width * photo.height)
+    for i, photo in enumerate(sizes):
+        if min(photo.width, photo.height) >= PHOTO_MIN_SIDE:
+            return sizes[i:]
+
+    return sizes[-1:]
+
+
+async def classify_photo(context: ContextTypes.DEFAULT_TYPE, photos: list[PhotoSize]) -> bool | None:
+    # The score of a photo is stored under its largest size
+    largest = max(photos, key=lambda photo: photo.width * photo.height)
+    fingerprint = get_media_fingerprint()
+    score = await async_db.get_media_score(largest.file_unique_id, fingerprint)
+    if score is not None:
+        return score > NSFW_THRESHOLD
+
+    # One download and inference per photo, unless the score is too close to the threshold to trust
+    downloaded = 0
+    for photo in select_photo_sizes(photos):
+        data = await get_to_memory(context, photo, "photo")
+        if data is None:
+            return None
+
+        downloaded += len(data)
+        score = await moderation_pool.run(score_image, data, default=None)
+
+        # A timed out classification is not stored and the photo is not relayed
+        if score is None:
+            return None
+
+        if abs(score - NSFW_THRESHOLD) > PHOTO_UNCERTAINTY_BAND:
+            break
+
+    await async_db.set_media_score(largest.file_unique_id, score, fingerprint, downloaded)
+
+    return score > NSFW_THRESHOLD
+
+
+async def classify_text(text: str) -> bool | None:
+    # Preprocess (in the text lane, stemming is CPU-bound) and moderate a text or a caption, None on timeout
+    text = await moderation_pool.run(preprocess_text, text, lane="text", default=None)
+
+    # A timed out preprocessing leaves the text unmoderated
+    if text is None:
+        return None
+
+    toxic, _ = await text_batcher.submit(text)
+
+    return toxic
+
+
+async def predict_toxicity(context: ContextTypes.DEFAULT_TYPE, message: Message) -> bool | None:
+    # Processing toxicity detection on message (text, gif, photo, sticker), None if it could not be moderated
+    if message.text:
+        return await classify_text(message.text)
+
+    if message.photo:
+        # Caption and photo are checked at the same time
+        checks = [classify_photo(context, message.photo)]
+        if message.caption:
+            checks.append(classify_text(message.caption))
+
+        return await first_toxic(*checks)
     
     if message.animation:
-        file = await get_to_memory(context, message.animation)
-        frame = iio.imread(file, extension=".mp4", index=0)
-        image = Image.fromarray(frame)
-
-        return predict_toxic_image(image)
+        return await classify_media(context, message.animation, "animation", score_video)
 
     if message.sticker:
         sticker = message.sticker
 
-        if message.sticker.is_animated:
-            file = await get_to_memory(context, sticker)
-            animation = lottie.parsers.tgs.parse_tgs(file)
-
-            image = io.BytesIO()
-            lottie.exporters.cairo.export_png(animation, image)
-            image.seek(0)
+        # Stickers of allowlisted sets are not moderated
+        if sticker.set_name and await async_db.is_sticker_set_allowed(sticker.set_name):
+            return False
 
-            return predict_toxic_image(io.BytesIO(image.read()))
+        if message.sticker.is_animated:
+            return await classify_media(context, sticker, "sticker", score_tgs)
 
         elif message.sticker.is_video:
-            file = await get_to_memory(context, sticker)
-            frame = iio.imread(file, extension=".webm", index=0)
-            image = Image.fromarray(frame)
-
-            return predict_toxic_image(image)
+            return await classify_media(context, sticker, "sticker", score_video)
 
         else:
-            image = await get_to_memory(context, sticker)
-
-            return predict_toxic_image(image)
+            return await classify_media(context, sticker, "sticker", score_image)
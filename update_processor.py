@@ -0,0 +1,70 @@
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# Updates processed at once for the whole bot, further updates wait for a slot
+MAX_CONCURRENT_UPDATES = 256
+
+# Updates accepted at once (processed, or waiting for their user's previous updates or for a slot)
+MAX_PENDING_UPDATES = 16384
+
+
+def get_update_key(update: object) -> int:
+    # Updates of the same user (or of the same chat, without a user) are processed in order
+    if not isinstance(update, Update):
+        return None
+
+    if update.effective_user is not None:
+        return update.effective_user.id
+
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes the updates of different users concurrently, and the updates of a same user one by one
+    in arrival order. ConversationHandler keeps one state per user and relies on that user's updates
+    not overlapping, while one chat waiting on moderation no longer holds up every other chat.
+
+    BaseUpdateProcessor.process_update holds its semaphore for the whole do_process_update, so it only
+    bounds the accepted updates (max_pending_updates). The max_concurrent_updates processing slots are
+    taken once the user's turn has come: a user's queued updates wait without holding a slot, and a user
+    flooding the bot still gets a single one.
+    """
+
+    def __init__(
+        self, max_concurrent_updates: int = MAX_CONCURRENT_UPDATES, max_pending_updates: int = MAX_PENDING_UPDATES
+    ):
+        super().__init__(max(max_pending_updates, max_concurrent_updates))
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        # Lock of every user with updates running or waiting, and how many updates hold it
+        self._locks: dict[int, list] = {}
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        key = get_update_key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        # Tasks reach the lock in creation order and asyncio.Lock wakes its waiters first in, first out
+        slot = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        slot[1] += 1
+        try:
+            async with slot[0], self._slots:
+                await coroutine
+        finally:
+            # The entry is dropped with its last update
+            slot[1] -= 1
+            if not slot[1]:
+                del self._locks[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass